@@ -0,0 +1,63 @@
+"""Compare decoding a large result table row by row and column by column.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_decode [n_rows]
+"""
+import sys
+from timeit import default_timer as timer
+
+from azure.kusto.data.helpers import dataframe_from_result_table
+
+from kusto_tool.decode import arrow_from_result_table, decode_result_table
+from tests.fake_database import FakeKustoResultTable
+
+COLUMNS = [
+    ("Timestamp", "datetime"),
+    ("Duration", "timespan"),
+    ("Name", "string"),
+    ("Count", "long"),
+    ("Value", "real"),
+    ("Flag", "bool"),
+]
+
+
+def make_table(n_rows):
+    rows = [
+        [
+            f"2023-01-{i % 28 + 1:02d}T{i % 24:02d}:00:00.1234567Z",
+            f"{i % 7}.01:02:03.5",
+            f"name{i % 1000}",
+            i if i % 10 else None,
+            i / 3 if i % 10 else "NaN",
+            i % 2 == 0,
+        ]
+        for i in range(n_rows)
+    ]
+    return FakeKustoResultTable(COLUMNS, rows)
+
+
+def bench(name, func, table, repeat=3):
+    best = min(_time(func, table) for _ in range(repeat))
+    print(f"{name:<32}{best:>8.3f} s")
+
+
+def _time(func, table):
+    start = timer()
+    func(table)
+    return timer() - start
+
+
+def main(n_rows=1_000_000):
+    table = make_table(n_rows)
+    print(f"Decoding {n_rows} rows x {len(COLUMNS)} columns")
+    bench("dataframe_from_result_table", dataframe_from_result_table, table)
+    bench("decode_result_table", decode_result_table, table)
+    try:
+        bench("arrow_from_result_table", arrow_from_result_table, table)
+    except ImportError:
+        print("pyarrow is not installed, skipping arrow_from_result_table")
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:]])
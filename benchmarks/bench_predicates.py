@@ -0,0 +1,61 @@
+"""Time building and compiling filters with many terms, and the memory they use.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_predicates [n_terms]
+"""
+
+import sys
+import tracemalloc
+from functools import reduce
+from operator import or_
+from timeit import default_timer as timer
+
+from kusto_tool.database import KustoDatabase
+
+
+def table():
+    db = KustoDatabase("cluster", "db", offline=True)
+    return db.table("tbl", columns={"id": int, "name": str, "value": float})
+
+
+def isin(tbl, n_terms):
+    return tbl.where(tbl.id.isin(*range(n_terms)))
+
+
+def or_chain(tbl, n_terms):
+    return tbl.where(reduce(or_, (tbl.id == i for i in range(n_terms))))
+
+
+def predicates(tbl, n_terms):
+    return tbl.where(*[tbl.value != i for i in range(n_terms)]).extend(x=tbl.value)
+
+
+def bench(name, build, n_terms):
+    tbl = table()
+    start = timer()
+    expr = build(tbl, n_terms)
+    built = timer()
+    query = str(expr)
+    compiled = timer()
+    # Traced separately, since tracing slows building down.
+    tracemalloc.start()
+    expr = build(tbl, n_terms)
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(
+        f"{name:<16}{built - start:>8.3f} s{compiled - built:>10.3f} s"
+        f"{size / 2**20:>10.1f} MiB{len(query) / 2**20:>10.1f} MiB"
+    )
+
+
+def main(n_terms=100_000):
+    print(f"Filters with {n_terms} terms")
+    print(f"{'':<16}{'build':>10}{'compile':>12}{'memory':>14}{'query':>14}")
+    bench("isin", isin, n_terms)
+    bench("or chain", or_chain, n_terms)
+    bench("predicates", predicates, n_terms)
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:]])
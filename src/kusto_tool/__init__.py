@@ -3,5 +3,6 @@ __version__ = "0.4.2"
 
 from .database import Cluster, KustoDatabase, cluster
 from .expression import TableExpr
+from .options import QueryOptions
 
-__all__ = ["KustoDatabase", "Cluster", "cluster", "TableExpr"]
+__all__ = ["KustoDatabase", "Cluster", "cluster", "TableExpr", "QueryOptions"]
@@ -0,0 +1,57 @@
+"""Run independent queries concurrently on a bounded thread pool."""
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import as_completed as _as_completed
+
+DEFAULT_MAX_WORKERS = 8
+
+
+def _call(func):
+    """Call func, returning the exception instead of raising it."""
+    try:
+        return func()
+    except Exception as exc:  # pylint: disable=broad-except
+        return exc
+
+
+def _iter_completed(funcs, max_workers):
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    futures = {executor.submit(_call, func): i for i, func in enumerate(funcs)}
+    try:
+        for future in _as_completed(futures):
+            yield futures[future], future.result()
+    finally:
+        # If the caller stops iterating early, don't start the remaining calls.
+        for future in futures:
+            future.cancel()
+        executor.shutdown(wait=True)
+
+
+def run_many(funcs, max_workers=None, as_completed=False):
+    """Call zero-argument functions concurrently on a bounded thread pool.
+
+    An exception raised by one call does not stop the others; it is returned in
+    place of that call's result.
+
+    Parameters
+    ----------
+    funcs: Iterable[Callable]
+        The functions to call.
+    max_workers: int, default None
+        The maximum number of calls to run at once. Defaults to 8.
+    as_completed: bool, default False
+        If False, wait for all calls and return a list of results in input order.
+        If True, return an iterator of (index, result) pairs in completion order.
+
+    Returns
+    -------
+    list or Iterator[Tuple[int, Any]]
+        The results, or exceptions, of the calls.
+    """
+    funcs = list(funcs)
+    max_workers = max_workers or DEFAULT_MAX_WORKERS
+    if as_completed:
+        return _iter_completed(funcs, max_workers)
+    results = [None] * len(funcs)
+    for i, result in _iter_completed(funcs, max_workers):
+        results[i] = result
+    return results
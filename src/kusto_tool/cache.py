@@ -0,0 +1,421 @@
+"""Caches for query results."""
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import fields
+from datetime import timedelta
+from functools import partial
+from pathlib import Path
+
+import pandas as pd
+from loguru import logger
+
+from kusto_tool.parameters import parameter_value
+
+METADATA_KEY = b"kusto_tool"
+# QueryOptions fields that don't change a query's results, or that aren't sent
+# to the server.
+UNKEYED_OPTIONS = ("client_request_id", "application", "parameterize")
+
+
+def cache_key(cluster, database, query, parameters=None, options=None):
+    """A key identifying a query's results.
+
+    Parameters
+    ----------
+    cluster: str
+        The cluster name.
+    database: str
+        The database name.
+    query: str
+        The fully rendered query text.
+    parameters: Dict[str, Any], default None
+        The query parameters sent with the query, if any.
+    options: QueryOptions, default None
+        The request options sent with the query, if any. The client request
+        ID and application name don't change the results, so they are left
+        out.
+
+    Returns
+    -------
+    str
+        The hex SHA-256 digest of the cluster, database, query, parameters and
+        options.
+    """
+    text = "\n".join([str(cluster), str(database), query])
+    if parameters:
+        values = {name: parameter_value(val) for name, val in parameters.items()}
+        text = "\n".join([text, json.dumps(values, sort_keys=True)])
+    values = {} if options is None else _option_values(options)
+    if values:
+        text = "\n".join([text, json.dumps(values, sort_keys=True, default=str)])
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def _option_values(options):
+    """The request options that can change a query's results, by name."""
+    values = {}
+    for field in fields(options):
+        val = getattr(options, field.name)
+        if val is not None and field.name not in UNKEYED_OPTIONS:
+            values[field.name] = val
+    return values
+
+
+def _seconds(duration):
+    if isinstance(duration, timedelta):
+        return duration.total_seconds()
+    return duration
+
+
+def _copy_on_write():
+    """Whether pandas copies data lazily, so shallow copies can't share writes."""
+    if int(pd.__version__.split(".", maxsplit=1)[0]) >= 3:
+        return True
+    return pd.get_option("mode.copy_on_write") is True
+
+
+def _snapshot(df):
+    """A copy of df whose mutations never reach df, and vice versa."""
+    return df.copy(deep=not _copy_on_write())
+
+
+def _unlink(path):
+    """Delete a file, if it still exists."""
+    # Path.unlink(missing_ok=True) needs Python 3.8.
+    try:
+        path.unlink()
+    except FileNotFoundError:
+        pass
+
+
+class DiskCache:
+    """A directory of query results stored as parquet files.
+
+    Each entry is named by its cache key and records the cluster, database and
+    query that produced it in the parquet file's metadata. Entries expire after
+    a time to live, and the least recently used entries are evicted when the
+    directory grows past a size limit. Requires pyarrow.
+    """
+
+    def __init__(self, path, ttl=None, max_bytes=None, stale_while_revalidate=False):
+        """A directory of query results stored as parquet files.
+
+        Parameters
+        ----------
+        path: str or Path
+            The cache directory. It is created if it does not exist.
+        ttl: timedelta or float, default None
+            How long an entry stays fresh, as a timedelta or in seconds. If
+            None, entries never expire.
+        max_bytes: int, default None
+            The maximum total size of the cache directory. When it is exceeded,
+            the least recently used entries are deleted. If None, the cache can
+            grow without limit.
+        stale_while_revalidate: bool, default False
+            If True, an expired entry is returned immediately while the query is
+            re-run in a background thread to refresh it.
+        """
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.ttl = _seconds(ttl)
+        self.max_bytes = max_bytes
+        self.stale_while_revalidate = stale_while_revalidate
+        self._lock = threading.Lock()
+        self._refreshing = set()
+
+    def _entry(self, key):
+        return self.path / f"{key}.parquet"
+
+    def _is_fresh(self, entry):
+        if self.ttl is None:
+            return True
+        return time.time() - entry.stat().st_mtime < self.ttl
+
+    def get(self, key):
+        """Read an entry from the cache.
+
+        Parameters
+        ----------
+        key: str
+            The cache key.
+
+        Returns
+        -------
+        Tuple[pandas.DataFrame, bool] or None
+            The cached DataFrame and whether it is still fresh, or None if the
+            key is not in the cache.
+        """
+        # pylint: disable=import-outside-toplevel
+        import pyarrow.parquet as pq
+
+        entry = self._entry(key)
+        try:
+            fresh = self._is_fresh(entry)
+            df = pq.read_table(entry).to_pandas()
+            # Record the access time for LRU eviction; mtime stays the write time.
+            os.utime(entry, (time.time(), entry.stat().st_mtime))
+        except FileNotFoundError:
+            return None
+        return df, fresh
+
+    def metadata(self, key):
+        """The cluster, database and query stored with an entry, or None."""
+        # pylint: disable=import-outside-toplevel
+        import pyarrow.parquet as pq
+
+        try:
+            schema = pq.read_schema(self._entry(key))
+        except FileNotFoundError:
+            return None
+        return json.loads(schema.metadata[METADATA_KEY])
+
+    def put(self, key, df, **metadata):
+        """Write a DataFrame to the cache.
+
+        Parameters
+        ----------
+        key: str
+            The cache key.
+        df: pandas.DataFrame
+            The results to cache.
+        metadata: Dict[str, Any]
+            JSON-serializable values to store with the entry, such as the
+            cluster, database and query.
+        """
+        # pylint: disable=import-outside-toplevel
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        table = table.replace_schema_metadata(
+            {**(table.schema.metadata or {}), METADATA_KEY: json.dumps(metadata)}
+        )
+        fd, tmp_path = tempfile.mkstemp(dir=self.path, suffix=".tmp")
+        os.close(fd)
+        try:
+            pq.write_table(table, tmp_path)
+            os.replace(tmp_path, self._entry(key))
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        if self.max_bytes is not None:
+            self.evict()
+
+    def evict(self):
+        """Delete least recently used entries until the cache fits in max_bytes."""
+        with self._lock:
+            entries = []
+            for entry in self.path.glob("*.parquet"):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_atime, stat.st_size, entry))
+            total = sum(size for _, size, _ in entries)
+            for _, size, entry in sorted(entries, key=lambda e: e[0]):
+                if total <= self.max_bytes:
+                    break
+                logger.info("Evicting cached results {}", entry.name)
+                _unlink(entry)
+                total -= size
+
+    def clear(self):
+        """Delete every entry in the cache."""
+        for entry in self.path.glob("*.parquet"):
+            _unlink(entry)
+
+    def _store(self, key, df, metadata):
+        try:
+            self.put(key, df, **metadata)
+        except Exception as exc:  # pylint: disable=broad-except
+            # Results that can't be written as parquet are returned uncached.
+            logger.warning("Could not cache results {}: {}", key, exc)
+
+    def _refresh(self, key, load, metadata):
+        try:
+            self._store(key, load(), metadata)
+        except Exception as exc:  # pylint: disable=broad-except
+            logger.warning("Could not refresh cached results {}: {}", key, exc)
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
+
+    def _refresh_in_background(self, key, load, metadata):
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+        thread = threading.Thread(target=self._refresh, args=(key, load, metadata), daemon=True)
+        thread.start()
+
+    def fetch(self, key, load, **metadata):
+        """Get results from the cache, or load and cache them.
+
+        Parameters
+        ----------
+        key: str
+            The cache key.
+        load: Callable[[], pandas.DataFrame]
+            Called to get the results on a cache miss or expired entry.
+        metadata: Dict[str, Any]
+            JSON-serializable values to store with a new entry.
+
+        Returns
+        -------
+        pandas.DataFrame
+            The results.
+        """
+        cached = self.get(key)
+        if cached is not None:
+            df, fresh = cached
+            if fresh:
+                logger.info("Reading cached results {}", key)
+                return df
+            if self.stale_while_revalidate:
+                logger.info("Reading stale cached results {} while refreshing", key)
+                self._refresh_in_background(key, load, metadata)
+                return df
+        df = load()
+        self._store(key, df, metadata)
+        return df
+
+
+class MemoryCache:
+    """An in-process LRU cache of query results, bounded by memory use.
+
+    The size of each entry is its DataFrame's deep memory usage. Cached frames
+    are never handed out directly: callers get a copy-on-write view when pandas
+    copy-on-write is enabled, and a deep copy otherwise.
+    """
+
+    def __init__(self, max_bytes, ttl=None):
+        """An in-process LRU cache of query results, bounded by memory use.
+
+        Parameters
+        ----------
+        max_bytes: int
+            The maximum total memory usage of the cached DataFrames. The least
+            recently used entries are dropped to stay under it.
+        ttl: timedelta or float, default None
+            How long an entry stays fresh, as a timedelta or in seconds. If
+            None, entries never expire.
+        """
+        self.max_bytes = max_bytes
+        self.ttl = _seconds(ttl)
+        self.nbytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        """Read an entry from the cache.
+
+        Parameters
+        ----------
+        key: str
+            The cache key.
+
+        Returns
+        -------
+        pandas.DataFrame or None
+            A copy of the cached DataFrame, or None if the key is not cached or
+            has expired.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            df, size, created = entry
+            if self.ttl is not None and time.time() - created >= self.ttl:
+                del self._entries[key]
+                self.nbytes -= size
+                return None
+            self._entries.move_to_end(key)
+        return _snapshot(df)
+
+    def put(self, key, df, **metadata):  # pylint: disable=unused-argument
+        """Add a DataFrame to the cache.
+
+        A DataFrame larger than max_bytes is not cached.
+
+        Parameters
+        ----------
+        key: str
+            The cache key.
+        df: pandas.DataFrame
+            The results to cache.
+        """
+        size = int(df.memory_usage(index=True, deep=True).sum())
+        if size > self.max_bytes:
+            return
+        df = _snapshot(df)
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.nbytes -= old[1]
+            self._entries[key] = (df, size, time.time())
+            self.nbytes += size
+            while self.nbytes > self.max_bytes:
+                _, (_, evicted_size, _) = self._entries.popitem(last=False)
+                self.nbytes -= evicted_size
+
+    def clear(self):
+        """Drop every entry in the cache."""
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+
+    def fetch(self, key, load, **metadata):
+        """Get results from the cache, or load and cache them.
+
+        Parameters
+        ----------
+        key: str
+            The cache key.
+        load: Callable[[], pandas.DataFrame]
+            Called to get the results on a cache miss.
+        metadata: Dict[str, Any]
+            Ignored; accepted for compatibility with DiskCache.
+
+        Returns
+        -------
+        pandas.DataFrame
+            The results.
+        """
+        df = self.get(key)
+        if df is not None:
+            logger.info("Reading results {} from memory", key)
+            return df
+        df = load()
+        # put() stores its own copy, so the caller can keep this one.
+        self.put(key, df)
+        return df
+
+
+class TieredCache:
+    """Caches checked in order, e.g. a MemoryCache in front of a DiskCache.
+
+    A miss in one cache falls through to the next, and results found in a
+    later cache are copied into the earlier ones.
+    """
+
+    def __init__(self, *caches):
+        self.caches = caches
+
+    def clear(self):
+        """Clear every cache."""
+        for cache in self.caches:
+            cache.clear()
+
+    def fetch(self, key, load, **metadata):
+        """Get results from the first cache that has them, or load and cache them."""
+        for cache in reversed(self.caches):
+            load = partial(cache.fetch, key, load, **metadata)
+        return load()
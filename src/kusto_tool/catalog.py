@@ -0,0 +1,163 @@
+"""A cache of the table schemas in a Kusto database."""
+import json
+import os
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+from loguru import logger
+
+from kusto_tool.cache import _seconds
+from kusto_tool.expression import KTYPES
+
+
+def parse_cslschema(schema):
+    """Parse a CSL schema string such as "foo:string,bar:long".
+
+    Returns
+    -------
+    Dict[str, type]
+        Column types by column name.
+    """
+    if not schema:
+        return {}
+    columns = schema.split(",")
+    return {col.split(":")[0]: KTYPES[col.split(":")[1]] for col in columns}
+
+
+class SchemaCatalog:
+    """The table schemas of a database, fetched in one command and cached.
+
+    All table schemas are fetched at once with `.show database cslschema`,
+    kept in memory, and optionally saved to a JSON file so that later
+    processes can skip the fetch. Looking up a table that is not in the catalog refetches the
+    schemas once, so newly created tables are found.
+    """
+
+    def __init__(self, database, ttl=None, path=None):
+        """The table schemas of a database, fetched in one command and cached.
+
+        Parameters
+        ----------
+        database: KustoDatabase
+            The database to describe.
+        ttl: timedelta or float, default None
+            How long fetched schemas stay fresh, as a timedelta or in seconds.
+            If None, they never expire.
+        path: str or Path, default None
+            A JSON file to save the schemas to and load them from.
+        """
+        self.database = database
+        self.ttl = _seconds(ttl)
+        self.path = Path(path) if path is not None else None
+        self._schemas = None
+        self._fetched = None
+        self._lock = threading.Lock()
+
+    def _is_fresh(self, fetched):
+        return self.ttl is None or time.time() - fetched < self.ttl
+
+    def _load(self):
+        """Load schemas saved by an earlier process, if still fresh."""
+        try:
+            with open(self.path, "r", encoding="utf-8") as catalog_file:
+                saved = json.load(catalog_file)
+        except (FileNotFoundError, ValueError):
+            return False
+        if (
+            saved.get("cluster") != self.database.cluster
+            or saved.get("database") != self.database.database
+            or not self._is_fresh(saved["fetched"])
+        ):
+            return False
+        logger.info("Reading table schemas from {}", self.path)
+        self._schemas = saved["tables"]
+        self._fetched = saved["fetched"]
+        return True
+
+    def _save(self):
+        saved = {
+            "cluster": self.database.cluster,
+            "database": self.database.database,
+            "fetched": self._fetched,
+            "tables": self._schemas,
+        }
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.path.parent, suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as catalog_file:
+            json.dump(saved, catalog_file)
+        os.replace(tmp_path, self.path)
+
+    def refresh(self):
+        """Fetch all table schemas from the database.
+
+        Returns
+        -------
+        Dict[str, str]
+            CSL schema strings by table name.
+        """
+        result = self.database.execute(f".show database {self.database.database} cslschema")
+        schemas = {row.TableName: row.Schema for row in result.itertuples(index=False)}
+        with self._lock:
+            self._schemas = schemas
+            self._fetched = time.time()
+            if self.path is not None:
+                self._save()
+        return schemas
+
+    def invalidate(self):
+        """Forget the fetched schemas, so they are fetched again when next used."""
+        with self._lock:
+            self._schemas = None
+            self._fetched = None
+            if self.path is not None and self.path.exists():
+                self.path.unlink()
+
+    def _ensure(self):
+        """The schemas, fetched if missing or expired, and whether they were fetched."""
+        schemas, fetched = self._schemas, self._fetched
+        if schemas is not None and self._is_fresh(fetched):
+            return schemas, False
+        if self.path is not None and self._load():
+            return self._schemas, False
+        return self.refresh(), True
+
+    def schemas(self):
+        """All table schemas as CSL schema strings.
+
+        Returns
+        -------
+        Dict[str, str]
+            CSL schema strings by table name.
+        """
+        schemas, _ = self._ensure()
+        return dict(schemas)
+
+    def _schema(self, table):
+        """A table's CSL schema string, refetching once if the table is missing."""
+        schemas, fetched = self._ensure()
+        if table not in schemas and not fetched:
+            schemas = self.refresh()
+        return schemas.get(table)
+
+    def __contains__(self, table):
+        return self._schema(table) is not None
+
+    def columns(self, table):
+        """The columns of a table.
+
+        Parameters
+        ----------
+        table: str
+            The table name.
+
+        Returns
+        -------
+        Dict[str, type] or None
+            Column types by column name, or None if the table does not exist.
+        """
+        schema = self._schema(table)
+        if schema is None:
+            return None
+        return parse_cslschema(schema)
@@ -0,0 +1,112 @@
+"""A process-wide registry of Kusto clients shared by all databases on a cluster.
+
+Each KustoClient holds its own HTTP connection pool and its own credential, and
+acquiring a token with the Azure CLI starts a subprocess. Databases on the same
+cluster with the same auth mode therefore share one client from this registry.
+KustoClient is safe to use from several threads at once.
+"""
+import os
+import threading
+
+from azure.kusto.data import KustoClient, KustoConnectionStringBuilder
+
+AUTH_MODES = {
+    "az_cli": KustoConnectionStringBuilder.with_az_cli_authentication,
+    "device": KustoConnectionStringBuilder.with_aad_device_authentication,
+    "interactive": KustoConnectionStringBuilder.with_interactive_login,
+    "managed_identity": KustoConnectionStringBuilder.with_aad_managed_service_identity_authentication,
+}
+
+_clients = {}
+_lock = threading.Lock()
+
+
+class PooledKustoClient(KustoClient):
+    """A KustoClient with a configurable HTTP connection pool size."""
+
+    def __init__(self, kcsb, pool_size=None):
+        if pool_size is not None:
+            # KustoClient sizes its connection pool from this attribute.
+            self._max_pool_size = pool_size
+        super().__init__(kcsb)
+
+
+def connection_string(cluster_uri, auth="az_cli"):
+    """Build a connection string for a cluster and auth mode.
+
+    Parameters
+    ----------
+    cluster_uri: str
+        The cluster URI, e.g. https://help.kusto.windows.net
+    auth: str, default "az_cli"
+        One of "az_cli", "device", "interactive" or "managed_identity".
+
+    Returns
+    -------
+    KustoConnectionStringBuilder
+        The connection string.
+    """
+    try:
+        builder = AUTH_MODES[auth]
+    except KeyError as exc:
+        raise ValueError(f"auth must be one of {', '.join(AUTH_MODES)}.") from exc
+    return builder(cluster_uri)
+
+
+def get_client(cluster_uri, auth="az_cli", pool_size=None):
+    """Get the shared client for a cluster and auth mode, creating it if needed.
+
+    Parameters
+    ----------
+    cluster_uri: str
+        The cluster URI, e.g. https://help.kusto.windows.net
+    auth: str, default "az_cli"
+        One of "az_cli", "device", "interactive" or "managed_identity".
+    pool_size: int, default None
+        The maximum number of pooled HTTP connections. Only used when the
+        client is created; defaults to the Kusto SDK's default of 100.
+
+    Returns
+    -------
+    KustoClient
+        The shared client.
+    """
+    key = (cluster_uri, auth)
+    with _lock:
+        client = _clients.get(key)
+        if client is None:
+            client = PooledKustoClient(connection_string(cluster_uri, auth), pool_size=pool_size)
+            _clients[key] = client
+    return client
+
+
+def reset_clients(close=True):
+    """Forget all shared clients, so new ones are created when next needed.
+
+    Parameters
+    ----------
+    close: bool, default True
+        If True, close the clients' connections. Pass False in a forked child
+        process, whose inherited connections belong to the parent.
+    """
+    with _lock:
+        clients = list(_clients.values())
+        _clients.clear()
+    if close:
+        for client in clients:
+            client.close()
+
+
+def _reinit_after_fork():
+    """Give a forked child its own registry and lock.
+
+    The child can't use the connections or credentials inherited from the
+    parent, and the lock may have been held by another parent thread.
+    """
+    global _lock  # pylint: disable=global-statement
+    _lock = threading.Lock()
+    _clients.clear()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reinit_after_fork)
@@ -1,16 +1,102 @@
 """Classes for interacting with a Kusto database."""
+import json
 import os
+import tempfile
+import urllib.parse
 from collections.abc import KeysView
+from datetime import datetime
+from functools import lru_cache, partial
+from itertools import chain, islice
 from pathlib import Path
 from timeit import default_timer as timer
 
 import jinja2 as jj
+import numpy as np
 import pandas as pd
-from azure.kusto.data import KustoClient, KustoConnectionStringBuilder
+from azure.kusto.data.exceptions import KustoAioSyntaxError
 from azure.kusto.data.helpers import dataframe_from_result_table
+from azure.kusto.data.response import KustoResultTable
 from loguru import logger
 
-from kusto_tool.expression import KTYPES, TableExpr, quote
+from kusto_tool.batch import run_many
+from kusto_tool.cache import METADATA_KEY, cache_key
+from kusto_tool.catalog import SchemaCatalog
+from kusto_tool.clients import AUTH_MODES, connection_string, get_client
+from kusto_tool.decode import arrow_from_result_table
+from kusto_tool.events import QueryEvent, emit, install_response_hook
+from kusto_tool.expression import TableExpr, quote
+from kusto_tool.options import merge_options, server_cache_hit
+from kusto_tool.parameters import declare, set_parameters, split_parameters
+from kusto_tool.partition import (
+    DEFAULT_TARGET_SECONDS,
+    DEFAULT_WINDOW,
+    MIN_WINDOW,
+    concat_windows,
+    iter_windows,
+)
+
+
+# Shared by every rendered query so that each template source is compiled once.
+_JINJA_ENV = jj.Environment()
+_PRECOMPILED = {}
+TEMPLATE_CACHE_SIZE = 1024
+
+
+@lru_cache(maxsize=TEMPLATE_CACHE_SIZE)
+def _compile_cached(source):
+    return _JINJA_ENV.from_string(source)
+
+
+def compile_template(source) -> jj.Template:
+    """Compile a Jinja2 query template, reusing the compiled template for the
+    same source.
+
+    Templates precompiled with `load_templates` are always reused; others are
+    kept in a least-recently-used cache of the last 1024 template sources.
+
+    Parameters
+    ----------
+    source: str
+        The template text.
+
+    Returns
+    -------
+    jinja2.Template
+        The compiled template.
+    """
+    template = _PRECOMPILED.get(source)
+    if template is None:
+        template = _compile_cached(source)
+    return template
+
+
+def load_templates(directory, pattern="*.kql"):
+    """Precompile every query template file in a directory.
+
+    Afterwards, executing any of these files (or the same query text) skips
+    Jinja2 compilation. Call this once at startup.
+
+    Parameters
+    ----------
+    directory: str or Path
+        The directory containing template files.
+    pattern: str, default "*.kql"
+        A glob pattern selecting the template files. Use "**/*.kql" to include
+        subdirectories.
+
+    Returns
+    -------
+    Dict[Path, jinja2.Template]
+        The compiled templates by file path.
+    """
+    templates = {}
+    for path in sorted(Path(directory).glob(pattern)):
+        source = path.read_text(encoding="utf-8")
+        template = _PRECOMPILED.get(source) or _JINJA_ENV.from_string(source)
+        _PRECOMPILED[source] = template
+        templates[path] = template
+    logger.info("Precompiled {} templates from {}.", len(templates), directory)
+    return templates
 
 
 def list_to_kusto(lst):
@@ -25,7 +111,7 @@ def dict_to_datatable(dictionary: dict) -> str:
     template = """datatable(key: string, value: string)[
     {{ dict_str }}
 ]"""
-    stmt = jj.Template(template).render(dict_str=dict_str)
+    stmt = compile_template(template).render(dict_str=dict_str)
     return stmt
 
 
@@ -46,7 +132,47 @@ def render_template_query(query, *args, **kwargs) -> str:
         k: list_to_kusto(v) if isinstance(v, (list, tuple, set, KeysView)) else v
         for k, v in kwargs.items()
     }
-    return jj.Template(query).render(*args, **converted_kwargs)
+    return compile_template(query).render(*args, **converted_kwargs)
+
+
+def render_parameterized_query(query, *args, parameterize=True, parameters=None, **kwargs):
+    """Render a query with its template parameters sent as query parameters.
+
+    Template parameters that are sent as query parameters render as their
+    names, and the query is prefixed with a `declare query_parameters`
+    statement declaring them.
+
+    Parameters
+    ----------
+    query: str
+        The query template, or a path to a file containing one.
+    parameterize: bool or Collection[str], default True
+        If True, send every template parameter that can be a query parameter
+        as one. If a collection of names, only send those. If False, only send
+        `parameters`.
+    parameters: Dict[str, Any], default None
+        Further query parameters to declare and send, by name.
+    args: List[Any]
+        Positional arguments to pass to the query as Jinja2 template params.
+    kwargs: Dict[Any]
+        Keyword arguments to pass to the query as Jinja2 template params.
+
+    Returns
+    -------
+    Tuple[str, Dict[str, Any]]
+        The rendered query and its query parameters.
+    """
+    parameters = dict(parameters or {})
+    if parameterize:
+        names = None if parameterize is True else set(parameterize)
+        kwargs, template_parameters = split_parameters(kwargs, names)
+        parameters = {**template_parameters, **parameters}
+    query_rendered = render_template_query(query, *args, **kwargs)
+    if not parameters:
+        return query_rendered, parameters
+    if query_rendered.startswith("."):
+        raise ValueError("Management commands can't take query parameters.")
+    return declare(parameters) + query_rendered, parameters
 
 
 def render_set(query, table, folder, docstring, *args, replace=False, **kwargs) -> str:
@@ -73,10 +199,176 @@ docstring = "{{ docstring }}",
     return command_rendered
 
 
+DEFAULT_CHUNK_ROWS = 100_000
+
+
+def _chunk_table(table, rows):
+    """Wrap a slice of a streaming result table's rows as a KustoResultTable."""
+    return KustoResultTable(
+        {"TableName": table.table_name, "Columns": table.raw_columns, "Rows": rows}
+    )
+
+
+def write_parquet(tables, path, row_group_size=DEFAULT_CHUNK_ROWS, metadata=None, **options):
+    """Write a stream of pyarrow Tables to one parquet file, atomically.
+
+    The tables are written as they arrive to a temporary file in the same
+    directory, which replaces path only once every table has been written.
+
+    Parameters
+    ----------
+    tables: Iterable[pyarrow.Table]
+        Tables with the same schema. The first table's schema is the file's.
+    path: str or Path
+        The parquet file to write.
+    row_group_size: int, default 100000
+        The maximum number of rows in each row group.
+    metadata: Callable[[], Dict[str, str]], default None
+        Called after the last table is written; the key-value metadata it
+        returns is added to the file.
+    options: Dict[str, Any]
+        Options for pyarrow.parquet.ParquetWriter, such as compression.
+
+    Returns
+    -------
+    int
+        The number of rows written.
+    """
+    # pylint: disable=import-outside-toplevel
+    import pyarrow.parquet as pq
+
+    path = Path(path)
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+    os.close(fd)
+    writer = None
+    n_rows = 0
+    try:
+        for table in tables:
+            if writer is None:
+                writer = pq.ParquetWriter(tmp_path, table.schema, **options)
+            writer.write_table(table, row_group_size=row_group_size)
+            n_rows += table.num_rows
+        if writer is None:
+            raise ValueError("No tables to write.")
+        if metadata is not None:
+            writer.add_key_value_metadata(metadata())
+        writer.close()
+        # mkstemp creates the file readable only by its owner.
+        os.chmod(tmp_path, _file_mode())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if writer is not None:
+            writer.close()
+        os.unlink(tmp_path)
+        raise
+    logger.info("Wrote {} rows to {}.", n_rows, path)
+    return n_rows
+
+
+def _file_mode():
+    """The permissions of a newly created file under the process's umask."""
+    umask = os.umask(0)
+    os.umask(umask)
+    return 0o666 & ~umask
+
+
+HIVE_NULL = "__HIVE_DEFAULT_PARTITION__"
+
+
+def _partition_dir(columns, values):
+    """The relative hive-style directory of a partition, e.g. Date=2023-01-01."""
+    parts = []
+    for column, value in zip(columns, values):
+        if pd.isna(value):
+            text = HIVE_NULL
+        elif isinstance(value, datetime):
+            text = value.isoformat()
+        else:
+            text = str(value)
+        parts.append(f"{column}={urllib.parse.quote(text, safe='')}")
+    return Path(*parts)
+
+
+def _partition_filter(columns, values):
+    """A Kusto predicate selecting the rows of a partition."""
+    terms = []
+    for column, value in zip(columns, values):
+        if pd.isna(value):
+            terms.append(f"isnull({column})")
+        elif isinstance(value, (bool, np.bool_)):
+            terms.append(f"{column} == {str(bool(value)).lower()}")
+        else:
+            terms.append(f"{column} == {quote(value)}")
+    return " and ".join(terms)
+
+
+INGESTION_TIME = "ingestion_time()"
+INGESTION_TIME_COLUMN = "_ingestion_time"
+
+
+def _watermarks(path):
+    """The part files of an incremental dataset, and its current watermark."""
+    # pylint: disable=import-outside-toplevel
+    import pyarrow.parquet as pq
+
+    parts = sorted(Path(path).glob("part-*.parquet"))
+    watermark = None
+    for part in parts:
+        saved = pq.read_metadata(part).metadata or {}
+        if METADATA_KEY in saved:
+            part_watermark = pd.Timestamp(json.loads(saved[METADATA_KEY])["watermark"])
+            watermark = part_watermark if watermark is None else max(watermark, part_watermark)
+    return parts, watermark
+
+
+class _WatermarkTracker:
+    """Passes tables through, keeping the maximum value of a datetime column."""
+
+    def __init__(self, tables, column):
+        self.tables = tables
+        self.column = column
+        self.watermark = None
+
+    def __iter__(self):
+        # pylint: disable=import-outside-toplevel
+        import pyarrow.compute as pc
+
+        for table in self.tables:
+            value = pc.max(table[self.column]).as_py()
+            if value is not None:
+                value = pd.Timestamp(value)
+                self.watermark = value if self.watermark is None else max(self.watermark, value)
+            yield table
+
+    def metadata(self):
+        watermark = None if self.watermark is None else self.watermark.isoformat()
+        return {METADATA_KEY: json.dumps({"column": self.column, "watermark": watermark})}
+
+
+def _select_method(client, query):
+    """Pick the client method to run a query or a management command."""
+    return client.execute_mgmt if query.startswith(".") else client.execute_query
+
+
 class KustoDatabase:
     """A class representing a Kusto database."""
 
-    def __init__(self, cluster, database, client=None):
+    def __init__(
+        self,
+        cluster,
+        database,
+        client=None,
+        async_client=None,
+        decoder=None,
+        cache=None,
+        schema_ttl=None,
+        schema_path=None,
+        auth="az_cli",
+        pool_size=None,
+        offline=False,
+        hooks=None,
+        options=None,
+    ):
         """A class representing a Kusto database.
 
         Parameters
@@ -86,13 +378,95 @@ class KustoDatabase:
         database: str
             The database name.
         client: KustoClient, default None
-            Pass this if you wish to provide your own KustoClient.
+            Pass this if you wish to provide your own KustoClient. Otherwise the
+            client shared by all databases on the cluster with the same auth
+            mode is used (see `kusto_tool.clients`), and it and its credential
+            are only created when the first query is executed.
+        async_client: azure.kusto.data.aio.KustoClient, default None
+            Pass this if you wish to provide your own asynchronous KustoClient.
+            Otherwise one is created on the first call to `execute_async`.
+        decoder: Callable[[KustoResultTable], pandas.DataFrame], default None
+            The function used to convert result tables to DataFrames. Defaults
+            to the Kusto SDK's `dataframe_from_result_table`; pass
+            `kusto_tool.decode.decode_result_table` for faster columnar decoding.
+        cache: DiskCache, MemoryCache or TieredCache, default None
+            If provided, query results from `execute` and `TableExpr.collect`
+            are read from and saved to this cache (see `kusto_tool.cache`).
+            Management commands are never cached.
+        schema_ttl: timedelta or float, default None
+            How long table schemas fetched for `table(..., inspect=True)` and
+            `table_exists` are reused, as a timedelta or in seconds. If None,
+            they are reused until a management command changes the database.
+        schema_path: str or Path, default None
+            A JSON file to persist fetched table schemas to, so that other
+            processes can reuse them within schema_ttl.
+        auth: str, default "az_cli"
+            How to authenticate: "az_cli", "device", "interactive" or
+            "managed_identity".
+        pool_size: int, default None
+            The maximum number of pooled HTTP connections of the shared client,
+            if this database is the first to use it.
+        offline: bool, default False
+            If True, the database is only used to compile query expressions,
+            and executing anything raises a RuntimeError instead of connecting.
+        hooks: List[Callable[[QueryEvent], None]], default None
+            Functions called with a `kusto_tool.events.QueryEvent` after each
+            query executes, with the time spent in each stage of the execution.
+        options: QueryOptions, default None
+            Request options for every query on this database, such as the
+            server results cache age. Options given to an expression or a call
+            override these.
         """
         self.cluster = cluster
         self.cluster_uri = f"https://{cluster}.kusto.windows.net"
         self.database = database
-        kcsb = KustoConnectionStringBuilder.with_az_cli_authentication(self.cluster_uri)
-        self.client = client or KustoClient(kcsb)
+        if auth not in AUTH_MODES:
+            raise ValueError(f"auth must be one of {', '.join(AUTH_MODES)}.")
+        self.auth = auth
+        self.pool_size = pool_size
+        self.offline = offline
+        self._client = client
+        self._async_client = async_client
+        self.decoder = decoder or dataframe_from_result_table
+        self.cache = cache
+        self.catalog = SchemaCatalog(self, ttl=schema_ttl, path=schema_path)
+        self.hooks = list(hooks or [])
+        self.options = options
+
+    @property
+    def client(self):
+        """The KustoClient, fetched from the shared registry on first use."""
+        if self._client is None:
+            self._check_online()
+            self._client = get_client(self.cluster_uri, auth=self.auth, pool_size=self.pool_size)
+        return self._client
+
+    @client.setter
+    def client(self, client):
+        self._client = client
+
+    def _check_online(self):
+        if self.offline:
+            raise RuntimeError(f"{self} is offline and can't execute queries.")
+
+    @property
+    def async_client(self):
+        """The asynchronous KustoClient, created on first use.
+
+        The aio client opens its HTTP session in the running event loop, so it
+        should be first used from inside the loop that will keep using it.
+        """
+        if self._async_client is None:
+            self._check_online()
+            try:
+                # pylint: disable=import-outside-toplevel
+                from azure.kusto.data.aio import KustoClient as AsyncKustoClient
+            except (ImportError, KustoAioSyntaxError) as exc:
+                raise ImportError(
+                    "Async execution requires aiohttp: pip install kusto-tool[aio]"
+                ) from exc
+            self._async_client = AsyncKustoClient(connection_string(self.cluster_uri, self.auth))
+        return self._async_client
 
     def table(self, name, columns=None, inspect=False):
         """A tabular expression.
@@ -109,6 +483,8 @@ class KustoDatabase:
         inspect: bool, default False
             If true, columns will be inspected from the database. If columns
             list is provided and inspect is true, inspect takes precedence.
+            Schemas of all tables are fetched together on first use and
+            reused, see `KustoDatabase.catalog`.
 
         Returns
         -------
@@ -116,15 +492,12 @@ class KustoDatabase:
             A table expression instance.
         """
         if inspect:
-            columns = self.execute(f".show table {name} cslschema").Schema
-            if len(columns) < 1:
+            columns = self.catalog.columns(name)
+            if columns is None:
                 raise KeyError(f"Table {name} does not exist in the database.")
-            columns = columns.item()
-            columns = columns.split(",")
-            columns = {col.split(":")[0]: KTYPES[col.split(":")[1]] for col in columns}
         return TableExpr(name, database=self, columns=columns)
 
-    def execute(self, query: str, *args, **kwargs):
+    def execute(self, query: str, *args, options=None, parameters=None, **kwargs):
         """Execute a query or command.
 
         Parameters
@@ -132,6 +505,10 @@ class KustoDatabase:
         query: str
             The text of the Kusto query or command to run. Can also be a path to
             a file containing a query.
+        options: QueryOptions, default None
+            Request options for this call, overriding the database's options.
+        parameters: Dict[str, Any], default None
+            Query parameters to declare and send with the query, by name.
         args: List[Any]
             Positional arguments to pass to the query as Jinja2 template params.
         kwargs: Dict[Any]
@@ -142,21 +519,362 @@ class KustoDatabase:
         pandas.DataFrame
             A DataFrame containing the query results.
         """
-        query = maybe_read_file(query)
-        query_rendered = render_template_query(query, *args, **kwargs)
+        event = QueryEvent(self.cluster, self.database, query)
+        try:
+            query_rendered, parameters = self._render(
+                event, query, *args, options=options, parameters=parameters, **kwargs
+            )
+            df = self._execute_cached(query_rendered, event, options, parameters)
+            event.result(df)
+            return df
+        except Exception as exc:
+            event.error = exc
+            raise
+        finally:
+            self._emit(event)
 
-        method = (
-            self.client.execute_mgmt
-            if query_rendered.startswith(".")
-            else self.client.execute_query
+    def _render(self, event, query, *args, options=None, parameters=None, **kwargs):
+        """Read and render a query, timing both stages of the event.
+
+        Returns the rendered query and its query parameters.
+        """
+        with event.stage("read_file"):
+            query = maybe_read_file(query)
+        with event.stage("render"):
+            merged = merge_options(self.options, options)
+            parameterize = merged is not None and merged.parameterize
+            if parameterize or parameters:
+                query_rendered, parameters = render_parameterized_query(
+                    query, *args, parameterize=parameterize, parameters=parameters, **kwargs
+                )
+            else:
+                query_rendered = render_template_query(query, *args, **kwargs)
+        event.query = query_rendered
+        return query_rendered, parameters
+
+    def _execute_cached(self, query_rendered, event=None, options=None, parameters=None):
+        """Run a rendered query or command, through the results cache if any."""
+        if query_rendered.startswith("."):
+            if not query_rendered.startswith(".show"):
+                # Commands may create, alter or drop tables.
+                self.catalog.invalidate()
+            return self._execute_rendered(query_rendered, event, options)
+        if self.cache is None:
+            return self._execute_rendered(query_rendered, event, options, parameters)
+        return self.cache.fetch(
+            cache_key(
+                self.cluster,
+                self.database,
+                query_rendered,
+                parameters,
+                merge_options(self.options, options),
+            ),
+            partial(self._execute_rendered, query_rendered, event, options, parameters),
+            cluster=self.cluster,
+            database=self.database,
+            query=query_rendered,
         )
+
+    def _properties(self, options=None, parameters=None):
+        """The client request properties for the database's options merged
+        with a call's options, and any query parameters, or None if there are
+        neither options nor parameters."""
+        options = merge_options(self.options, options)
+        properties = None if options is None else options.properties()
+        if parameters:
+            properties = set_parameters(properties, parameters)
+        return properties
+
+    def _execute_rendered(self, query_rendered, event=None, options=None, parameters=None):
+        """Run a rendered query or command on the cluster."""
+        if event is None:
+            event = QueryEvent(self.cluster, self.database, query_rendered)
+        client = self.client
+        install_response_hook(client)
+        method = _select_method(client, query_rendered)
         logger.info("Executing query on {}: {}", self.database, query_rendered)
         start_time = timer()
-        result = method(self.database, query_rendered)
+        with event.request():
+            result = method(self.database, query_rendered, self._properties(options, parameters))
         end_time = timer()
         duration = end_time - start_time
         logger.info("Query execution completed in {:.2f} seconds.", duration)
-        return dataframe_from_result_table(result.primary_results[0])
+        event.server_cache_hit = server_cache_hit(result)
+        with event.stage("convert"):
+            df = self.decoder(result.primary_results[0])
+        df.attrs["server_cache_hit"] = event.server_cache_hit
+        return df
+
+    def _emit(self, event):
+        if self.hooks:
+            emit(self.hooks, event)
+
+    def add_hook(self, hook):
+        """Call a function with a `kusto_tool.events.QueryEvent` after each
+        query executes.
+
+        Parameters
+        ----------
+        hook: Callable[[QueryEvent], None]
+            The function to call. Exceptions it raises are logged and ignored.
+        """
+        self.hooks.append(hook)
+
+    def remove_hook(self, hook):
+        """Stop calling a function added with `add_hook`."""
+        self.hooks.remove(hook)
+
+    def execute_iter(
+        self,
+        query: str,
+        *args,
+        chunk_rows=DEFAULT_CHUNK_ROWS,
+        options=None,
+        parameters=None,
+        **kwargs,
+    ):
+        """Execute a query and iterate over its results in fixed-size chunks.
+
+        Rows are read from a streaming response as they arrive, so at most one
+        chunk of rows is held in memory at a time, no matter how large the
+        result is. Management commands can't be streamed; use `execute`.
+
+        Parameters
+        ----------
+        query: str
+            The text of the Kusto query to run. Can also be a path to a file
+            containing a query.
+        chunk_rows: int, default 100000
+            The maximum number of rows in each DataFrame chunk.
+        options: QueryOptions, default None
+            Request options for this call, overriding the database's options.
+        parameters: Dict[str, Any], default None
+            Query parameters to declare and send with the query, by name.
+        args: List[Any]
+            Positional arguments to pass to the query as Jinja2 template params.
+        kwargs: Dict[Any]
+            Keyword arguments to pass to the query as Jinja2 template params.
+
+        Yields
+        ------
+        pandas.DataFrame
+            DataFrames of up to chunk_rows rows each. A query that returns no
+            rows yields one empty DataFrame with the result's columns.
+        """
+        if chunk_rows < 1:
+            raise ValueError("chunk_rows must be a positive integer.")
+        event = QueryEvent(self.cluster, self.database, query)
+        try:
+            query_rendered, parameters = self._render(
+                event, query, *args, options=options, parameters=parameters, **kwargs
+            )
+            if query_rendered.startswith("."):
+                raise ValueError("Management commands can't be streamed, use execute() instead.")
+            event.rows = 0
+            stream = self._stream_rendered(query_rendered, chunk_rows, event, options, parameters)
+            for table in stream:
+                with event.stage("convert"):
+                    df = self.decoder(table)
+                event.rows += len(df)
+                event.columns = len(df.columns)
+                yield df
+        except Exception as exc:
+            event.error = exc
+            raise
+        finally:
+            self._emit(event)
+
+    def _stream_rendered(
+        self, query_rendered, chunk_rows, event=None, options=None, parameters=None
+    ):
+        """Stream a rendered query's results as result tables of up to
+        chunk_rows rows. A query that returns no rows yields one empty table."""
+        if event is None:
+            event = QueryEvent(self.cluster, self.database, query_rendered)
+        logger.info("Streaming query on {}: {}", self.database, query_rendered)
+        start_time = timer()
+        with event.stage("network"):
+            response = self.client.execute_streaming_query(
+                self.database, query_rendered, properties=self._properties(options, parameters)
+            )
+            table = next(response.iter_primary_results())
+            rows = iter(table.raw_rows)
+        n_rows = 0
+        while True:
+            with event.stage("network"):
+                chunk = list(islice(rows, chunk_rows))
+            if not chunk and n_rows > 0:
+                break
+            n_rows += len(chunk)
+            yield _chunk_table(table, chunk)
+            if len(chunk) < chunk_rows:
+                break
+        end_time = timer()
+        duration = end_time - start_time
+        logger.info("Streamed {} rows in {:.2f} seconds.", n_rows, duration)
+
+    def execute_many(
+        self, queries, *args, max_workers=None, as_completed=False, options=None, **kwargs
+    ):
+        """Execute many independent queries or commands concurrently.
+
+        The queries share this database's client and are run on a bounded
+        thread pool. A query that fails does not stop the others; its exception
+        is returned in place of its DataFrame.
+
+        Parameters
+        ----------
+        queries: Iterable[str or Tuple[str, dict]]
+            The queries to run. Each item is either a query (or a path to a file
+            containing one), or a (query, params) pair whose params dict is
+            merged over kwargs when rendering that query.
+        max_workers: int, default None
+            The maximum number of queries to run at once. Defaults to 8.
+        as_completed: bool, default False
+            If False, return a list of results in the same order as queries.
+            If True, return an iterator of (index, result) pairs in the order
+            the queries complete, where index is the position in queries.
+        options: QueryOptions, default None
+            Request options for this call, overriding the database's options.
+        args: List[Any]
+            Positional arguments to pass to each query as Jinja2 template params.
+        kwargs: Dict[Any]
+            Keyword arguments to pass to each query as Jinja2 template params.
+
+        Returns
+        -------
+        list or Iterator[Tuple[int, pandas.DataFrame or Exception]]
+            The query results.
+        """
+        calls = []
+        for query in queries:
+            params = kwargs
+            if isinstance(query, tuple):
+                query, query_params = query
+                params = {**kwargs, **query_params}
+            calls.append(partial(self.execute, query, *args, options=options, **params))
+        return run_many(calls, max_workers=max_workers, as_completed=as_completed)
+
+    def iter_windowed(
+        self,
+        query: str,
+        start,
+        end,
+        *args,
+        window=DEFAULT_WINDOW,
+        max_workers=None,
+        min_window=MIN_WINDOW,
+        target_seconds=DEFAULT_TARGET_SECONDS,
+        **kwargs,
+    ):
+        """Execute a query template once per time window, concurrently.
+
+        The template is rendered with `start` and `end` set to each window's
+        bounds as Kusto datetime literals, and should filter on them with
+        `>= {{ start }}` and `< {{ end }}`. A window whose results are too large
+        or that times out is split in half and retried, and slow windows make
+        the following windows smaller.
+
+        Parameters
+        ----------
+        query: str
+            The text of the Kusto query template to run. Can also be a path to a
+            file containing a query.
+        start: datetime
+            The start of the range (inclusive).
+        end: datetime
+            The end of the range (exclusive).
+        window: timedelta, default 1 day
+            The initial and largest window size.
+        max_workers: int, default None
+            The maximum number of windows to run at once. Defaults to 8.
+        min_window: timedelta, default 1 minute
+            Windows this small are not split further; their errors are raised.
+        target_seconds: float, default 60
+            The longest a window should take to run.
+        args: List[Any]
+            Positional arguments to pass to the query as Jinja2 template params.
+        kwargs: Dict[Any]
+            Keyword arguments to pass to the query as Jinja2 template params.
+
+        Yields
+        ------
+        Tuple[datetime, datetime, pandas.DataFrame]
+            The start, end and results of each window, in the order they complete.
+        """
+        query = maybe_read_file(query)
+
+        def run(lower, upper):
+            return self.execute(query, *args, start=quote(lower), end=quote(upper), **kwargs)
+
+        return iter_windows(
+            run,
+            start,
+            end,
+            window=window,
+            max_workers=max_workers,
+            min_window=min_window,
+            target_seconds=target_seconds,
+        )
+
+    def execute_windowed(self, query: str, start, end, *args, **kwargs):
+        """Execute a query template once per time window, concurrently, and
+        return the windows' results concatenated in time order.
+
+        Takes the same parameters as `iter_windowed`.
+        """
+        return concat_windows(self.iter_windowed(query, start, end, *args, **kwargs))
+
+    async def execute_async(self, query: str, *args, options=None, parameters=None, **kwargs):
+        """Execute a query or command without blocking the event loop.
+
+        Parameters
+        ----------
+        query: str
+            The text of the Kusto query or command to run. Can also be a path to
+            a file containing a query.
+        options: QueryOptions, default None
+            Request options for this call, overriding the database's options.
+        parameters: Dict[str, Any], default None
+            Query parameters to declare and send with the query, by name.
+        args: List[Any]
+            Positional arguments to pass to the query as Jinja2 template params.
+        kwargs: Dict[Any]
+            Keyword arguments to pass to the query as Jinja2 template params.
+
+        Returns
+        -------
+        pandas.DataFrame
+            A DataFrame containing the query results.
+        """
+        event = QueryEvent(self.cluster, self.database, query)
+        try:
+            query_rendered, parameters = self._render(
+                event, query, *args, options=options, parameters=parameters, **kwargs
+            )
+            if query_rendered.startswith(".") and not query_rendered.startswith(".show"):
+                self.catalog.invalidate()
+
+            method = _select_method(self.async_client, query_rendered)
+            logger.info("Executing query on {}: {}", self.database, query_rendered)
+            start_time = timer()
+            with event.stage("network"):
+                properties = self._properties(options, parameters)
+                result = await method(self.database, query_rendered, properties)
+            end_time = timer()
+            duration = end_time - start_time
+            logger.info("Query execution completed in {:.2f} seconds.", duration)
+            event.server_cache_hit = server_cache_hit(result)
+            with event.stage("convert"):
+                df = self.decoder(result.primary_results[0])
+            df.attrs["server_cache_hit"] = event.server_cache_hit
+            event.result(df)
+            return df
+        except Exception as exc:
+            event.error = exc
+            raise
+        finally:
+            self._emit(event)
 
     def show_tables(self):
         """Show the list of tables in the database.
@@ -196,8 +914,7 @@ class KustoDatabase:
         bool
             True if the table exists in the database.
         """
-        tables = self.show_tables()
-        return table in tables.TableName.tolist()
+        return table in self.catalog
 
     def set_table(self, query, table, folder, docstring, *args, **kwargs):
         """
@@ -229,10 +946,30 @@ class KustoDatabase:
             render_set(query, table, folder, docstring, replace=False, *args, **kwargs),
         )
 
-    def to_parquet(self, query, path, *args, force=False, **kwargs):
+    def to_parquet(
+        self,
+        query,
+        path,
+        *args,
+        force=False,
+        row_group_size=DEFAULT_CHUNK_ROWS,
+        compression="snappy",
+        use_dictionary=True,
+        load=True,
+        partition_by=None,
+        max_workers=None,
+        watermark=None,
+        options=None,
+        **kwargs,
+    ):
         """Run the given query, cache the results as a local parquet file, and
         return results as a Pandas DataFrame.
 
+        Query results are streamed into the file one row group at a time, so
+        exporting a result never holds more than one row group in memory. The
+        file is written to a temporary file first and renamed into place when
+        complete. Dynamic columns are stored as JSON strings. Requires pyarrow.
+
         Parameters
         ----------
         query: str
@@ -242,6 +979,35 @@ class KustoDatabase:
         force: bool, default False
             If False, the data will be read from the cached parquet file if it
             exists. If True, the data will be re-downloaded regardless.
+        row_group_size: int, default 100000
+            The number of rows in each row group of the file.
+        compression: str or dict, default "snappy"
+            The compression codec, or a dict of codecs by column name.
+        use_dictionary: bool or list, default True
+            Whether to dictionary-encode columns, or a list of the columns to
+            dictionary-encode.
+        load: bool, default True
+            If False, only write the file and return None, for results too
+            large to fit in memory.
+        partition_by: str or List[str], default None
+            If given, path is a directory and the results are written as a
+            hive-partitioned dataset with one `col=value` subdirectory per
+            distinct value of these columns. Each partition is queried and
+            written separately, in parallel, and partitions that already exist
+            are only rewritten if force is True.
+        max_workers: int, default None
+            The maximum number of partitions to write at once. Defaults to 8.
+        watermark: str, default None
+            If given, path is a directory that is refreshed incrementally: only
+            rows where this datetime column is later than the latest value
+            already downloaded are queried, and they are written to a new part
+            file that records the new latest value in its metadata. Pass
+            "ingestion_time()" to use the ingestion time of the rows, which adds
+            an `_ingestion_time` column; the query must then return rows of a
+            table, such as a plain filter of one. force=True deletes the parts
+            and downloads everything again.
+        options: QueryOptions, default None
+            Request options for this call, overriding the database's options.
         args: List[Any]
             Positional arguments to pass to the query as Jinja2 template params.
         kwargs: Dict[Any]
@@ -249,17 +1015,148 @@ class KustoDatabase:
 
         Returns
         -------
-        pandas.DataFrame
-            A DataFrame containing the results of the control command.
+        pandas.DataFrame or None
+            A DataFrame containing the query results, or None if load is False.
         """
+        writer_options = {
+            "row_group_size": row_group_size,
+            "compression": compression,
+            "use_dictionary": use_dictionary,
+        }
+        if partition_by is not None and watermark is not None:
+            raise ValueError("partition_by and watermark can't be used together.")
+        if watermark is not None:
+            query = maybe_read_file(query)
+            query_rendered = render_template_query(query, *args, **kwargs)
+            self._write_increment(
+                query_rendered, path, watermark, force=force, options=options, **writer_options
+            )
+            if not load:
+                return None
+            if not any(Path(path).glob("part-*.parquet")):
+                return pd.DataFrame()
+            return pd.read_parquet(path)
+        if partition_by is not None:
+            query = maybe_read_file(query)
+            query_rendered = render_template_query(query, *args, **kwargs)
+            self._write_partitions(
+                query_rendered,
+                path,
+                partition_by,
+                force=force,
+                max_workers=max_workers,
+                options=options,
+                **writer_options,
+            )
+            if not load:
+                return None
+            if not any(Path(path).rglob("*.parquet")):
+                return pd.DataFrame()
+            return pd.read_parquet(path)
         if not force:
             if os.path.isfile(path):
                 logger.info("Reading dataframe from existing file {}", path)
-                return pd.read_parquet(path)
+                return pd.read_parquet(path) if load else None
         logger.info("File {} does not exist, will run query.", path)
-        df = self.execute(query, *args, **kwargs)
-        df.to_parquet(path, index=False)
-        return df
+        query = maybe_read_file(query)
+        query_rendered = render_template_query(query, *args, **kwargs)
+        tables = self._iter_arrow(query_rendered, row_group_size, options)
+        write_parquet(tables, path, **writer_options)
+        return pd.read_parquet(path) if load else None
+
+    def _write_increment(
+        self, query_rendered, path, watermark, force=False, options=None, **writer_options
+    ):
+        """Download the rows of a query that are newer than a dataset's
+        watermark into a new part file."""
+        path = Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+        if force:
+            for part in path.glob("part-*.parquet"):
+                part.unlink()
+        parts, latest = _watermarks(path)
+        query_rendered = query_rendered.rstrip().rstrip(";")
+        column = watermark
+        if watermark == INGESTION_TIME:
+            column = INGESTION_TIME_COLUMN
+            query_rendered = f"{query_rendered}\n| extend {column} = {INGESTION_TIME}"
+        if latest is not None:
+            query_rendered = f"{query_rendered}\n| where {column} > {quote(latest)}"
+        logger.info("Refreshing {} from watermark {}.", path, latest)
+        tables = self._iter_arrow(query_rendered, writer_options["row_group_size"], options)
+        first = next(tables)
+        if first.num_rows == 0:
+            logger.info("No new rows for {}.", path)
+            tables.close()
+            return
+        tracker = _WatermarkTracker(chain([first], tables), column)
+        number = int(parts[-1].stem.split("-")[1]) + 1 if parts else 0
+        part = path / f"part-{number:05d}.parquet"
+        write_parquet(tracker, part, metadata=tracker.metadata, **writer_options)
+
+    def _write_partitions(
+        self,
+        query_rendered,
+        path,
+        partition_by,
+        force=False,
+        max_workers=None,
+        options=None,
+        **writer_options,
+    ):
+        """Write a query's results as a hive-partitioned parquet dataset,
+        skipping partitions that already exist unless force is True."""
+        if isinstance(partition_by, str):
+            partition_by = [partition_by]
+        query_rendered = query_rendered.rstrip().rstrip(";")
+        columns = ", ".join(partition_by)
+        values = self._execute_rendered(f"{query_rendered}\n| distinct {columns}", options=options)
+        Path(path).mkdir(parents=True, exist_ok=True)
+        writes = []
+        for row in values[partition_by].itertuples(index=False):
+            part = Path(path) / _partition_dir(partition_by, row) / "part-0.parquet"
+            if part.exists() and not force:
+                continue
+            part.parent.mkdir(parents=True, exist_ok=True)
+            partition_query = (
+                f"{query_rendered}\n"
+                f"| where {_partition_filter(partition_by, row)}\n"
+                f"| project-away {columns}"
+            )
+            tables = self._iter_arrow(partition_query, writer_options["row_group_size"], options)
+            writes.append(partial(write_parquet, tables, part, **writer_options))
+        logger.info("Writing {} of {} partitions to {}.", len(writes), len(values), path)
+        for result in run_many(writes, max_workers=max_workers):
+            if isinstance(result, Exception):
+                raise result
+
+    def _iter_arrow(self, query_rendered, chunk_rows, options=None):
+        """Run a rendered query or command and iterate over its results as
+        pyarrow Tables of up to chunk_rows rows, emitting its event once the
+        iteration ends."""
+        # pylint: disable=import-outside-toplevel
+        import pyarrow as pa
+
+        event = QueryEvent(self.cluster, self.database, query_rendered)
+        try:
+            if query_rendered.startswith("."):
+                # Commands can't be streamed.
+                df = self._execute_rendered(query_rendered, event, options)
+                event.result(df)
+                yield pa.Table.from_pandas(df, preserve_index=False)
+                return
+            event.rows = 0
+            for table in self._stream_rendered(query_rendered, chunk_rows, event, options):
+                with event.stage("convert"):
+                    arrow = arrow_from_result_table(table)
+                event.rows += arrow.num_rows
+                event.columns = arrow.num_columns
+                yield arrow
+        except Exception as exc:
+            event.error = exc
+            raise
+        finally:
+            self._emit(event)
 
     def __str__(self):
         return f"{str(self.cluster)}.database('{self.database}')"
@@ -268,30 +1165,62 @@ class KustoDatabase:
 class Cluster:
     """A class representing a Kusto cluster."""
 
-    def __init__(self, name):
+    def __init__(self, name, auth="az_cli", pool_size=None, offline=False, options=None):
+        """A class representing a Kusto cluster.
+
+        Parameters
+        ----------
+        name: str
+            The cluster name.
+        auth: str, default "az_cli"
+            How to authenticate: "az_cli", "device", "interactive" or
+            "managed_identity".
+        pool_size: int, default None
+            The maximum number of pooled HTTP connections of the client shared
+            by this cluster's databases.
+        offline: bool, default False
+            If True, the cluster's databases are only used to compile query
+            expressions and never connect.
+        options: QueryOptions, default None
+            Request options for every query on this cluster's databases.
+        """
         self.name = name
+        self.auth = auth
+        self.pool_size = pool_size
+        self.offline = offline
+        self.options = options
 
-    def database(self, name):
+    def database(self, name, options=None):
         """Create an instance representing a database in the cluster.
 
         Parameters
         ----------
         name: str
             The name of the Kusto database in the cluster.
+        options: QueryOptions, default None
+            Request options for every query on this database, overriding the
+            cluster's options.
 
         Returns
         -------
         KustoDatabase
             an instance representing the Kusto database.
         """
-        return KustoDatabase(self.name, name)
+        return KustoDatabase(
+            self.name,
+            name,
+            auth=self.auth,
+            pool_size=self.pool_size,
+            offline=self.offline,
+            options=merge_options(self.options, options),
+        )
 
     def __str__(self):
         return f"cluster('{self.name}')"
 
 
-def cluster(name):
+def cluster(name, auth="az_cli", pool_size=None, offline=False, options=None):
     """Convenience function to construct a Cluster instance.
     Makes the query look more like KQL.
     """
-    return Cluster(name)
+    return Cluster(name, auth=auth, pool_size=pool_size, offline=offline, options=options)
@@ -0,0 +1,133 @@
+"""Structured events describing where the time of each query execution went.
+
+A hook is any callable that takes a `QueryEvent`. Hooks registered on a
+`KustoDatabase` are called once per executed query, after it completes or
+fails, with the time spent in each stage:
+
+- read_file: reading the query from a file.
+- render: rendering the Jinja2 template.
+- network: from sending the request until the whole response is downloaded,
+  including acquiring a token.
+- parse: parsing the JSON response into result tables.
+- convert: converting the result table to a DataFrame.
+
+The network and parse stages are told apart by a response hook on the
+client's `requests.Session`. For clients without one, such as the asynchronous
+client, and for streamed queries, the network stage includes parsing.
+"""
+import threading
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from timeit import default_timer as timer
+from typing import Dict, Optional
+
+import requests
+from loguru import logger
+
+_local = threading.local()
+
+
+@dataclass
+class QueryEvent:
+    """The timings and size of one query execution.
+
+    Attributes
+    ----------
+    cluster: str
+        The cluster name.
+    database: str
+        The database name.
+    query: str
+        The query, rendered once the render stage has run.
+    timings: Dict[str, float]
+        Seconds spent in each stage, by stage name.
+    rows: int
+        The number of rows returned.
+    columns: int
+        The number of columns returned.
+    response_bytes: int
+        The size of the HTTP response body, if known.
+    server_cache_hit: bool
+        Whether the results were served from the server's query results cache.
+    error: Exception
+        The exception raised by the execution, if it failed.
+    """
+
+    cluster: str
+    database: str
+    query: str
+    timings: Dict[str, float] = field(default_factory=dict)
+    rows: Optional[int] = None
+    columns: Optional[int] = None
+    response_bytes: Optional[int] = None
+    server_cache_hit: Optional[bool] = None
+    error: Optional[BaseException] = None
+    _received: Optional[float] = field(default=None, repr=False)
+
+    @property
+    def duration(self):
+        """The total seconds spent in all stages."""
+        return sum(self.timings.values())
+
+    @contextmanager
+    def stage(self, name):
+        """Time a block of code as a stage, adding to any earlier time in it."""
+        start_time = timer()
+        try:
+            yield
+        finally:
+            self.timings[name] = self.timings.get(name, 0.0) + timer() - start_time
+
+    @contextmanager
+    def request(self):
+        """Time a client call as the network and parse stages."""
+        self._received = None
+        _local.event = self
+        start_time = timer()
+        try:
+            yield
+        finally:
+            end_time = timer()
+            _local.event = None
+            received = self._received if self._received is not None else end_time
+            self.timings["network"] = self.timings.get("network", 0.0) + received - start_time
+            if self._received is not None:
+                self.timings["parse"] = self.timings.get("parse", 0.0) + end_time - received
+
+    def result(self, df):
+        """Record the shape of the results."""
+        self.rows, self.columns = df.shape
+
+
+def _record_response(response, *args, **kwargs):  # pylint: disable=unused-argument
+    """A requests response hook recording the response size and the time it
+    finished downloading on the current thread's event."""
+    event = getattr(_local, "event", None)
+    if event is None:
+        return response
+    if kwargs.get("stream"):
+        length = response.headers.get("Content-Length")
+        event.response_bytes = int(length) if length is not None else None
+    else:
+        # The session would read the body right after the hooks run anyway.
+        event.response_bytes = len(response.content)
+    event._received = timer()  # pylint: disable=protected-access
+    return response
+
+
+def install_response_hook(client):
+    """Add the response hook to a client's HTTP session, if it has one."""
+    session = getattr(client, "_session", None)
+    if isinstance(session, requests.Session):
+        hooks = session.hooks["response"]
+        if _record_response not in hooks:
+            hooks.append(_record_response)
+
+
+def emit(hooks, event):
+    """Call each hook with an event. Exceptions raised by hooks are logged."""
+    for hook in hooks:
+        try:
+            hook(event)
+        except Exception:  # pylint: disable=broad-except
+            logger.exception("Query event hook {} failed.", hook)
@@ -1,10 +1,25 @@
 """Experimental Kusto expression API for generating queries."""
 
+import hashlib
+import json
 from copy import copy
 from datetime import datetime, timedelta
 from decimal import Decimal
 from typing import Any
 
+import pandas as pd
+
+from kusto_tool.batch import run_many
+from kusto_tool.options import merge_options
+from kusto_tool.parameters import collect, collecting, datetime_literal, is_collecting
+from kusto_tool.partition import (
+    DEFAULT_TARGET_SECONDS,
+    DEFAULT_WINDOW,
+    MIN_WINDOW,
+    concat_windows,
+    iter_windows,
+)
+
 
 class attrdict:
     """A dict whose members are accessible with the . operator."""
@@ -45,6 +60,15 @@ OP = attrdict(
     STRCAT="strcat",
     BAG_UNPACK="bag_unpack",
     PERCENTILE="percentile",
+    HASH="hash",
+    COUNTIF="countif",
+    ISNOTNULL="isnotnull",
+    HLL="hll",
+    HLL_MERGE="hll_merge",
+    DCOUNT_HLL="dcount_hll",
+    TDIGEST="tdigest",
+    TDIGEST_MERGE="tdigest_merge",
+    PERCENTILE_TDIGEST="percentile_tdigest",
 )
 
 PTYPES = {
@@ -75,13 +99,24 @@ KTYPES = {
 
 
 def quote(val):
-    """Quote strings."""
+    """Quote strings and datetimes."""
     if isinstance(val, str):
         return repr(val)
+    if isinstance(val, datetime):
+        return datetime_literal(val)
     return str(val)
 
 
+def literal(val):
+    """Quote a literal value, or name the query parameter holding it when
+    compiling a parameterized query."""
+    name = collect(val)
+    return quote(val) if name is None else name
+
+
 class Prefix:
+    __slots__ = ("terms", "op", "agg", "dtype")
+
     def __init__(self, op, *args, agg=False, dtype=Any):
         self.terms = args
         self.op = op
@@ -94,6 +129,8 @@ class Prefix:
 
 
 class Between:
+    __slots__ = ("lhs", "left", "right", "negate", "dtype")
+
     def __init__(self, lhs, left, right, negate=False):
         self.lhs = lhs
         self.left = left
@@ -103,21 +140,47 @@ class Between:
 
     def __str__(self):
         neg = "!" if self.negate else ""
-        return f"{self.lhs} {neg}between({self.left} .. {self.right})"
+        return f"{self.lhs} {neg}between({literal(self.left)} .. {literal(self.right)})"
 
 
 class Infix:
     # TODO: does this need __add__, __sub__?
+    __slots__ = ("op", "lhs", "rhs", "dtype")
+
     def __init__(self, op, lhs, rhs, dtype=Any):
         self.op = op
         self.lhs = lhs
         self.rhs = rhs
         self.dtype = dtype
 
+    def flatten(self):
+        """The innermost left operand and the Infix expressions applied to it,
+        innermost first.
+
+        Long chains like `a | b | c | ...` nest on the left, so walking them
+        in a loop instead of recursing avoids the recursion limit.
+        """
+        links = []
+        expr = self
+        while isinstance(expr, Infix):
+            links.append(expr)
+            expr = expr.lhs
+        links.reverse()
+        return expr, links
+
     def __str__(self):
-        if self.op in [OP.AND, OP.OR]:
-            return f"({self.lhs}) {self.op} ({quote(self.rhs)})"
-        return f"{self.lhs} {self.op} {quote(self.rhs)}"
+        base, links = self.flatten()
+        # Each and/or wraps everything to its left in parentheses, so they
+        # are all opened up front.
+        opened = 0
+        parts = [str(base)]
+        for link in links:
+            if link.op in [OP.AND, OP.OR]:
+                opened += 1
+                parts.append(f") {link.op} ({literal(link.rhs)})")
+            else:
+                parts.append(f" {link.op} {literal(link.rhs)}")
+        return "(" * opened + "".join(parts)
 
     def __repr__(self):
         return f"{repr(self.lhs)} {self.op} {quote(self.rhs)}"
@@ -140,12 +203,14 @@ def typeof(expr):
 
 
 class Project:
+    __slots__ = ("columns", "renamed_columns", "_text")
+
     def __init__(self, *args, **kwargs):
         self.columns = list(args)
         self.renamed_columns = kwargs
 
     def _build_column_list(self):
-        col_list = self.columns
+        col_list = list(self.columns)
         for k, v in self.renamed_columns.items():
             col_list.append(f"{k} = {v}")
         col_str = ",\n\t".join([str(col) for col in col_list])
@@ -157,6 +222,8 @@ class Project:
 
 
 class Count:
+    __slots__ = ("_text",)
+
     def __repr__(self):
         return "Count()"
 
@@ -167,6 +234,8 @@ class Count:
 class Sample:
     """Sample operator."""
 
+    __slots__ = ("n", "_text")
+
     def __init__(self, n):
         self.n = n
 
@@ -180,6 +249,8 @@ class Sample:
 class SampleDistinct:
     """Sample distinct operator."""
 
+    __slots__ = ("n", "of", "_text")
+
     def __init__(self, n, of):
         self.n = n
         self.of = of
@@ -192,6 +263,8 @@ class SampleDistinct:
 
 
 class Distinct:
+    __slots__ = ("columns", "_text")
+
     def __init__(self, *args):
         self.columns = list(args)
 
@@ -209,6 +282,8 @@ class Distinct:
 
 
 class Where:
+    __slots__ = ("expressions", "_text")
+
     def __init__(self, *args):
         self.expressions = list(args)
 
@@ -217,15 +292,29 @@ class Where:
         return f"Where({exprs})"
 
     def __str__(self):
-        exprs = " and ".join([str(ex) for ex in self.expressions])
+        if len(self.expressions) == 1:
+            return f"| where {self.expressions[0]}"
+        exprs = " and ".join([_conjunct(ex) for ex in self.expressions])
         return f"| where {exprs}"
 
 
+def _conjunct(predicate):
+    """A predicate to join to others with and, in parentheses if it may be an
+    or, which binds less tightly than and."""
+    if isinstance(predicate, str) or (isinstance(predicate, Infix) and predicate.op == OP.OR):
+        return f"({predicate})"
+    return str(predicate)
+
+
 class Join:
-    def __init__(self, right, on, kind, strategy=None):
+    __slots__ = ("right", "on", "kind", "left_columns", "strategy", "_text", "_pruned")
+
+    def __init__(self, right, on, kind, strategy=None, left_columns=None):
         self.right = right
         self.on = [on] if isinstance(on, str) else on
         self.kind = kind
+        # The names of the left side's columns, if known.
+        self.left_columns = left_columns
         if strategy in ["broadcast", "shuffle"]:
             self.strategy = strategy
         else:
@@ -241,6 +330,8 @@ class Join:
 
 
 class Summarize:
+    __slots__ = ("expressions", "by", "shuffle", "shufflekey", "num_partitions", "_text")
+
     def __init__(self, by=None, shuffle=False, shufflekey=None, num_partitions=None, **kwargs):
         # expressions in summarize must be aggregate functions.
         for _, v in kwargs.items():
@@ -291,8 +382,189 @@ class Summarize:
 
         return clause
 
+    def decompose(self):
+        """Rewrite the aggregation as partial aggregates that can be merged.
+
+        Running the partial aggregation on disjoint partitions of the rows and
+        merging the partitions' results with `MergeAggregates.merge` gives the
+        same results as running this aggregation on all of the rows. sum, min,
+        max and count are their own partials, avg becomes a sum and a count of
+        non-null values, dcount becomes an `hll()` sketch and percentile a
+        `tdigest()` sketch.
+
+        Returns
+        -------
+        Tuple[Summarize, MergeAggregates]
+            The partial aggregation and the merge of its results.
+        """
+        partials = {}
+        aggregates = []
+        for alias, expr in self.expressions.items():
+            alias = str(alias)
+            op = getattr(expr, "op", None)
+            terms = getattr(expr, "terms", ())
+            if op in (OP.SUM, OP.MIN, OP.MAX):
+                partials[alias] = expr
+                aggregates.append((alias, op, [alias], ()))
+            elif op == OP.COUNT:
+                partials[alias] = expr
+                aggregates.append((alias, OP.SUM, [alias], ()))
+            elif op == OP.AVG:
+                total, count = f"_{alias}_sum", f"_{alias}_count"
+                partials[total] = Prefix(OP.SUM, *terms, agg=True, dtype=float)
+                partials[count] = Prefix(
+                    OP.COUNTIF, Prefix(OP.ISNOTNULL, *terms), agg=True, dtype=int
+                )
+                aggregates.append((alias, OP.AVG, [total, count], ()))
+            elif op == OP.DCOUNT:
+                sketch = f"_{alias}_hll"
+                partials[sketch] = Prefix(OP.HLL, *terms, agg=True, dtype=object)
+                aggregates.append((alias, OP.DCOUNT, [sketch], ()))
+            elif op == OP.PERCENTILE and len(terms) == 2:
+                sketch = f"_{alias}_tdigest"
+                partials[sketch] = Prefix(OP.TDIGEST, terms[0], agg=True, dtype=object)
+                aggregates.append((alias, OP.PERCENTILE, [sketch], terms[1:]))
+            else:
+                raise ValueError(f"Can't decompose {alias}={expr} into partial aggregates.")
+        partial = Summarize(
+            by=self.by,
+            shuffle=self.shuffle,
+            shufflekey=self.shufflekey or None,
+            num_partitions=getattr(self, "num_partitions", None),
+            **partials,
+        )
+        return partial, MergeAggregates([str(col) for col in self.by], aggregates)
+
+
+# Sketches are inlined in merge queries, whose text Kusto limits in size.
+MAX_SKETCH_QUERY_CHARS = 1_000_000
+
+
+def _dynamic(val):
+    """A Kusto dynamic literal for a decoded dynamic value or its JSON text."""
+    return f"dynamic({val if isinstance(val, str) else json.dumps(val)})"
+
+
+class MergeAggregates:
+    """Merges partial aggregates computed on disjoint partitions of the rows."""
+
+    def __init__(self, by, aggregates):
+        """Merges partial aggregates computed on disjoint partitions of the rows.
+
+        Parameters
+        ----------
+        by: List[str]
+            The names of the group by columns.
+        aggregates: List[Tuple[str, str, List[str], tuple]]
+            For each aggregate, its name, the operator that merges it, the
+            partial columns it is merged from, and any arguments to the merge.
+        """
+        self.by = by
+        self.aggregates = aggregates
+
+    def _sketch_queries(self, groups, partials, max_query_chars):
+        """Queries merging the hll and tdigest sketches of each group.
+
+        Sketches are inlined as literals, so groups are split over several
+        queries, each with at most max_query_chars characters of sketches
+        unless one group has more. All of a group's sketches are in the same
+        query.
+        """
+        sketches = [
+            (alias, op, columns[0], args)
+            for alias, op, columns, args in self.aggregates
+            if op in (OP.DCOUNT, OP.PERCENTILE)
+        ]
+        columns = [column for _, _, column, _ in sketches]
+        schema = ", ".join(["_group: long", *[f"{column}: dynamic" for column in columns]])
+        rows = [
+            (group, ", ".join([str(group), *[_dynamic(val) for val in row]]))
+            for group, row in zip(groups, partials[columns].itertuples(index=False))
+        ]
+        sizes = {}
+        for group, row in rows:
+            sizes[group] = sizes.get(group, 0) + len(row)
+        batches, batch, size = {}, 0, 0
+        for group in sorted(sizes):
+            if size and size + sizes[group] > max_query_chars:
+                batch, size = batch + 1, 0
+            batches[group] = batch
+            size += sizes[group]
+        batch_rows = [[] for _ in range(batch + 1)]
+        for group, row in rows:
+            batch_rows[batches[group]].append(row)
+        separator = ",\n\t"
+        merged = ",\n\t".join(
+            f"{column}={OP.HLL_MERGE if op == OP.DCOUNT else OP.TDIGEST_MERGE}({column})"
+            for _, op, column, _ in sketches
+        )
+        finals = [
+            (
+                f"{alias}={OP.DCOUNT_HLL}({column})"
+                if op == OP.DCOUNT
+                else f"{alias}={OP.PERCENTILE_TDIGEST}({column}, {quote(args[0])})"
+            )
+            for alias, op, column, args in sketches
+        ]
+        return [
+            f"datatable({schema})[\n\t{separator.join(rows)},\n]\n"
+            f"| summarize\n\t{merged}\n\tby _group\n"
+            f"| project _group, {', '.join(finals)}"
+            for rows in batch_rows
+        ]
+
+    def merge(self, partials, database=None, max_query_chars=MAX_SKETCH_QUERY_CHARS):
+        """Merge the concatenated results of the partial aggregation.
+
+        sum, min, max, count and avg are merged locally with pandas. The hll
+        and tdigest sketches of dcount and percentile can only be read by
+        Kusto, so they are merged by queries on the database, with the groups
+        split over as many queries as keep each one's text small.
+
+        Parameters
+        ----------
+        partials: pandas.DataFrame
+            The partial aggregation's results from every partition.
+        database: KustoDatabase, default None
+            The database to merge sketches on. Only needed for dcount and
+            percentile.
+        max_query_chars: int, default 1000000
+            The most characters of sketches to send in one merge query.
+
+        Returns
+        -------
+        pandas.DataFrame
+            The merged aggregation, with one row per group.
+        """
+        aliases = [alias for alias, _, _, _ in self.aggregates]
+        if partials.empty and self.by:
+            return pd.DataFrame(columns=[*self.by, *aliases])
+        keys = self.by or ["_group"]
+        frame = partials if self.by else partials.assign(_group=0)
+        grouped = frame.groupby(keys, dropna=False, sort=False)
+        result = grouped.size().to_frame("_size")
+        for alias, op, columns, _ in self.aggregates:
+            if op in (OP.SUM, OP.MIN, OP.MAX):
+                result[alias] = grouped[columns[0]].agg(op)
+            elif op == OP.AVG:
+                total, count = columns
+                result[alias] = grouped[total].sum() / grouped[count].sum()
+        if any(op in (OP.DCOUNT, OP.PERCENTILE) for _, op, _, _ in self.aggregates):
+            if database is None:
+                raise ValueError("A database is needed to merge dcount and percentile sketches.")
+            # With sort=False, groups are numbered in the order of result's rows.
+            queries = self._sketch_queries(grouped.ngroup(), frame, max_query_chars)
+            sketches = pd.concat([database.execute(query) for query in queries])
+            sketches = sketches.set_index("_group").reindex(range(len(result)))
+            for alias, op, _, _ in self.aggregates:
+                if op in (OP.DCOUNT, OP.PERCENTILE):
+                    result[alias] = sketches[alias].to_numpy()
+        return result.reset_index()[[*self.by, *aliases]]
+
 
 class Extend:
+    __slots__ = ("kwargs", "_text")
+
     def __init__(self, **kwargs):
         self.kwargs = kwargs
 
@@ -302,6 +574,8 @@ class Extend:
 
 
 class Property:
+    __slots__ = ("column", "prop")
+
     def __init__(self, column, prop):
         self.column = column
         self.prop = prop
@@ -311,10 +585,16 @@ class Property:
 
 
 class ListLit:
+    __slots__ = ("args",)
+
     def __init__(self, *args):
         self.args = list(args)
 
     def __str__(self):
+        name = collect(self.args)
+        if name is not None:
+            # The whole list is one dynamic parameter.
+            return f"({name})"
         in_list = f"({', '.join([quote(arg) for arg in self.args])})"
         return in_list
 
@@ -322,6 +602,8 @@ class ListLit:
 class Column:
     """A column in a tabular expression."""
 
+    __slots__ = ("name", "dtype", "ascending")
+
     def __init__(self, name: str, dtype: str, ascending: bool = False):
         """"""
         self.name = name
@@ -417,14 +699,12 @@ class Column:
         return Prefix(OP.BAG_UNPACK, self)
 
     def asc(self):
-        """Sort this column in ascending order."""
-        self.ascending = True
-        return self
+        """This column, sorted in ascending order."""
+        return Column(self.name, self.dtype, ascending=True)
 
     def desc(self):
-        """Sort this column in descending order."""
-        self.ascending = False
-        return self
+        """This column, sorted in descending order."""
+        return Column(self.name, self.dtype, ascending=False)
 
     def between(self, left, right):
         """Returns True if the column value is between left (inclusive) and right (inclusive)."""
@@ -445,6 +725,8 @@ class Column:
 
 
 class Evaluate:
+    __slots__ = ("expr", "_text")
+
     def __init__(self, expr):
         self.expr = expr
 
@@ -461,8 +743,7 @@ def asc(expr):
         A column name string or Column expression instance.
     """
     if isinstance(expr, Column):
-        expr.ascending = True
-        return expr
+        return expr.asc()
     return Column(expr, typeof(expr), ascending=True)
 
 
@@ -475,30 +756,86 @@ def desc(expr):
         A column name string or Column expression instance.
     """
     if isinstance(expr, Column):
-        expr.ascending = False
-        return expr
-    return Column(expr, typeof(expr), asc=False)
+        return expr.desc()
+    return Column(expr, typeof(expr), ascending=False)
+
+
+def _sort_keys(args):
+    """Render sort keys, adding asc to ascending columns."""
+    keys = []
+    for arg in args:
+        if isinstance(arg, Column):
+            if arg.ascending:
+                keys.append(quote(arg) + " asc")
+            else:
+                keys.append(quote(arg))
+        else:
+            keys.append(arg)
+    return ",\n\t".join(keys)
 
 
 class Order:
+    __slots__ = ("args", "_text")
+
     def __init__(self, *args):
         self.args = args
 
     def __str__(self):
-        args = []
-        for arg in self.args:
-            if isinstance(arg, Column):
-                if arg.ascending:
-                    args.append(quote(arg) + " asc")
-                else:
-                    args.append(quote(arg))
-            else:
-                args.append(arg)
-        args_str = ",\n\t".join(args)
-        return f"| order by\n\t{args_str}"
+        return f"| order by\n\t{_sort_keys(self.args)}"
+
+
+class Top:
+    """Top operator: the first n rows sorted by the given columns."""
+
+    __slots__ = ("n", "args", "_text")
+
+    def __init__(self, n, *args):
+        assert isinstance(n, int)
+        self.n = n
+        self.args = args
+
+    def __repr__(self):
+        return f"Top({self.n})"
+
+    def __str__(self):
+        return f"| top {self.n} by\n\t{_sort_keys(self.args)}"
+
+
+class TopNested:
+    """Top-nested operator: hierarchical top values, one level per clause."""
+
+    __slots__ = ("levels", "_text")
+
+    def __init__(self, *levels):
+        """Top-nested operator.
+
+        Parameters
+        ----------
+        levels: Tuple[int, Any, str, Prefix, bool, Any]
+            For each level, the number of values to keep (None for all), the
+            expression to group by, the aggregation's alias and expression,
+            whether to keep the smallest values instead of the largest, and
+            the value to aggregate the other values as (None to drop them).
+        """
+        self.levels = list(levels)
+
+    def __repr__(self):
+        return f"TopNested({len(self.levels)} levels)"
+
+    def __str__(self):
+        clauses = []
+        for n, of, alias, agg, ascending, others in self.levels:
+            count = "" if n is None else f" {n}"
+            others_str = "" if others is None else f" with others={quote(others)}"
+            order = " asc" if ascending else ""
+            clauses.append(f"top-nested{count} of {of}{others_str} by {alias}={agg}{order}")
+        clause_str = ",\n\t".join(clauses)
+        return f"| {clause_str}"
 
 
 class Limit:
+    __slots__ = ("n", "_text")
+
     def __init__(self, n):
         assert isinstance(n, int)
         self.n = n
@@ -508,6 +845,8 @@ class Limit:
 
 
 class Expand:
+    __slots__ = ("column", "_text")
+
     def __init__(self, column):
         self.column = column
 
@@ -515,10 +854,155 @@ class Expand:
         return f"| mv-expand {str(self.column)}"
 
 
+def render(op):
+    """Compile an operator, caching its text on it.
+
+    Operators are never modified once built, so the text is reused by every
+    expression and every compile that includes the same operator. Nothing is
+    cached while collecting query parameters, whose names depend on the
+    whole query.
+    """
+    if is_collecting():
+        return str(op)
+    text = getattr(op, "_text", None)
+    if text is None:
+        text = str(op)
+        op._text = text  # pylint: disable=protected-access
+    return text
+
+
+def _fields(obj):
+    """An object's public attributes, by name."""
+    if hasattr(obj, "__dict__"):
+        items = vars(obj).items()
+    else:
+        names = [name for cls in type(obj).__mro__ for name in getattr(cls, "__slots__", ())]
+        items = [(name, getattr(obj, name)) for name in names if hasattr(obj, name)]
+    return sorted((name, val) for name, val in items if not name.startswith("_"))
+
+
+def structure(obj):
+    """A nested tuple of plain values describing an expression's structure.
+
+    Equal structures compile to the same query, and the tuple's repr is the
+    same in every process.
+    """
+    if isinstance(obj, TableExpr):
+        return ("TableExpr", obj.fingerprint)
+    if isinstance(obj, type):
+        return ("type", f"{obj.__module__}.{obj.__qualname__}")
+    if obj is None or isinstance(obj, (str, bool, int, float, Decimal, datetime, timedelta)):
+        return (type(obj).__name__, repr(obj))
+    if isinstance(obj, (list, tuple)):
+        return tuple(structure(item) for item in obj)
+    if isinstance(obj, dict):
+        # In order, since the order of extended or projected columns matters.
+        return tuple((str(key), structure(val)) for key, val in obj.items())
+    if isinstance(obj, (set, frozenset)):
+        return tuple(sorted(repr(structure(item)) for item in obj))
+    if isinstance(obj, Infix):
+        # Flat, so long and/or chains don't recurse once per term.
+        base, links = obj.flatten()
+        links = tuple((link.op, structure(link.dtype), structure(link.rhs)) for link in links)
+        return ("Infix", structure(base), links)
+    fields = _fields(obj)
+    if not fields:
+        return (type(obj).__qualname__, str(obj))
+    return (type(obj).__qualname__, tuple((name, structure(val)) for name, val in fields))
+
+
+def _digest(*parts):
+    return hashlib.blake2b(repr(parts).encode("utf-8"), digest_size=16).hexdigest()
+
+
+class Node:
+    """An operator of a table expression, linked to the operator before it.
+
+    Nodes are never modified, so appending an operator is O(1) and every
+    expression derived from the same base shares the base's nodes.
+    """
+
+    __slots__ = ("op", "parent", "length", "text", "digest")
+
+    def __init__(self, op, parent=None):
+        self.op = op
+        self.parent = parent
+        self.length = 1 if parent is None else parent.length + 1
+        # The compiled operators and fingerprint, cached on first use.
+        self.text = None
+        self.digest = None
+
+    @classmethod
+    def chain(cls, ops, parent=None):
+        """Link a list of operators after parent, returning the last node."""
+        node = parent
+        for op in ops:
+            node = cls(op, node)
+        return node
+
+    def ops(self):
+        """The operators from the first to this one."""
+        ops = [None] * self.length
+        node = self
+        while node is not None:
+            ops[node.length - 1] = node.op
+            node = node.parent
+        return ops
+
+    def fingerprint(self):
+        """A digest of the operators from the first to this one, reusing the
+        parent's digest."""
+        # Walk up to the last node with a digest, then compute the rest from
+        # there down, without recursing once per operator.
+        missing = []
+        node = self
+        while node is not None and node.digest is None:
+            missing.append(node)
+            node = node.parent
+        digest = "" if node is None else node.digest
+        for node in reversed(missing):
+            digest = node.digest = _digest(digest, structure(node.op))
+        return self.digest
+
+
+# Joins whose output rows each come from one row of the left side.
+LEFT_PRESERVING_JOINS = ("inner", "left", "leftouter", "leftsemi", "leftanti")
+
+
+def _concatenable(op, key):
+    """Whether running op on partitions of the source rows and concatenating
+    the results gives the same rows as running it on all of them."""
+    if isinstance(op, (Where, Extend, Project, Expand)):
+        return True
+    if isinstance(op, Join):
+        if op.kind == "innerunique":
+            # Left rows are deduplicated on the join keys, so their partitions
+            # must not share keys.
+            return str(key) in [str(col) for col in op.on]
+        return op.kind in LEFT_PRESERVING_JOINS
+    return False
+
+
+def _sort_columns(keys):
+    """The column names and directions of sort keys, for sorting results."""
+    names, ascending = [], []
+    for key in keys:
+        if isinstance(key, Column):
+            names.append(key.name)
+            ascending.append(key.ascending)
+        elif isinstance(key, str) and key.isidentifier():
+            # Kusto sorts in descending order by default.
+            names.append(key)
+            ascending.append(False)
+        else:
+            raise ValueError(f"Can't sort partitioned results by {key!r}.")
+    return names, ascending
+
+
 class TableExpr:
     """A table or tabular expression."""
 
-    def __init__(self, name, database, columns=None, ast=None):
+    def __init__(self, name, database, columns=None, ast=None, options=None):
         """A tabular expression.
 
         Parameters
@@ -533,20 +1017,75 @@ class TableExpr:
             data type names, or
             2. A list of Column instances.
         ast: list, default None
-            Abstract syntax tree used internally to store a nested list of expressions.
+            The expression's operators, first to last.
+        options: QueryOptions, default None
+            Request options for executing the expression, overriding the
+            database's options.
         """
-        self._ast = ast or []
+        self._node = Node.chain(ast or [])
         self.name = name
         self.database = database
+        self.options = options
         if columns is None:
             self.columns = {}
         elif isinstance(columns, (list, tuple)):
             self.columns = {c.name: c for c in columns}
         elif isinstance(columns, dict):
-            self.columns = {k: Column(k, v) for k, v in columns.items()}
+            self.columns = {
+                k: v if isinstance(v, Column) else Column(k, v) for k, v in columns.items()
+            }
         else:
             raise ValueError("columns must be a dict or a list of Columns.")
 
+    @property
+    def _ast(self):
+        """The expression's operators as a list, first to last."""
+        return [] if self._node is None else self._node.ops()
+
+    @property
+    def _last(self):
+        """The expression's last operator, or None."""
+        return None if self._node is None else self._node.op
+
+    def _derive(self, node, columns=None):
+        """A new expression on the same table ending at node.
+
+        The new expression shares this one's columns unless given new ones,
+        which must already be Columns.
+        """
+        expr = TableExpr.__new__(TableExpr)
+        expr._node = node
+        expr.name = self.name
+        expr.database = self.database
+        expr.options = self.options
+        expr.columns = self.columns if columns is None else columns
+        return expr
+
+    def _with_ast(self, ast, columns=None):
+        """A new expression on the same table with the given operators."""
+        return self._derive(Node.chain(ast), columns=columns)
+
+    def _chain(self, op, columns=None):
+        """A new expression with an operator appended."""
+        return self._derive(Node(op, self._node), columns=columns)
+
+    def _replace_last(self, *ops, columns=None):
+        """A new expression with the last operator replaced by ops."""
+        return self._derive(Node.chain(ops, self._node.parent), columns=columns)
+
+    def with_options(self, options):
+        """Set request options for executing this expression.
+
+        Parameters
+        ----------
+        options: QueryOptions
+            The options, overriding those of the database and any set earlier
+            on this expression.
+        """
+        expr = self._derive(self._node)
+        expr.options = options if self.options is None else self.options.merge(options)
+        return expr
+
     def __getattr__(self, name):
         try:
             return self.columns[name]
@@ -574,30 +1113,290 @@ class TableExpr:
         renamed = {k: Column(k, typeof(v)) for k, v in kwargs.items()}
         columns = {k: v for k, v in self.columns.items() if k in args}
         columns = {**columns, **renamed}
-        return TableExpr(
-            self.name, self.database, columns=columns, ast=[*self._ast, Project(*args, **kwargs)]
+        return self._chain(Project(*args, **kwargs), columns=columns)
+
+    def _options(self, options):
+        if self.options is None:
+            return options
+        return self.options.merge(options)
+
+    def _compile(self, options=None):
+        """Compile the expression to a query and its query parameters.
+
+        Literal values are only collected as query parameters if the
+        database's options merged with options set `parameterize`.
+        """
+        merged = merge_options(getattr(self.database, "options", None), options)
+        if merged is None or not merged.parameterize:
+            return str(self), {}
+        with collecting() as parameters:
+            query_str = str(self)
+        return query_str, parameters
+
+    def collect(self, options=None):
+        """Compile the expression to a query, execute it, and return results.
+
+        Parameters
+        ----------
+        options: QueryOptions, default None
+            Request options for this execution, overriding the expression's.
+        """
+        options = self._options(options)
+        query_str, parameters = self._compile(options)
+        return self.database.execute(query_str, options=options, parameters=parameters)
+
+    def iter_batches(self, chunk_rows=100_000, options=None):
+        """Compile the expression to a query, execute it, and iterate over the
+        results in DataFrame chunks of up to chunk_rows rows, streamed as they
+        arrive."""
+        options = self._options(options)
+        query_str, parameters = self._compile(options)
+        return self.database.execute_iter(
+            query_str, chunk_rows=chunk_rows, options=options, parameters=parameters
+        )
+
+    @staticmethod
+    def collect_many(exprs, max_workers=None, as_completed=False):
+        """Compile and execute many expressions concurrently.
+
+        Each expression is executed on its own database's client, on a bounded
+        thread pool. An expression that fails does not stop the others; its
+        exception is returned in place of its results.
+
+        Parameters
+        ----------
+        exprs: Iterable[TableExpr]
+            The expressions to execute.
+        max_workers: int, default None
+            The maximum number of queries to run at once. Defaults to 8.
+        as_completed: bool, default False
+            If False, return a list of results in the same order as exprs.
+            If True, return an iterator of (index, result) pairs in the order
+            the queries complete.
+        """
+        return run_many(
+            [expr.collect for expr in exprs], max_workers=max_workers, as_completed=as_completed
+        )
+
+    def _prefilter(self, *args):
+        """Filter the source table before any of the expression's operators."""
+        return self._with_ast([Where(*args), *self._ast])
+
+    def _window(self, column, lower, upper):
+        """Filter the source table to a time window."""
+        return self._prefilter((column >= lower) & (column < upper))
+
+    def _decompose(self):
+        """Split a final summarize into the expression computing partial
+        aggregates and the merge of its results, or return None."""
+        if not isinstance(self._last, Summarize):
+            return None
+        partial, merge = self._last.decompose()
+        return self._replace_last(partial), merge
+
+    def partitions(self, key, n):
+        """Split the expression into n disjoint partitions by the hash of a column.
+
+        Partition i keeps the source rows where `hash(key, n) == i`. The filter
+        is applied to the source table, before any joins or aggregations.
+
+        Parameters
+        ----------
+        key: str or Column
+            A column of the source table to partition by.
+        n: int
+            The number of partitions.
+
+        Returns
+        -------
+        List[TableExpr]
+            The n partitioned expressions.
+        """
+        if n < 1:
+            raise ValueError("n must be a positive integer.")
+        if isinstance(key, str):
+            key = Column(key, Any)
+        return [
+            self._prefilter(Infix(OP.EQ, Prefix(OP.HASH, key, n), i, dtype=bool)) for i in range(n)
+        ]
+
+    def _partitioned(self, key):
+        """Split the expression into the expression each partition runs and a
+        function merging the partitions' concatenated results.
+
+        Raises ValueError if the partitions' results can't be merged into the
+        expression's results.
+        """
+        ops = self._ast
+        expr, body, merge = self, ops, lambda frame: frame
+        last = ops[-1] if ops else None
+        if isinstance(last, Summarize):
+            expr, aggregates = self._decompose()
+            body = ops[:-1]
+
+            def merge(frame):
+                return aggregates.merge(frame, self.database)
+
+        elif isinstance(last, Count):
+            body = ops[:-1]
+
+            def merge(frame):
+                return pd.DataFrame({"Count": [frame["Count"].sum()]})
+
+        elif isinstance(last, Distinct):
+            body = ops[:-1]
+
+            def merge(frame):
+                return frame.drop_duplicates(ignore_index=True)
+
+        elif isinstance(last, (Order, Top, Limit)):
+            # Each partition's first rows include the overall first rows.
+            n = None if isinstance(last, Order) else last.n
+            keys = last.args if isinstance(last, (Order, Top)) else ()
+            body = ops[:-1]
+            if isinstance(last, Limit) and body and isinstance(body[-1], Order):
+                keys = body[-1].args
+                body = body[:-1]
+            names, ascending = _sort_columns(keys)
+
+            def merge(frame):
+                if names:
+                    frame = frame.sort_values(names, ascending=ascending, ignore_index=True)
+                return frame if n is None else frame.head(n)
+
+        for op in body:
+            if not _concatenable(op, key):
+                name = f"{op.kind} join" if isinstance(op, Join) else type(op).__name__
+                raise ValueError(
+                    f"Can't merge the partitions of an expression with {name}, since "
+                    "concatenating their results doesn't give the expression's results."
+                )
+        return expr, merge
+
+    def collect_partitioned(self, key, n, max_workers=None):
+        """Execute the expression as n hash partitions, concurrently, and
+        return their results concatenated.
+
+        Each partition is a smaller query, so a large extract stays under the
+        result size limits and is spread over the cluster. If the expression
+        ends with a summarize, the partitions compute partial aggregates that
+        are merged into the final results; see `Summarize.decompose`. A final
+        count is summed, and a final distinct, order, limit or top is applied
+        again to the concatenated results. Other operators that don't work
+        on each source row independently, such as a summarize followed by
+        other operators or a join that keeps right side rows, raise an error.
+
+        Parameters
+        ----------
+        key: str or Column
+            A column of the source table to partition by.
+        n: int
+            The number of partitions.
+        max_workers: int, default None
+            The maximum number of partitions to run at once. Defaults to 8.
+
+        Returns
+        -------
+        pandas.DataFrame
+            The results of all partitions.
+        """
+        expr, merge = self._partitioned(key)
+        results = TableExpr.collect_many(expr.partitions(key, n), max_workers=max_workers)
+        for result in results:
+            if isinstance(result, Exception):
+                raise result
+        return merge(pd.concat(results, ignore_index=True))
+
+    def iter_windowed(
+        self,
+        column,
+        start,
+        end,
+        window=DEFAULT_WINDOW,
+        max_workers=None,
+        min_window=MIN_WINDOW,
+        target_seconds=DEFAULT_TARGET_SECONDS,
+    ):
+        """Execute the expression once per time window, concurrently.
+
+        Each window filters the source table with
+        `column >= start and column < end`, before any of the expression's
+        operators, and yields the expression's results on those rows. A window
+        whose results are too large or that times out is split in half and
+        retried, and slow windows make the following windows smaller.
+
+        Parameters
+        ----------
+        column: str or Column
+            The datetime column of the source table to partition by.
+        start: datetime
+            The start of the range (inclusive).
+        end: datetime
+            The end of the range (exclusive).
+        window: timedelta, default 1 day
+            The initial and largest window size.
+        max_workers: int, default None
+            The maximum number of windows to run at once. Defaults to 8.
+        min_window: timedelta, default 1 minute
+            Windows this small are not split further; their errors are raised.
+        target_seconds: float, default 60
+            The longest a window should take to run.
+
+        Yields
+        ------
+        Tuple[datetime, datetime, pandas.DataFrame]
+            The start, end and results of each window, in the order they complete.
+        """
+        if isinstance(column, str):
+            # The column may be projected or aggregated away later.
+            column = Column(column, datetime)
+
+        def run(lower, upper):
+            return self._window(column, lower, upper).collect()
+
+        return iter_windows(
+            run,
+            start,
+            end,
+            window=window,
+            max_workers=max_workers,
+            min_window=min_window,
+            target_seconds=target_seconds,
         )
 
-    def collect(self):
-        """Compile the expression to a query, execute it, and return results."""
-        query_str = str(self)
-        return self.database.execute(query_str)
+    def collect_windowed(self, column, start, end, window=DEFAULT_WINDOW, **kwargs):
+        """Execute the expression once per time window, concurrently, and
+        return the windows' results concatenated in time order.
+
+        Takes the same parameters as `iter_windowed`. The windows' results
+        are merged like the partitions of `collect_partitioned`: a final
+        summarize computes partial aggregates that are merged into the final
+        results, a final count is summed, a final distinct, order, limit or
+        top is applied again, and other expressions whose results can't be
+        merged raise an error.
+        """
+        expr, merge = self._partitioned(column)
+        windows = expr.iter_windowed(column, start, end, window=window, **kwargs)
+        return merge(concat_windows(windows))
+
+    async def collect_async(self, options=None):
+        """Compile the expression to a query, execute it without blocking the
+        event loop, and return results."""
+        options = self._options(options)
+        query_str, parameters = self._compile(options)
+        return await self.database.execute_async(query_str, options=options, parameters=parameters)
 
     def count(self):
         """Get the count of rows that would be returned by the expression."""
-        return TableExpr(self.name, self.database, columns=self.columns, ast=[*self._ast, Count()])
+        return self._chain(Count())
 
     def distinct(self, *args):
         """Distinct values in the given column(s)."""
-        return TableExpr(
-            self.name, self.database, columns=self.columns, ast=[*self._ast, Distinct(*args)]
-        )
+        return self._chain(Distinct(*args))
 
     def where(self, *args):
         """Filter the expression by one or more predicates."""
-        return TableExpr(
-            self.name, self.database, columns=self.columns, ast=[*self._ast, Where(*args)]
-        )
+        return self._chain(Where(*args))
 
     def join(self, right, on, kind, *args, strategy=None):
         """Join this table expression to another.
@@ -623,12 +1422,8 @@ class TableExpr:
             If "shuffle" then a shuffle join is used.
             If another value or None, a single-node join strategy is used.
         """
-        return TableExpr(
-            self.name,
-            self.database,
-            columns=self.columns,
-            ast=[*self._ast, Join(right, on, kind=kind, strategy=strategy)],
-        )
+        join = Join(right, on, kind=kind, strategy=strategy, left_columns=list(self.columns))
+        return self._chain(join)
 
     def summarize(self, by=None, shuffle=False, shufflekey=None, num_partitions=None, **kwargs):
         """Aggregate by columns.
@@ -668,20 +1463,15 @@ class TableExpr:
 
         kwarg_cols = {k: Column(k, typeof(v)) for k, v in kwargs.items()}
         columns = {**by_cols, **kwarg_cols}
-        return TableExpr(
-            self.name,
-            self.database,
+        return self._chain(
+            Summarize(
+                by=by,
+                shuffle=shuffle,
+                shufflekey=shufflekey,
+                num_partitions=num_partitions,
+                **kwargs,
+            ),
             columns=columns,
-            ast=[
-                *self._ast,
-                Summarize(
-                    by=by,
-                    shuffle=shuffle,
-                    shufflekey=shufflekey,
-                    num_partitions=num_partitions,
-                    **kwargs,
-                ),
-            ],
         )
 
     def extend(self, **kwargs):
@@ -697,9 +1487,7 @@ class TableExpr:
             if key not in self.columns:
                 new_cols[key] = Column(key, typeof(val))
         columns = {**self.columns, **new_cols}
-        new_inst = TableExpr(
-            self.name, self.database, columns=columns, ast=[*self._ast, Extend(**kwargs)]
-        )
+        new_inst = self._chain(Extend(**kwargs), columns=columns)
         return new_inst
 
     def order(self, *args):
@@ -710,9 +1498,7 @@ class TableExpr:
         args: array
             The columns to sort by.
         """
-        return TableExpr(
-            self.name, self.database, columns=self.columns, ast=[*self._ast, Order(*args)]
-        )
+        return self._chain(Order(*args))
 
     def sort(self, *args):
         """Order the result set by the given columns. Alias for .order().
@@ -724,11 +1510,59 @@ class TableExpr:
         """
         return self.order(*args)
 
+    def top(self, n, *args):
+        """The first n rows sorted by the given columns.
+
+        `order` or `sort` followed directly by `limit` or `take` compiles to
+        the same operator.
+
+        Parameters
+        ----------
+        n: int
+            The number of rows to return.
+        args: array
+            The columns to sort by, descending unless marked with asc().
+        """
+        if not args:
+            raise ValueError("top needs at least one column to sort by.")
+        return self._chain(Top(n, *args))
+
+    def top_nested(self, n, of, ascending=False, others=None, **kwargs):
+        """Hierarchical top values: the top n values of an expression by an
+        aggregation, within each group of the previous level.
+
+        Calling top_nested directly after top_nested adds a level to the same
+        operator.
+
+        Parameters
+        ----------
+        n: int
+            The number of values to keep at this level, or None for all.
+        of: Column or str
+            The column or expression whose values are ranked.
+        ascending: bool, default False
+            If True, keep the values with the smallest aggregates.
+        others: Any, default None
+            If not None, aggregate the values that aren't kept into one row
+            with this value.
+        kwargs: Dict
+            One aliased aggregation to rank values by, e.g. total=foo.sum()
+        """
+        if len(kwargs) != 1:
+            raise ValueError("top_nested takes exactly one aliased aggregation.")
+        ((alias, agg),) = kwargs.items()
+        if isinstance(of, str):
+            of = self.columns.get(of, Column(of, Any))
+        level = (n, of, alias, agg, ascending, others)
+        columns = {str(of): Column(str(of), typeof(of)), alias: Column(alias, typeof(agg))}
+        if isinstance(self._last, TopNested):
+            op = TopNested(*self._last.levels, level)
+            return self._replace_last(op, columns={**self.columns, **columns})
+        return self._chain(TopNested(level), columns=columns)
+
     def evaluate(self, expr):
         """Evaluate a Kusto plugin expression."""
-        return TableExpr(
-            self.name, self.database, columns=self.columns, ast=[*self._ast, Evaluate(expr)]
-        )
+        return self._chain(Evaluate(expr))
 
     def limit(self, n):
         """Limit the result set to the first n rows.
@@ -738,7 +1572,7 @@ class TableExpr:
         n: int
             The number of rows to return.
         """
-        return TableExpr(self.name, self.database, columns=self.columns, ast=[*self._ast, Limit(n)])
+        return self._chain(Limit(n))
 
     def take(self, n):
         """Limit the result set to the first n rows. Alias for .limit().
@@ -758,9 +1592,7 @@ class TableExpr:
         n: int
             The number of rows to sample.
         """
-        return TableExpr(
-            self.name, self.database, columns=self.columns, ast=[*self._ast, Sample(n)]
-        )
+        return self._chain(Sample(n))
 
     def sample_distinct(self, n, column):
         """Randomly sample n rows from the dataset with distinct values in column.
@@ -774,12 +1606,7 @@ class TableExpr:
         """
         if isinstance(column, str):
             column = self.columns[column]
-        return TableExpr(
-            self.name,
-            self.database,
-            columns=self.columns,
-            ast=[*self._ast, SampleDistinct(n, column)],
-        )
+        return self._chain(SampleDistinct(n, column))
 
     def mv_expand(self, column):
         """Expand a dynamic column into one row per value.
@@ -791,20 +1618,40 @@ class TableExpr:
         """
         if isinstance(column, str):
             column = self.columns[column]
-        return TableExpr(
-            self.name,
-            self.database,
-            columns=self.columns,
-            ast=[*self._ast, Expand(column)],
+        return self._chain(Expand(column))
+
+    @property
+    def fingerprint(self):
+        """A stable hex digest of the expression's structure.
+
+        Expressions on the same table with structurally equal operators have
+        the same fingerprint, in any process, so it can be used as a cache key
+        without compiling the query. Request options are not included.
+        """
+        operators = "" if self._node is None else self._node.fingerprint()
+        return _digest(
+            str(self.database.cluster), str(self.database.database), self.name, operators
         )
 
+    def _compile_ops(self):
+        """Optimize and compile the operators, one line each."""
+        # pylint: disable=import-outside-toplevel
+        from kusto_tool.optimize import optimize
+
+        return "".join(f"{render(op)}\n" for op in optimize(self._ast))
+
     def __str__(self):
-        ops = [
-            f"cluster('{self.database.cluster}').database('{self.database.database}').['{self.name}']",
-            *self._ast,
-        ]
-        query_str = "\n".join([str(op) for op in ops]) + "\n"
-        return query_str
+        database = f"cluster('{self.database.cluster}').database('{self.database.database}')"
+        source = f"{database}.['{self.name}']"
+        if self._node is None:
+            return f"{source}\n"
+        if is_collecting():
+            return f"{source}\n{self._compile_ops()}"
+        if self._node.text is None:
+            # Only the operators the optimizer changed or added are compiled
+            # again; the others reuse their cached text.
+            self._node.text = self._compile_ops()
+        return f"{source}\n{self._node.text}"
 
 
 __all__ = ["TableExpr"]
@@ -0,0 +1,405 @@
+"""Rule-based rewrites of a table expression's operators before compiling.
+
+Each rule keeps the query's results the same. Filters are merged and moved as
+close to the source table as they can go, so Kusto reads fewer rows and can
+use its indexes:
+
+- Adjacent `where` operators are merged into one.
+- Predicates that only reference columns an `extend` doesn't define are moved
+  ahead of it.
+- Predicates are moved ahead of a `project`, with renamed columns replaced by
+  the columns they were renamed from. Predicates on computed columns stay.
+- Predicates on the left side's columns are moved ahead of `inner`, `left`,
+  `leftsemi` and `leftanti` joins, and ahead of `innerunique` joins if they
+  only reference the join keys.
+- Predicates on datetime columns are put first in each `where`, so Kusto can
+  skip extents outside the time range before evaluating the rest.
+- `order` directly followed by `limit` becomes `top`, so Kusto keeps only the
+  top rows instead of sorting all of them.
+- If later operators only use some of the source table's columns, an early
+  `project` of just those columns is added after the leading `where`s, and a
+  join's right side is projected to the columns used from it, so wide tables
+  don't carry unused columns through the query.
+"""
+from copy import copy
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+from kusto_tool.expression import (
+    LEFT_PRESERVING_JOINS,
+    OP,
+    Between,
+    Column,
+    Count,
+    Distinct,
+    Expand,
+    Extend,
+    Infix,
+    Join,
+    Limit,
+    ListLit,
+    Order,
+    Prefix,
+    Project,
+    Property,
+    Sample,
+    SampleDistinct,
+    Summarize,
+    Top,
+    TopNested,
+    Where,
+)
+
+LITERAL_TYPES = (str, bool, int, float, Decimal, datetime, timedelta, type(None))
+DATETIME_TYPES = (datetime, "datetime", "date")
+# Operators whose output columns don't depend on their input's columns.
+RESTRICTING = (Project, Summarize, Distinct, Count, TopNested)
+# Joins whose output only has one side's columns.
+LEFT_ONLY_JOINS = ("leftsemi", "leftanti")
+RIGHT_ONLY_JOINS = ("rightsemi", "rightanti")
+
+
+def references(expr):
+    """The names of the columns an expression references, or None if they
+    can't be known, as for predicates written as strings."""
+    if isinstance(expr, Column):
+        return {expr.name}
+    if isinstance(expr, Infix):
+        base, links = expr.flatten()
+        return _union(base, *[link.rhs for link in links])
+    if isinstance(expr, Prefix):
+        return _union(*expr.terms)
+    if isinstance(expr, Between):
+        return _union(expr.lhs, expr.left, expr.right)
+    if isinstance(expr, ListLit):
+        return _union(*expr.args)
+    if isinstance(expr, Property):
+        return references(expr.column)
+    return None
+
+
+def _union(*terms):
+    names = set()
+    for term in terms:
+        if isinstance(term, LITERAL_TYPES):
+            # Strings inside expressions are quoted as literals.
+            continue
+        term_names = references(term)
+        if term_names is None:
+            return None
+        names |= term_names
+    return names
+
+
+def _names(items):
+    """The column names referenced by a list of columns, column names and
+    expressions, or None if they can't be known."""
+    names = set()
+    for item in items:
+        if isinstance(item, str):
+            if not item.isidentifier():
+                return None
+            item_names = {item}
+        else:
+            item_names = references(item)
+        if item_names is None:
+            return None
+        names |= item_names
+    return names
+
+
+def substitute(expr, columns):
+    """A copy of an expression with columns replaced by name."""
+    if isinstance(expr, Column):
+        return columns.get(expr.name, expr)
+    if isinstance(expr, Infix):
+        base, links = expr.flatten()
+        result = substitute(base, columns)
+        for link in links:
+            rhs = substitute(link.rhs, columns)
+            result = Infix(link.op, result, rhs, dtype=link.dtype)
+        return result
+    if isinstance(expr, Prefix):
+        terms = [substitute(term, columns) for term in expr.terms]
+        return Prefix(expr.op, *terms, agg=expr.agg, dtype=expr.dtype)
+    if isinstance(expr, Between):
+        return Between(
+            substitute(expr.lhs, columns),
+            substitute(expr.left, columns),
+            substitute(expr.right, columns),
+            negate=expr.negate,
+        )
+    if isinstance(expr, ListLit):
+        return ListLit(*[substitute(arg, columns) for arg in expr.args])
+    if isinstance(expr, Property):
+        return Property(substitute(expr.column, columns), expr.prop)
+    return expr
+
+
+def _passable(op):
+    """The column names that decide which predicates can move ahead of op, or
+    None if no predicate can."""
+    if isinstance(op, Extend):
+        # The columns it defines.
+        return frozenset(op.kwargs)
+    if isinstance(op, Project):
+        # The columns it renames.
+        return frozenset(op.renamed_columns)
+    if isinstance(op, Join):
+        if op.kind in LEFT_ONLY_JOINS:
+            # Only the left side's columns are in the output.
+            return frozenset()
+        if op.kind == "innerunique":
+            # Deduplicating the left side on the keys keeps an arbitrary row,
+            # so only predicates on the keys keep the same rows.
+            return frozenset(str(key) for key in op.on)
+        if op.kind in LEFT_PRESERVING_JOINS and op.left_columns:
+            # Right columns whose names clash with left columns are renamed,
+            # so only predicates on the left side's columns can be moved.
+            return frozenset(op.left_columns)
+    return None
+
+
+def _push_past(op, passable, predicate, names):
+    """The predicate rewritten to run before op with the same results, or None
+    if it can't be.
+
+    passable is `_passable(op)` and names the columns the predicate
+    references.
+    """
+    if names is None or passable is None:
+        return None
+    if isinstance(op, Extend):
+        return None if names & passable else predicate
+    if isinstance(op, Project):
+        renamed = {}
+        for name in names & passable:
+            source = op.renamed_columns[name]
+            if not isinstance(source, Column):
+                return None
+            renamed[name] = source
+        return substitute(predicate, renamed) if renamed else predicate
+    if isinstance(op, Join):
+        if op.kind in LEFT_ONLY_JOINS or names <= passable:
+            return predicate
+    return None
+
+
+def is_datetime_predicate(predicate):
+    """Whether a predicate filters on a datetime column."""
+    # and/or chains are walked with a stack, since they can be very long.
+    stack = [predicate]
+    while stack:
+        predicate = stack.pop()
+        if isinstance(predicate, Infix) and predicate.op in (OP.AND, OP.OR):
+            stack.extend([predicate.rhs, predicate.lhs])
+        elif not isinstance(predicate, (Infix, Between)):
+            return False
+        elif not (isinstance(predicate.lhs, Column) and predicate.lhs.dtype in DATETIME_TYPES):
+            return False
+    return True
+
+
+def _push_where(ops, floor, predicate):
+    """Add a predicate to the end of ops, moved as early as it can go, but not
+    before floor.
+
+    The `where` operators in ops are lists of their predicates, so adding one
+    doesn't copy the rest, and other operators are paired with `_passable`.
+    """
+    # Only computed once there is an operator to move past.
+    names = None
+    position = len(ops)
+    while position > floor:
+        op = ops[position - 1]
+        if isinstance(op, list):
+            position -= 1
+            continue
+        if names is None:
+            names = references(predicate)
+        pushed = _push_past(*op, predicate, names)
+        if pushed is None:
+            break
+        if pushed is not predicate:
+            predicate = pushed
+            names = references(predicate)
+        position -= 1
+    if position < len(ops) and isinstance(ops[position], list):
+        ops[position].append(predicate)
+    else:
+        ops.insert(position, [predicate])
+
+
+def push_down_filters(ast):
+    """Merge adjacent `where` operators and move predicates earlier."""
+    ops = []
+    # Predicates never move ahead of the last operator none can pass.
+    floor = 0
+    for op in ast:
+        if isinstance(op, Where):
+            if not op.expressions:
+                ops.append([])
+            for predicate in op.expressions:
+                _push_where(ops, floor, predicate)
+        else:
+            passable = _passable(op)
+            ops.append((op, passable))
+            if passable is None:
+                floor = len(ops)
+    # Keep the original where if its predicates are unchanged, so its
+    # compiled text is reused.
+    wheres = {_identity(op.expressions): op for op in ast if isinstance(op, Where)}
+    return [
+        wheres.get(_identity(op)) or Where(*op) if isinstance(op, list) else op[0] for op in ops
+    ]
+
+
+def _identity(predicates):
+    return tuple(id(predicate) for predicate in predicates)
+
+
+def datetime_predicates_first(ast):
+    """Put the datetime predicates of each `where` first, keeping the order
+    of the rest."""
+    ops = []
+    for op in ast:
+        if isinstance(op, Where) and len(op.expressions) > 1:
+            predicates = sorted(
+                op.expressions, key=lambda predicate: not is_datetime_predicate(predicate)
+            )
+            if _identity(predicates) != _identity(op.expressions):
+                op = Where(*predicates)
+        ops.append(op)
+    return ops
+
+
+def _join_needs(op, needed):
+    """The columns needed from each side of a join, given the columns needed
+    from its output. Either is None if all columns are needed."""
+    keys = {str(key) for key in op.on}
+    if op.kind in LEFT_ONLY_JOINS:
+        return None if needed is None else needed | keys, keys
+    if op.kind in RIGHT_ONLY_JOINS:
+        return keys, None if needed is None else needed | keys
+    left = set(op.left_columns or [])
+    right = set(getattr(op.right, "columns", None) or {})
+    if needed is None or not left or not right:
+        return None, None
+    left_needed, right_needed = set(keys), set(keys)
+    for name in needed:
+        if name in left:
+            left_needed.add(name)
+        elif name in right:
+            right_needed.add(name)
+        elif name[:-1] in left & right and name.endswith("1"):
+            # The right column, renamed because the left has one of that name.
+            # Keep both so it is still renamed.
+            left_needed.add(name[:-1])
+            right_needed.add(name[:-1])
+        else:
+            return None, None
+    return left_needed, right_needed
+
+
+def _needs(op, needed):
+    """The columns needed from an operator's input, given the columns needed
+    from its output, or None if all of them are."""
+    if isinstance(op, Project):
+        return _names([*op.columns, *op.renamed_columns.values()])
+    if isinstance(op, Summarize):
+        return _names([*op.by, *op.expressions.values()])
+    if isinstance(op, Distinct):
+        return _names(op.columns)
+    if isinstance(op, Count):
+        return set()
+    if isinstance(op, TopNested):
+        terms = []
+        for _, of, _, agg, _, _ in op.levels:
+            terms.extend([of, agg])
+        return _names(terms)
+    if isinstance(op, (Limit, Sample)):
+        return needed
+    if needed is None:
+        return None
+    if isinstance(op, Where):
+        names = _names(op.expressions)
+    elif isinstance(op, Extend):
+        # Strings are quoted as literals by extend, not read as column names.
+        names = _union(*op.kwargs.values())
+        needed = needed - set(op.kwargs)
+    elif isinstance(op, (Order, Top)):
+        names = _names(op.args)
+    elif isinstance(op, SampleDistinct):
+        names = _names([op.of])
+    elif isinstance(op, Expand):
+        names = _names([op.column])
+    else:
+        return None
+    return None if names is None else needed | names
+
+
+def _project_right(op, needed):
+    """A copy of a join whose right side is projected to the needed columns."""
+    # pylint: disable=protected-access
+    right = op.right
+    columns = set(getattr(right, "columns", None) or {})
+    if columns and needed >= columns:
+        return op
+    # Reuse the pruned join, and its compiled text, when compiling again.
+    cache = getattr(op, "_pruned", None)
+    if cache is None:
+        cache = op._pruned = {}
+    key = frozenset(needed)
+    if key not in cache:
+        pruned = copy(op)
+        pruned._pruned = None
+        pruned._text = None
+        pruned.right = right._chain(Project(*sorted(needed)))
+        cache[key] = pruned
+    return cache[key]
+
+
+def prune_columns(ast):
+    """Project the source table and the right side of joins to the columns
+    that later operators use."""
+    ops = list(ast)
+    # The project goes after the leading filters, which read the table as is.
+    start = 0
+    while start < len(ops) and isinstance(ops[start], Where):
+        start += 1
+    needed = None
+    for position in range(len(ops) - 1, start - 1, -1):
+        op = ops[position]
+        if isinstance(op, Join):
+            needed, right_needed = _join_needs(op, needed)
+            if right_needed is not None and hasattr(op.right, "_chain"):
+                ops[position] = _project_right(op, right_needed)
+        else:
+            needed = _needs(op, needed)
+    if not needed or (start < len(ops) and isinstance(ops[start], RESTRICTING)):
+        return ops
+    ops.insert(start, Project(*sorted(needed)))
+    return ops
+
+
+def order_limit_to_top(ast):
+    """Replace `order` directly followed by `limit` with `top`."""
+    ops = []
+    for op in ast:
+        if isinstance(op, Limit) and ops and isinstance(ops[-1], Order):
+            op = Top(op.n, *ops.pop().args)
+        ops.append(op)
+    return ops
+
+
+RULES = [push_down_filters, order_limit_to_top, prune_columns, datetime_predicates_first]
+
+
+def optimize(ast):
+    """Apply every rule to a list of operators, returning a new list.
+
+    The operators passed in are not modified.
+    """
+    for rule in RULES:
+        ast = rule(ast)
+    return ast
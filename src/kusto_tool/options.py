@@ -0,0 +1,140 @@
+"""Per-query request options, set at the cluster, database, expression or call level."""
+from dataclasses import dataclass, fields
+from datetime import timedelta
+from typing import Any, Collection, Dict, Optional, Union
+
+from azure.kusto.data import ClientRequestProperties
+
+RESULTS_CACHE_MAX_AGE = "query_results_cache_max_age"
+NOTRUNCATION = "notruncation"
+MAX_MEMORY_PER_ITERATOR = "maxmemoryconsumptionperiterator"
+
+
+def _timespan(duration):
+    """Format a timedelta as a Kusto timespan, e.g. 1.02:03:04."""
+    seconds = int(duration.total_seconds())
+    days, seconds = divmod(seconds, 86400)
+    hours, seconds = divmod(seconds, 3600)
+    minutes, seconds = divmod(seconds, 60)
+    span = f"{hours:02d}:{minutes:02d}:{seconds:02d}"
+    return f"{days}.{span}" if days else span
+
+
+@dataclass(frozen=True)
+class QueryOptions:
+    """Options sent with a query as client request properties.
+
+    Options can be given to a `Cluster`, a `KustoDatabase`, a `TableExpr` (with
+    `with_options`) and to each call of `execute` or `collect`. They are merged
+    field by field, and the most specific level that sets a field wins.
+
+    Attributes
+    ----------
+    results_cache_max_age: timedelta
+        Serve the results from the server's query results cache if they were
+        cached less than this long ago, and cache them otherwise.
+    notruncation: bool
+        If True, don't truncate results at 500,000 records or 64 MB.
+    max_memory_per_iterator: int
+        The maximum memory, in bytes, that a query iterator may use.
+    server_timeout: timedelta
+        How long the server may run the query. Also extends the client's
+        request timeout.
+    client_request_id: str
+        An ID correlating the request with server logs and `.show queries`.
+    application: str
+        The application name reported to the server.
+    options: Dict[str, Any]
+        Any other request options, by their Kusto option name.
+    parameterize: bool or Collection[str]
+        If True, send the literal values of expressions and the values of
+        template parameters as query parameters instead of in the query text,
+        so queries that differ only in values share a query plan and results
+        cache entry. Templates must then use parameters as values, not inside
+        quotes or as table names. If a collection of names, only send those
+        template parameters as query parameters. Not sent to the server.
+    """
+
+    results_cache_max_age: Optional[timedelta] = None
+    notruncation: Optional[bool] = None
+    max_memory_per_iterator: Optional[int] = None
+    server_timeout: Optional[timedelta] = None
+    client_request_id: Optional[str] = None
+    application: Optional[str] = None
+    options: Optional[Dict[str, Any]] = None
+    parameterize: Optional[Union[bool, Collection[str]]] = None
+
+    def merge(self, other):
+        """These options, overridden by the fields that other sets.
+
+        Parameters
+        ----------
+        other: QueryOptions or None
+            The more specific options.
+
+        Returns
+        -------
+        QueryOptions
+            The merged options.
+        """
+        if other is None:
+            return self
+        merged = {}
+        for field in fields(self):
+            value = getattr(other, field.name)
+            merged[field.name] = getattr(self, field.name) if value is None else value
+        if self.options and other.options:
+            merged["options"] = {**self.options, **other.options}
+        return QueryOptions(**merged)
+
+    def properties(self):
+        """The options as ClientRequestProperties for the Kusto client."""
+        properties = ClientRequestProperties()
+        for name, value in (self.options or {}).items():
+            properties.set_option(name, value)
+        if self.results_cache_max_age is not None:
+            properties.set_option(RESULTS_CACHE_MAX_AGE, _timespan(self.results_cache_max_age))
+        if self.notruncation is not None:
+            properties.set_option(NOTRUNCATION, self.notruncation)
+        if self.max_memory_per_iterator is not None:
+            properties.set_option(MAX_MEMORY_PER_ITERATOR, self.max_memory_per_iterator)
+        if self.server_timeout is not None:
+            properties.set_option(
+                ClientRequestProperties.request_timeout_option_name, self.server_timeout
+            )
+        properties.client_request_id = self.client_request_id
+        properties.application = self.application
+        return properties
+
+
+def merge_options(*levels):
+    """Merge options from the least to the most specific level, skipping None.
+
+    Returns
+    -------
+    QueryOptions or None
+        The merged options, or None if no level has options.
+    """
+    merged = None
+    for options in levels:
+        if options is not None:
+            merged = options if merged is None else merged.merge(options)
+    return merged
+
+
+def server_cache_hit(response):
+    """Whether a query response was served from the server's results cache.
+
+    The server adds a ServerCache row to the ExtendedProperties table of
+    responses served from its query results cache.
+    """
+    for table in getattr(response, "tables", None) or []:
+        if table.table_name.lstrip("@") != "ExtendedProperties":
+            continue
+        names = [column.column_name for column in table.columns]
+        if "Key" not in names:
+            continue
+        key = names.index("Key")
+        if any(row[key] == "ServerCache" for row in table.raw_rows):
+            return True
+    return False
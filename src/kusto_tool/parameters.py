@@ -0,0 +1,182 @@
+"""Query parameters, sent alongside a query instead of baked into its text.
+
+A query whose literal values are inlined changes text with every value, so the
+server can't reuse its query plan or results cache across values. With query
+parameters, the query text declares typed parameters with
+`declare query_parameters(...)` and refers to them by name, and the values are
+sent as client request properties.
+"""
+import json
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+
+from azure.kusto.data import ClientRequestProperties
+
+PREFIX = "_kt_p"
+
+# Checked in order, since bool is a subclass of int.
+SCALAR_TYPES = (
+    (bool, "bool"),
+    (int, "long"),
+    (float, "real"),
+    (Decimal, "decimal"),
+    (str, "string"),
+    (datetime, "datetime"),
+    (timedelta, "timespan"),
+)
+LIST_TYPES = (list, tuple, set, frozenset, type({}.keys()))
+
+_collector = ContextVar("kusto_tool_parameters", default=None)
+
+
+def datetime_literal(val):
+    """Format a datetime as a Kusto datetime literal, in UTC."""
+    if val.tzinfo is not None:
+        # Kusto datetimes are UTC.
+        val = val.astimezone(timezone.utc).replace(tzinfo=None)
+    nanos = getattr(val, "nanosecond", 0)
+    if nanos:
+        # Kusto datetimes have 100ns ticks; isoformat() only has microseconds.
+        ticks = (val.microsecond * 1000 + nanos) // 100
+        return f"datetime({val.strftime('%Y-%m-%dT%H:%M:%S')}.{ticks:07d})"
+    return f"datetime({val.isoformat()})"
+
+
+def _scalar_type(val):
+    for cls, kusto_type in SCALAR_TYPES:
+        if isinstance(val, cls):
+            return kusto_type
+    return None
+
+
+def is_parameter(val):
+    """Whether a value can be sent as a query parameter: a scalar of a type
+    with a Kusto equivalent, or a list of such scalars."""
+    if isinstance(val, LIST_TYPES):
+        return all(_scalar_type(item) is not None for item in val)
+    return _scalar_type(val) is not None
+
+
+def parameter_type(val):
+    """The Kusto type to declare a parameter with this value as."""
+    if isinstance(val, LIST_TYPES):
+        return "dynamic"
+    kusto_type = _scalar_type(val)
+    if kusto_type is None:
+        raise TypeError(f"Can't send a {type(val).__name__} as a query parameter.")
+    return kusto_type
+
+
+def _json(val):
+    if isinstance(val, datetime):
+        return datetime_literal(val)[len("datetime(") : -1]
+    if isinstance(val, timedelta):
+        return str(val)
+    if isinstance(val, Decimal):
+        return str(val)
+    raise TypeError(f"Can't convert a {type(val).__name__} to JSON.")
+
+
+def parameter_value(val):
+    """Format a parameter value as the server expects it: strings as they are,
+    and other types as Kusto literals."""
+    kusto_type = parameter_type(val)
+    if kusto_type == "dynamic":
+        return f"dynamic({json.dumps(list(val), default=_json)})"
+    if kusto_type == "string":
+        return val
+    if kusto_type == "bool":
+        return "true" if val else "false"
+    if kusto_type == "datetime":
+        return datetime_literal(val)
+    if kusto_type == "timespan":
+        return f"time({val.total_seconds()}s)"
+    return str(val)
+
+
+def declare(parameters):
+    """The `declare query_parameters` statement for a dict of parameters."""
+    declared = ", ".join(f"{name}:{parameter_type(val)}" for name, val in parameters.items())
+    return f"declare query_parameters({declared});\n"
+
+
+def set_parameters(properties, parameters):
+    """Set parameter values on ClientRequestProperties, creating them if None."""
+    if properties is None:
+        properties = ClientRequestProperties()
+    for name, val in parameters.items():
+        properties.set_parameter(name, parameter_value(val))
+    return properties
+
+
+def split_parameters(kwargs, names=None):
+    """Split template parameters into query parameters and the rest.
+
+    Parameters
+    ----------
+    kwargs: Dict[str, Any]
+        Jinja2 template parameters.
+    names: Collection[str], default None
+        The template parameters to send as query parameters. If None, every
+        template parameter that can be a query parameter is.
+
+    Returns
+    -------
+    Tuple[Dict[str, Any], Dict[str, Any]]
+        The template parameters, with those sent as query parameters replaced
+        by their names, and the query parameters.
+    """
+    rendered = {}
+    parameters = {}
+    for name, val in kwargs.items():
+        if (names is None or name in names) and is_parameter(val):
+            rendered[name] = name
+            parameters[name] = list(val) if isinstance(val, LIST_TYPES) else val
+        else:
+            rendered[name] = val
+    return rendered, parameters
+
+
+@contextmanager
+def collecting():
+    """Collect the literals of expressions compiled in this block as query
+    parameters, yielding the dict they are collected into."""
+    parameters = {}
+    # Parameter names by the type and value of what they hold.
+    token = _collector.set((parameters, {}))
+    try:
+        yield parameters
+    finally:
+        _collector.reset(token)
+
+
+def is_collecting():
+    """Whether literals are being collected as query parameters."""
+    return _collector.get() is not None
+
+
+def _key(val):
+    """A hashable key for a parameter value, equal only for values of the same
+    type, so 1, 1.0 and True don't share a parameter."""
+    if isinstance(val, list):
+        return (list, tuple(_key(item) for item in val))
+    return (type(val), val)
+
+
+def collect(val):
+    """The name of a parameter holding val, if parameters are being collected
+    and val can be one, else None. Equal values share a parameter."""
+    collector = _collector.get()
+    if collector is None or not is_parameter(val):
+        return None
+    parameters, names = collector
+    if isinstance(val, LIST_TYPES):
+        val = list(val)
+    key = _key(val)
+    name = names.get(key)
+    if name is None:
+        name = names[key] = f"{PREFIX}{len(parameters)}"
+        parameters[name] = val
+    return name
@@ -0,0 +1,135 @@
+"""Split large queries into time windows that run concurrently.
+
+A query over a long time range can exceed Kusto's result size limits or its
+execution timeout. Running it once per time window keeps each response small
+and lets the windows run in parallel. The window size adapts as results come
+in: a window that is truncated or times out is split in half and retried, and
+a slow window makes the following windows smaller.
+"""
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import timedelta
+from timeit import default_timer as timer
+
+import pandas as pd
+from loguru import logger
+
+from kusto_tool.batch import DEFAULT_MAX_WORKERS
+
+DEFAULT_WINDOW = timedelta(days=1)
+MIN_WINDOW = timedelta(minutes=1)
+DEFAULT_TARGET_SECONDS = 60.0
+
+# Errors after which a smaller window may succeed: the result set was too large
+# to return, or the query ran out of time.
+SPLIT_ERRORS = (
+    "E_QUERY_RESULT_SET_TOO_LARGE",
+    "80DA0003",
+    "Request execution timeout",
+    "E_QUERY_TIMEOUT",
+)
+
+
+def should_split(exc):
+    """Whether a failed window may succeed if split into smaller windows."""
+    if isinstance(exc, TimeoutError):
+        return True
+    message = str(exc)
+    return any(error in message for error in SPLIT_ERRORS)
+
+
+def _timed(run, start, end):
+    start_time = timer()
+    result = run(start, end)
+    return result, timer() - start_time
+
+
+def iter_windows(
+    run,
+    start,
+    end,
+    window=DEFAULT_WINDOW,
+    max_workers=None,
+    min_window=MIN_WINDOW,
+    target_seconds=DEFAULT_TARGET_SECONDS,
+):
+    """Run a query once per time window, concurrently, adapting the window size.
+
+    Windows are half-open, [start, end), so no row is returned twice.
+
+    Parameters
+    ----------
+    run: Callable[[datetime, datetime], pandas.DataFrame]
+        Runs the query for one window's start and end.
+    start: datetime
+        The start of the range (inclusive).
+    end: datetime
+        The end of the range (exclusive).
+    window: timedelta, default 1 day
+        The initial and largest window size.
+    max_workers: int, default None
+        The maximum number of windows to run at once. Defaults to 8.
+    min_window: timedelta, default 1 minute
+        Windows this small are not split further; their errors are raised.
+    target_seconds: float, default 60
+        Windows slower than this halve the size of the following windows, and
+        windows much faster than this double it, up to `window`.
+
+    Yields
+    ------
+    Tuple[datetime, datetime, pandas.DataFrame]
+        The start, end and results of each window, in the order they complete.
+    """
+    if window <= timedelta(0):
+        raise ValueError("window must be a positive timedelta.")
+    max_workers = max_workers or DEFAULT_MAX_WORKERS
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    pending = {}
+    retry = deque()
+    cursor = start
+    step = window
+    try:
+        while True:
+            while len(pending) < max_workers:
+                if retry:
+                    lower, upper = retry.popleft()
+                elif cursor < end:
+                    lower, upper = cursor, min(cursor + step, end)
+                    cursor = upper
+                else:
+                    break
+                pending[executor.submit(_timed, run, lower, upper)] = (lower, upper)
+            if not pending:
+                return
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                lower, upper = pending.pop(future)
+                try:
+                    result, duration = future.result()
+                except Exception as exc:  # pylint: disable=broad-except
+                    if not should_split(exc) or upper - lower <= min_window:
+                        raise
+                    middle = lower + (upper - lower) / 2
+                    logger.info("Splitting window {} to {}: {}", lower, upper, exc)
+                    retry.extend([(lower, middle), (middle, upper)])
+                    step = max(min(step, middle - lower), min_window)
+                    continue
+                logger.info("Window {} to {} completed in {:.2f} seconds.", lower, upper, duration)
+                if duration > target_seconds:
+                    step = max(step / 2, min_window)
+                elif duration < target_seconds / 4:
+                    step = min(step * 2, window)
+                yield lower, upper, result
+    finally:
+        # If the caller stops iterating early or a window fails, don't start the rest.
+        for future in pending:
+            future.cancel()
+        executor.shutdown(wait=True)
+
+
+def concat_windows(windows):
+    """Concatenate (start, end, DataFrame) window results in time order."""
+    frames = [df for _, _, df in sorted(windows, key=lambda window: window[0])]
+    if not frames:
+        return pd.DataFrame()
+    return pd.concat(frames, ignore_index=True)
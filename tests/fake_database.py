@@ -1,5 +1,9 @@
 """Test fakes."""
+from copy import copy
+
+from azure.kusto.data._models import KustoResultColumn
 from azure.kusto.data.response import KustoResponseDataSetV2, KustoResultTable
+from pytest import fixture
 
 
 class FakeDatabase:
@@ -9,7 +13,11 @@ class FakeDatabase:
         self.cluster = cluster
         self.database = database
 
-    def execute(self, query):
+    def execute(self, query, options=None, parameters=None):
+        """Just return the query instead of running it."""
+        return query
+
+    async def execute_async(self, query, options=None, parameters=None):
         """Just return the query instead of running it."""
         return query
 
@@ -26,20 +34,70 @@ class FakeKustoResponseDataSet(KustoResponseDataSetV2):
 
 class FakeKustoResultTable(KustoResultTable):
     def __init__(self, columns, rows):
-        self.columns = columns
+        """columns is a list of (name, kusto type) pairs."""
+        self.columns = [
+            KustoResultColumn({"ColumnName": name, "ColumnType": ctype}, i)
+            for i, (name, ctype) in enumerate(columns)
+        ]
+        self.raw_columns = [{"ColumnName": name, "ColumnType": ctype} for name, ctype in columns]
         self.raw_rows = rows
+        self.table_name = "PrimaryResult"
+
+
+class FakeKustoStreamingResponseDataSet:
+    """Yields a table whose rows can be iterated only once, like a stream."""
+
+    def __init__(self, table):
+        self.table = table
+
+    def iter_primary_results(self):
+        table = copy(self.table)
+        table.raw_rows = iter(self.table.raw_rows)
+        yield table
 
 
 class FakeKustoClient:
     """Fake KustoClient for testing."""
 
     def __init__(self, table):
-        self.response = FakeKustoResponseDataSet([FakeKustoResultTable(table)])
+        self.response = FakeKustoResponseDataSet([table])
+        self.queries = []
+        self.properties = []
 
-    def execute_mgmt(self, database, query):
+    def execute_mgmt(self, database, query, properties=None):
         self.response.query = query
+        self.queries.append(query)
+        self.properties.append(properties)
         return self.response
 
-    def execute_query(self, database, query):
+    def execute_query(self, database, query, properties=None):
         self.response.query = query
+        self.queries.append(query)
+        self.properties.append(properties)
         return self.response
+
+    def execute_streaming_query(self, database, query, properties=None):
+        self.queries.append(query)
+        self.properties.append(properties)
+        return FakeKustoStreamingResponseDataSet(self.response.tables[0])
+
+
+class FakeAsyncKustoClient(FakeKustoClient):
+    """Fake asynchronous KustoClient for testing."""
+
+    async def execute_mgmt(self, database, query, properties=None):
+        return super().execute_mgmt(database, query, properties)
+
+    async def execute_query(self, database, query, properties=None):
+        return super().execute_query(database, query, properties)
+
+
+def fake_table():
+    """A result table with a string and a long column and two rows."""
+    return FakeKustoResultTable([("foo", "string"), ("bar", "long")], [["a", 1], ["b", 2]])
+
+
+@fixture
+def client():
+    """A fake client that answers every query with `fake_table()`."""
+    return FakeKustoClient(fake_table())
@@ -0,0 +1,178 @@
+import os
+import time
+
+import pandas as pd
+from pytest import importorskip
+
+from kusto_tool import QueryOptions
+from kusto_tool import database as kdb
+from kusto_tool.cache import DiskCache, MemoryCache, TieredCache, cache_key
+
+from .fake_database import client  # pylint: disable=unused-import
+
+
+def test_cache_key():
+    """Keys depend on the cluster, database and query."""
+    key = cache_key("c", "db", "tbl")
+    assert key == cache_key("c", "db", "tbl")
+    assert key != cache_key("c2", "db", "tbl")
+    assert key != cache_key("c", "db2", "tbl")
+    assert key != cache_key("c", "db", "tbl | take 1")
+
+
+def test_cache_key_options():
+    """Keys depend on the request options that can change the results."""
+    key = cache_key("c", "db", "tbl")
+    assert key == cache_key("c", "db", "tbl", options=QueryOptions())
+    assert key != cache_key("c", "db", "tbl", options=QueryOptions(notruncation=True))
+    assert key != cache_key("c", "db", "tbl", options=QueryOptions(max_memory_per_iterator=1))
+    assert key != cache_key("c", "db", "tbl", options=QueryOptions(options={"a": 1}))
+    options = QueryOptions(client_request_id="id", application="app", parameterize=True)
+    assert key == cache_key("c", "db", "tbl", options=options)
+
+
+def test_execute_cached(tmp_path, client):
+    importorskip("pyarrow")
+    cache = DiskCache(tmp_path)
+    db = kdb.KustoDatabase("c", "db", client=client, cache=cache)
+    first = db.execute("tbl | take {{ n }}", n=2)
+    second = db.execute("tbl | take {{ n }}", n=2)
+    assert client.queries == ["tbl | take 2"]
+    assert second.equals(first)
+    assert second.bar.dtype == first.bar.dtype
+    key = cache_key("c", "db", "tbl | take 2")
+    assert cache.metadata(key) == {"cluster": "c", "database": "db", "query": "tbl | take 2"}
+
+
+def test_execute_cached_by_options(tmp_path, client):
+    importorskip("pyarrow")
+    db = kdb.KustoDatabase("c", "db", client=client, cache=DiskCache(tmp_path))
+    db.execute("tbl")
+    db.execute("tbl", options=QueryOptions(notruncation=True))
+    db.execute("tbl", options=QueryOptions(application="app"))
+    assert client.queries == ["tbl", "tbl"]
+
+
+def test_commands_not_cached(tmp_path, client):
+    importorskip("pyarrow")
+    db = kdb.KustoDatabase("c", "db", client=client, cache=DiskCache(tmp_path))
+    db.execute(".show tables")
+    db.execute(".show tables")
+    assert client.queries == [".show tables", ".show tables"]
+
+
+def _expire(cache, key):
+    entry = cache.path / f"{key}.parquet"
+    old = time.time() - 3600
+    os.utime(entry, (old, old))
+
+
+def test_ttl(tmp_path, client):
+    importorskip("pyarrow")
+    cache = DiskCache(tmp_path, ttl=60)
+    db = kdb.KustoDatabase("c", "db", client=client, cache=cache)
+    db.execute("tbl")
+    _expire(cache, cache_key("c", "db", "tbl"))
+    db.execute("tbl")
+    assert client.queries == ["tbl", "tbl"]
+
+
+def test_stale_while_revalidate(tmp_path, client):
+    importorskip("pyarrow")
+    cache = DiskCache(tmp_path, ttl=60, stale_while_revalidate=True)
+    key = cache_key("c", "db", "tbl")
+    db = kdb.KustoDatabase("c", "db", client=client, cache=cache)
+    db.execute("tbl")
+    _expire(cache, key)
+    stale = db.execute("tbl")
+    assert stale.foo.tolist() == ["a", "b"]
+    for _ in range(100):
+        if len(client.queries) == 2 and not cache._refreshing:
+            break
+        time.sleep(0.01)
+    assert client.queries == ["tbl", "tbl"]
+    assert cache.get(key)[1]
+
+
+def test_lru_eviction(tmp_path, client):
+    importorskip("pyarrow")
+    cache = DiskCache(tmp_path)
+    db = kdb.KustoDatabase("c", "db", client=client, cache=cache)
+    db.execute("tbl1")
+    entry_size = os.path.getsize(tmp_path / f"{cache_key('c', 'db', 'tbl1')}.parquet")
+    cache.max_bytes = int(entry_size * 2.5)
+    db.execute("tbl2")
+    # Make tbl1 the oldest entry, then reading it makes tbl2 the least recently used.
+    _expire(cache, cache_key("c", "db", "tbl1"))
+    db.execute("tbl1")
+    db.execute("tbl3")
+    remaining = {p.stem for p in tmp_path.glob("*.parquet")}
+    assert remaining == {cache_key("c", "db", "tbl1"), cache_key("c", "db", "tbl3")}
+
+
+def test_clear(tmp_path, client):
+    importorskip("pyarrow")
+    cache = DiskCache(tmp_path)
+    db = kdb.KustoDatabase("c", "db", client=client, cache=cache)
+    db.execute("tbl")
+    cache.clear()
+    assert cache.get(cache_key("c", "db", "tbl")) is None
+
+
+def test_memory_cache(client):
+    db = kdb.KustoDatabase("c", "db", client=client, cache=MemoryCache(max_bytes=10**6))
+    first = db.execute("tbl")
+    second = db.execute("tbl")
+    assert client.queries == ["tbl"]
+    assert second.equals(first)
+
+
+def test_memory_cache_copies():
+    """Mutating a DataFrame from the cache doesn't change the cached copy."""
+    cache = MemoryCache(max_bytes=10**6)
+    df = cache.fetch("key", lambda: pd.DataFrame({"foo": [1, 2]}))
+    df.loc[0, "foo"] = 100
+    assert cache.get("key").foo.tolist() == [1, 2]
+    df = cache.get("key")
+    df.loc[0, "foo"] = 100
+    assert cache.get("key").foo.tolist() == [1, 2]
+
+
+def test_memory_cache_evicts_by_size():
+    df = pd.DataFrame({"foo": range(100)})
+    size = df.memory_usage(index=True, deep=True).sum()
+    cache = MemoryCache(max_bytes=int(size * 2.5))
+    cache.put("a", df)
+    cache.put("b", df)
+    cache.get("a")
+    cache.put("c", df)
+    assert cache.get("b") is None
+    assert cache.get("a") is not None
+    assert cache.get("c") is not None
+    assert cache.nbytes == size * 2
+
+
+def test_memory_cache_too_large():
+    cache = MemoryCache(max_bytes=10)
+    cache.put("a", pd.DataFrame({"foo": range(100)}))
+    assert len(cache) == 0
+
+
+def test_memory_cache_ttl():
+    cache = MemoryCache(max_bytes=10**6, ttl=0)
+    cache.put("a", pd.DataFrame({"foo": [1]}))
+    assert cache.get("a") is None
+    assert cache.nbytes == 0
+
+
+def test_tiered_cache(tmp_path, client):
+    importorskip("pyarrow")
+    memory = MemoryCache(max_bytes=10**6)
+    disk = DiskCache(tmp_path)
+    db = kdb.KustoDatabase("c", "db", client=client, cache=TieredCache(memory, disk))
+    db.execute("tbl")
+    memory.clear()
+    db.execute("tbl")
+    db.execute("tbl")
+    assert client.queries == ["tbl"]
+    assert len(memory) == 1
@@ -0,0 +1,101 @@
+from datetime import datetime
+
+from pytest import raises
+
+from kusto_tool import database as kdb
+from kusto_tool.catalog import SchemaCatalog, parse_cslschema
+
+from .fake_database import FakeKustoClient, FakeKustoResultTable
+
+
+def schema_client():
+    table = FakeKustoResultTable(
+        [
+            ("TableName", "string"),
+            ("Schema", "string"),
+            ("DatabaseName", "string"),
+            ("Folder", "string"),
+            ("DocString", "string"),
+        ],
+        [
+            ["tbl1", "foo:string,bar:long", "db", "", ""],
+            ["tbl2", "ts:datetime", "db", "logs", "Events"],
+        ],
+    )
+    return FakeKustoClient(table)
+
+
+def test_parse_cslschema():
+    assert parse_cslschema("foo:string,bar:long") == {"foo": str, "bar": int}
+    assert parse_cslschema("") == {}
+
+
+def test_table_inspect():
+    """All schemas are fetched in one command, then reused."""
+    client = schema_client()
+    db = kdb.KustoDatabase("c", "db", client=client)
+    tbl1 = db.table("tbl1", inspect=True)
+    tbl2 = db.table("tbl2", inspect=True)
+    assert tbl1.foo.dtype == str
+    assert tbl1.bar.dtype == int
+    assert tbl2.ts.dtype == datetime
+    assert client.queries == [".show database db cslschema"]
+
+
+def test_table_inspect_missing_refetches():
+    """A missing table refetches the schemas once before raising."""
+    client = schema_client()
+    db = kdb.KustoDatabase("c", "db", client=client)
+    db.table("tbl1", inspect=True)
+    with raises(KeyError):
+        db.table("tbl3", inspect=True)
+    assert len(client.queries) == 2
+
+
+def test_table_exists():
+    client = schema_client()
+    db = kdb.KustoDatabase("c", "db", client=client)
+    assert db.table_exists("tbl1")
+    assert db.table_exists("tbl2")
+    assert len(client.queries) == 1
+
+
+def test_commands_invalidate_catalog():
+    client = schema_client()
+    db = kdb.KustoDatabase("c", "db", client=client)
+    db.table_exists("tbl1")
+    db.drop_table("tbl2")
+    db.table_exists("tbl1")
+    assert client.queries == [
+        ".show database db cslschema",
+        ".drop table tbl2",
+        ".show database db cslschema",
+    ]
+
+
+def test_catalog_ttl():
+    client = schema_client()
+    db = kdb.KustoDatabase("c", "db", client=client, schema_ttl=0)
+    db.table_exists("tbl1")
+    db.table_exists("tbl1")
+    assert len(client.queries) == 2
+
+
+def test_catalog_persisted(tmp_path):
+    path = tmp_path / "schema.json"
+    client = schema_client()
+    db = kdb.KustoDatabase("c", "db", client=client, schema_path=path)
+    assert db.catalog.schemas() == {"tbl1": "foo:string,bar:long", "tbl2": "ts:datetime"}
+    other_client = schema_client()
+    other_db = kdb.KustoDatabase("c", "db", client=other_client, schema_path=path)
+    assert other_db.table("tbl1", inspect=True).bar.dtype == int
+    assert other_client.queries == []
+
+
+def test_catalog_persisted_other_database(tmp_path):
+    path = tmp_path / "schema.json"
+    SchemaCatalog(kdb.KustoDatabase("c", "db", client=schema_client()), path=path).refresh()
+    client = schema_client()
+    db = kdb.KustoDatabase("c", "db2", client=client, schema_path=path)
+    db.table_exists("tbl1")
+    assert client.queries == [".show database db2 cslschema"]
@@ -0,0 +1,76 @@
+from pytest import fixture, raises
+
+from kusto_tool import clients
+from kusto_tool import database as kdb
+
+
+@fixture(autouse=True)
+def fresh_registry():
+    clients.reset_clients()
+    yield
+    clients.reset_clients()
+
+
+def test_databases_share_client():
+    """Databases on the same cluster share one client."""
+    cluster = kdb.cluster("test")
+    db1 = cluster.database("db1")
+    db2 = cluster.database("db2")
+    db3 = kdb.KustoDatabase("test", "db3")
+    assert db1.client is db2.client is db3.client
+
+
+def test_clients_keyed_by_cluster_and_auth():
+    db = kdb.KustoDatabase("test", "db")
+    assert kdb.KustoDatabase("other", "db").client is not db.client
+    assert kdb.KustoDatabase("test", "db", auth="device").client is not db.client
+
+
+def test_unknown_auth():
+    with raises(ValueError):
+        kdb.KustoDatabase("test", "db", auth="password")
+
+
+def test_pool_size():
+    db = kdb.cluster("test", pool_size=4).database("db")
+    assert db.client._max_pool_size == 4
+    adapter = db.client._session.get_adapter("https://test.kusto.windows.net")
+    assert adapter._pool_maxsize == 4
+
+
+def test_reset_clients():
+    client = kdb.KustoDatabase("test", "db").client
+    clients.reset_clients()
+    assert kdb.KustoDatabase("test", "db").client is not client
+
+
+def test_reinit_after_fork():
+    client = kdb.KustoDatabase("test", "db").client
+    lock = clients._lock
+    clients._reinit_after_fork()
+    assert clients._lock is not lock
+    assert kdb.KustoDatabase("test", "db").client is not client
+
+
+def test_client_created_lazily(mocker):
+    """Building and compiling expressions never creates a client."""
+    get_client = mocker.patch("kusto_tool.database.get_client")
+    tbl = kdb.cluster("test").database("db").table("tbl", columns={"foo": str})
+    str(tbl.where(tbl.foo == "a"))
+    get_client.assert_not_called()
+    assert tbl.database.client is get_client.return_value
+
+
+def test_offline_database():
+    db = kdb.KustoDatabase("test", "db", offline=True)
+    tbl = db.table("tbl", columns={"foo": str})
+    assert str(tbl.take(1)) == "cluster('test').database('db').['tbl']\n| limit 1\n"
+    with raises(RuntimeError):
+        tbl.take(1).collect()
+    assert clients._clients == {}
+
+
+def test_offline_cluster():
+    db = kdb.cluster("test", offline=True).database("db")
+    with raises(RuntimeError):
+        db.execute("tbl")
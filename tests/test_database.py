@@ -1,10 +1,21 @@
+import asyncio
+import os
+import stat
+
 from azure.kusto.data.helpers import dataframe_from_result_table
 from pytest import raises
 
 from kusto_tool import database as kdb
 from kusto_tool import expression as exp
 
-from .fake_database import FakeDatabase, FakeKustoClient, FakeKustoResultTable
+from .fake_database import (
+    FakeAsyncKustoClient,
+    FakeDatabase,
+    FakeKustoClient,
+    FakeKustoResultTable,
+    FakeKustoStreamingResponseDataSet,
+    fake_table,
+)
 
 
 def test_dict_to_datatable():
@@ -37,6 +48,24 @@ def test_render_template_query():
     assert actual == expected
 
 
+def test_compile_template_cached():
+    """The same template source is only compiled once."""
+    template = kdb.compile_template("{{ foo }} | take 10")
+    assert kdb.compile_template("{{ foo }} | take 10") is template
+    assert kdb.compile_template("{{ foo }} | take 20") is not template
+
+
+def test_load_templates(tmp_path):
+    (tmp_path / "first.kql").write_text("{{ tbl }} | take {{ n }}", encoding="utf-8")
+    (tmp_path / "second.kql").write_text("{{ tbl }} | count", encoding="utf-8")
+    (tmp_path / "notes.txt").write_text("not a template", encoding="utf-8")
+    templates = kdb.load_templates(tmp_path)
+    assert sorted(path.name for path in templates) == ["first.kql", "second.kql"]
+    assert kdb.compile_template("{{ tbl }} | count") is templates[tmp_path / "second.kql"]
+    query = kdb.render_template_query(str(tmp_path / "first.kql"), tbl="T", n=5)
+    assert query == "T | take 5"
+
+
 def test_render_set():
     result = kdb.render_set(
         "StormEvents | take 10",
@@ -210,9 +239,8 @@ def test_summarize_adds_aliases():
 | summarize
 \tsum_damage=sum(DamageProperty)
 \tby State, EventType
-| order by
+| top 20 by
 \tsum_damage
-| limit 20
 """
     assert str(query) == expected
 
@@ -238,9 +266,8 @@ def test_long_query():
 | summarize
 \tsum_damage=sum(DamageProperty)
 \tby State, EventType
-| order by
+| top 20 by
 \tsum_damage
-| limit 20
 """
     assert str(query) == expected
 
@@ -261,3 +288,285 @@ def test_expr_idempotent():
 \tDamageProperty
 """
     assert str(query) == expected
+
+
+def test_execute():
+    client = FakeKustoClient(fake_table())
+    db = kdb.KustoDatabase("test", "testdb", client=client)
+    df = db.execute("tbl | take {{ n }}", n=2)
+    assert client.queries == ["tbl | take 2"]
+    assert df.foo.tolist() == ["a", "b"]
+    assert df.bar.tolist() == [1, 2]
+
+
+def test_execute_async():
+    """execute_async returns the same DataFrame as execute."""
+    db = kdb.KustoDatabase(
+        "test",
+        "testdb",
+        client=FakeKustoClient(fake_table()),
+        async_client=FakeAsyncKustoClient(fake_table()),
+    )
+    expected = db.execute("tbl | take {{ n }}", n=2)
+    actual = asyncio.run(db.execute_async("tbl | take {{ n }}", n=2))
+    assert db.async_client.queries == ["tbl | take 2"]
+    assert actual.equals(expected)
+
+
+def test_execute_async_mgmt():
+    """Commands starting with . run with execute_mgmt."""
+    client = FakeAsyncKustoClient(fake_table())
+    db = kdb.KustoDatabase("test", "testdb", async_client=client)
+    asyncio.run(db.execute_async(".show tables"))
+    assert client.queries == [".show tables"]
+
+
+def test_collect_async():
+    db = FakeDatabase("test", "testdb")
+    tbl = kdb.TableExpr("tbl", database=db, columns={"foo": str, "bar": int})
+    query = asyncio.run(tbl.project(tbl.foo).collect_async())
+    assert query == "cluster('test').database('testdb').['tbl']\n| project\n\tfoo\n"
+
+
+def test_execute_many():
+    """Results come back in input order with per-query exceptions."""
+    client = FakeKustoClient(fake_table())
+    db = kdb.KustoDatabase("test", "testdb", client=client)
+    results = db.execute_many(
+        ["tbl | take {{ n }}", ("tbl | take {{ n }}", {"n": 1}), "tbl | take {{ n"],
+        n=2,
+        max_workers=2,
+    )
+    assert sorted(client.queries) == ["tbl | take 1", "tbl | take 2"]
+    assert results[0].foo.tolist() == ["a", "b"]
+    assert results[1].foo.tolist() == ["a", "b"]
+    assert isinstance(results[2], Exception)
+
+
+def test_execute_many_as_completed():
+    db = kdb.KustoDatabase("test", "testdb", client=FakeKustoClient(fake_table()))
+    results = db.execute_many(["tbl", "tbl2", "tbl3"], as_completed=True)
+    indexes = sorted(i for i, _ in results)
+    assert indexes == [0, 1, 2]
+
+
+def test_collect_many():
+    db = FakeDatabase("test", "testdb")
+    tbl = kdb.TableExpr("tbl", database=db, columns={"foo": str, "bar": int})
+    queries = kdb.TableExpr.collect_many([tbl.take(1), tbl.take(2)])
+    assert queries == [
+        "cluster('test').database('testdb').['tbl']\n| limit 1\n",
+        "cluster('test').database('testdb').['tbl']\n| limit 2\n",
+    ]
+
+
+def test_execute_iter():
+    """Results stream in chunks of at most chunk_rows rows."""
+    rows = [[str(i), i] for i in range(5)]
+    table = FakeKustoResultTable([("foo", "string"), ("bar", "long")], rows)
+    db = kdb.KustoDatabase("test", "testdb", client=FakeKustoClient(table))
+    chunks = list(db.execute_iter("tbl", chunk_rows=2))
+    assert [len(chunk) for chunk in chunks] == [2, 2, 1]
+    assert [v for chunk in chunks for v in chunk.bar.tolist()] == list(range(5))
+
+
+def test_execute_iter_exact_multiple():
+    rows = [[str(i), i] for i in range(4)]
+    table = FakeKustoResultTable([("foo", "string"), ("bar", "long")], rows)
+    db = kdb.KustoDatabase("test", "testdb", client=FakeKustoClient(table))
+    assert [len(chunk) for chunk in db.execute_iter("tbl", chunk_rows=2)] == [2, 2]
+
+
+def test_execute_iter_empty():
+    """An empty result yields one empty chunk with the columns."""
+    table = FakeKustoResultTable([("foo", "string"), ("bar", "long")], [])
+    db = kdb.KustoDatabase("test", "testdb", client=FakeKustoClient(table))
+    chunks = list(db.execute_iter("tbl"))
+    assert len(chunks) == 1
+    assert chunks[0].columns.tolist() == ["foo", "bar"]
+
+
+def test_execute_iter_mgmt_raises():
+    db = kdb.KustoDatabase("test", "testdb", client=FakeKustoClient(fake_table()))
+    with raises(ValueError):
+        list(db.execute_iter(".show tables"))
+
+
+def test_iter_batches():
+    db = kdb.KustoDatabase("test", "testdb", client=FakeKustoClient(fake_table()))
+    tbl = db.table("tbl", columns={"foo": str, "bar": int})
+    chunks = list(tbl.iter_batches(chunk_rows=1))
+    assert [chunk.foo.tolist() for chunk in chunks] == [["a"], ["b"]]
+    assert db.client.queries == [str(tbl).rstrip()]
+
+
+def test_to_parquet_streams_row_groups(tmp_path):
+    import pyarrow.parquet as pq
+
+    rows = [[i, f"s{i % 3}", {"k": i}] for i in range(10)]
+    table = FakeKustoResultTable([("n", "long"), ("s", "string"), ("d", "dynamic")], rows)
+    client = FakeKustoClient(table)
+    db = kdb.KustoDatabase("test", "db", client=client)
+    path = tmp_path / "out.parquet"
+    df = db.to_parquet("tbl", path, row_group_size=4, compression="zstd", use_dictionary=["s"])
+    metadata = pq.ParquetFile(path).metadata
+    assert [metadata.row_group(i).num_rows for i in range(metadata.num_row_groups)] == [4, 4, 2]
+    assert metadata.row_group(0).column(0).compression == "ZSTD"
+    assert df.n.tolist() == list(range(10))
+    assert df.d[3] == '{"k": 3}'
+    assert client.queries == ["tbl"]
+    assert list(tmp_path.iterdir()) == [path]
+
+
+def test_to_parquet_reads_existing_file(tmp_path):
+    client = FakeKustoClient(FakeKustoResultTable([("n", "long")], [[1]]))
+    db = kdb.KustoDatabase("test", "db", client=client)
+    path = tmp_path / "out.parquet"
+    assert db.to_parquet("tbl", path, load=False) is None
+    assert db.to_parquet("tbl", path).n.tolist() == [1]
+    assert client.queries == ["tbl"]
+
+
+def test_to_parquet_empty_result(tmp_path):
+    client = FakeKustoClient(FakeKustoResultTable([("n", "long")], []))
+    db = kdb.KustoDatabase("test", "db", client=client)
+    df = db.to_parquet("tbl", tmp_path / "out.parquet")
+    assert df.columns.tolist() == ["n"]
+    assert len(df) == 0
+
+
+def test_write_parquet_atomic(tmp_path):
+    import pyarrow as pa
+
+    path = tmp_path / "out.parquet"
+
+    def tables():
+        yield pa.table({"n": [1, 2]})
+        raise RuntimeError("connection lost")
+
+    with raises(RuntimeError):
+        kdb.write_parquet(tables(), path)
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_write_parquet_permissions(tmp_path):
+    import pyarrow as pa
+
+    path = tmp_path / "out.parquet"
+    umask = os.umask(0o022)
+    try:
+        kdb.write_parquet([pa.table({"n": [1]})], path)
+    finally:
+        os.umask(umask)
+    assert stat.S_IMODE(path.stat().st_mode) == 0o644
+
+
+class PartitionedKustoClient(FakeKustoClient):
+    """Answers distinct queries with the partition values and streams each
+    partition's rows."""
+
+    def __init__(self, partitions):
+        super().__init__(FakeKustoResultTable([("s", "string")], [[k] for k in partitions]))
+        self.partitions = partitions
+
+    def execute_streaming_query(self, database, query, properties=None):
+        self.queries.append(query)
+        value = query.split("| where s == '")[1].split("'")[0]
+        rows = [[n] for n in self.partitions[value]]
+        table = FakeKustoResultTable([("n", "long")], rows)
+        return FakeKustoStreamingResponseDataSet(table)
+
+
+def test_to_parquet_partition_by(tmp_path):
+    client = PartitionedKustoClient({"a": [1, 2], "b/c": [3]})
+    db = kdb.KustoDatabase("test", "db", client=client)
+    path = tmp_path / "out"
+    df = db.to_parquet("tbl;\n", path, partition_by="s")
+    assert (path / "s=a" / "part-0.parquet").is_file()
+    assert (path / "s=b%2Fc" / "part-0.parquet").is_file()
+    assert sorted(zip(df.s.astype(str), df.n)) == [("a", 1), ("a", 2), ("b/c", 3)]
+    assert client.queries[0] == "tbl\n| distinct s"
+    assert sorted(client.queries[1:]) == [
+        "tbl\n| where s == 'a'\n| project-away s",
+        "tbl\n| where s == 'b/c'\n| project-away s",
+    ]
+
+
+def test_to_parquet_partition_by_skips_existing(tmp_path):
+    client = PartitionedKustoClient({"a": [1], "b": [2]})
+    db = kdb.KustoDatabase("test", "db", client=client)
+    path = tmp_path / "out"
+    db.to_parquet("tbl", path, partition_by=["s"], load=False)
+    (path / "s=b" / "part-0.parquet").unlink()
+    client.queries.clear()
+    df = db.to_parquet("tbl", path, partition_by=["s"])
+    assert client.queries == ["tbl\n| distinct s", "tbl\n| where s == 'b'\n| project-away s"]
+    assert len(df) == 2
+
+
+def test_partition_filter():
+    assert kdb._partition_filter(["a", "b"], ["x", None]) == "a == 'x' and isnull(b)"
+    assert kdb._partition_filter(["a"], [True]) == "a == true"
+    assert str(kdb._partition_dir(["a", "b"], [1, None])) == "a=1/b=__HIVE_DEFAULT_PARTITION__"
+
+
+class IncrementalKustoClient(FakeKustoClient):
+    """Streams the rows newer than the query's watermark filter."""
+
+    def __init__(self, rows):
+        super().__init__(FakeKustoResultTable([("ts", "datetime"), ("n", "long")], rows))
+
+    def execute_streaming_query(self, database, query, properties=None):
+        self.queries.append(query)
+        rows = self.response.tables[0].raw_rows
+        if "| where ts > datetime(" in query:
+            watermark = query.split("datetime(")[1].rstrip(")")
+            rows = [row for row in rows if row[0].rstrip("Z") > watermark]
+        return FakeKustoStreamingResponseDataSet(
+            FakeKustoResultTable([("ts", "datetime"), ("n", "long")], rows)
+        )
+
+
+def test_to_parquet_watermark(tmp_path):
+    rows = [["2023-01-01T00:00:00Z", 1], ["2023-01-02T00:00:00.1234567Z", 2]]
+    client = IncrementalKustoClient(rows)
+    db = kdb.KustoDatabase("test", "db", client=client)
+    path = tmp_path / "out"
+    assert db.to_parquet("tbl", path, watermark="ts").n.tolist() == [1, 2]
+    # No new rows: no new part.
+    assert db.to_parquet("tbl", path, watermark="ts").n.tolist() == [1, 2]
+    rows.append(["2023-01-03T00:00:00Z", 3])
+    df = db.to_parquet("tbl", path, watermark="ts")
+    assert sorted(df.n.tolist()) == [1, 2, 3]
+    assert sorted(p.name for p in path.iterdir()) == ["part-00000.parquet", "part-00001.parquet"]
+    assert client.queries == [
+        "tbl",
+        "tbl\n| where ts > datetime(2023-01-02T00:00:00.1234567)",
+        "tbl\n| where ts > datetime(2023-01-02T00:00:00.1234567)",
+    ]
+    db.to_parquet("tbl", path, watermark="ts", force=True, load=False)
+    assert client.queries[-1] == "tbl"
+    assert sorted(p.name for p in path.iterdir()) == ["part-00000.parquet"]
+
+
+def test_to_parquet_watermark_ingestion_time(tmp_path):
+    client = FakeKustoClient(
+        FakeKustoResultTable(
+            [("n", "long"), ("_ingestion_time", "datetime")], [[1, "2023-01-01T00:00:00Z"]]
+        )
+    )
+    db = kdb.KustoDatabase("test", "db", client=client)
+    path = tmp_path / "out"
+    db.to_parquet("tbl", path, watermark="ingestion_time()", load=False)
+    db.to_parquet("tbl", path, watermark="ingestion_time()", load=False)
+    assert client.queries == [
+        "tbl\n| extend _ingestion_time = ingestion_time()",
+        "tbl\n| extend _ingestion_time = ingestion_time()\n"
+        "| where _ingestion_time > datetime(2023-01-01T00:00:00)",
+    ]
+
+
+def test_to_parquet_watermark_and_partition_by(tmp_path):
+    db = kdb.KustoDatabase("test", "db", offline=True)
+    with raises(ValueError):
+        db.to_parquet("tbl", tmp_path, watermark="ts", partition_by="s")
@@ -0,0 +1,82 @@
+import pandas as pd
+from azure.kusto.data.helpers import dataframe_from_result_table
+from pytest import fixture, importorskip, raises
+
+from kusto_tool import database as kdb
+from kusto_tool.decode import arrow_from_result_table, decode_result_table
+
+from .fake_database import FakeKustoClient, FakeKustoResultTable
+
+COLUMNS = [
+    ("s", "string"),
+    ("b", "bool"),
+    ("i", "int"),
+    ("l", "long"),
+    ("r", "real"),
+    ("d", "datetime"),
+    ("y", "dynamic"),
+    ("g", "guid"),
+    ("m", "decimal"),
+]
+
+
+@fixture
+def table():
+    return FakeKustoResultTable(
+        COLUMNS,
+        [
+            ["a", True, 1, 2, 1.5, "2023-01-01T00:00:00.1234567Z", {"a": 1}, "abc", "1.5"],
+            [None, None, None, None, None, None, None, None, None],
+            ["c", False, 3, 4, "NaN", "2023-01-02T00:00:00Z", [1, 2], None, None],
+            ["d", True, 5, 6, "Infinity", "2023-01-02T00:00:00Z", 3, None, "2"],
+        ],
+    )
+
+
+def test_decode_matches_sdk(table):
+    """The columnar decoder gives the same DataFrame as the SDK."""
+    pd.testing.assert_frame_equal(decode_result_table(table), dataframe_from_result_table(table))
+
+
+def test_decode_timespan():
+    table = FakeKustoResultTable(
+        [("t", "timespan")],
+        [["1.02:03:04.5"], [None], ["00:00:01"], ["-1.00:00:01"], ["00:00:00.0000001"], [10]],
+    )
+    actual = decode_result_table(table).t.tolist()
+    assert actual[0] == pd.Timedelta(days=1, hours=2, minutes=3, seconds=4.5)
+    assert pd.isna(actual[1])
+    assert actual[2] == pd.Timedelta(seconds=1)
+    assert actual[3] == -pd.Timedelta(days=1, seconds=1)
+    assert actual[4] == pd.Timedelta(nanoseconds=100)
+    assert actual[5] == pd.Timedelta(microseconds=1)
+
+
+def test_decode_invalid_timespan():
+    table = FakeKustoResultTable([("t", "timespan")], [["soon"]])
+    with raises(ValueError):
+        decode_result_table(table)
+
+
+def test_decode_empty():
+    table = FakeKustoResultTable(COLUMNS, [])
+    df = decode_result_table(table)
+    assert df.columns.tolist() == [name for name, _ in COLUMNS]
+    assert len(df) == 0
+
+
+def test_arrow_from_result_table(table):
+    importorskip("pyarrow")
+    arrow = arrow_from_result_table(table)
+    assert arrow.column_names == [name for name, _ in COLUMNS]
+    assert arrow.column("l").to_pylist() == [2, None, 4, 6]
+    assert arrow.column("b").to_pylist() == [True, None, False, True]
+    assert arrow.column("r").to_pylist() == [1.5, None, None, float("inf")]
+    assert arrow.column("y").to_pylist() == ['{"a": 1}', None, "[1, 2]", "3"]
+
+
+def test_execute_with_decoder(table):
+    db = kdb.KustoDatabase(
+        "test", "testdb", client=FakeKustoClient(table), decoder=decode_result_table
+    )
+    pd.testing.assert_frame_equal(db.execute("tbl"), dataframe_from_result_table(table))
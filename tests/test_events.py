@@ -0,0 +1,136 @@
+import asyncio
+
+import requests
+from pytest import raises
+
+from kusto_tool import QueryOptions
+from kusto_tool import database as kdb
+from kusto_tool.events import QueryEvent, _record_response, install_response_hook
+
+from .fake_database import FakeAsyncKustoClient, FakeKustoClient, fake_table
+
+
+class StaticAdapter(requests.adapters.BaseAdapter):
+    """Answers every request with the same body."""
+
+    def __init__(self, body):
+        super().__init__()
+        self.body = body
+
+    def send(self, request, **kwargs):  # pylint: disable=arguments-differ
+        response = requests.Response()
+        response.status_code = 200
+        response._content = self.body  # pylint: disable=protected-access
+        response.request = request
+        return response
+
+    def close(self):
+        pass
+
+
+class SessionKustoClient(FakeKustoClient):
+    """Makes an HTTP request for each query, like KustoClient."""
+
+    def __init__(self, table, body):
+        super().__init__(table)
+        self._session = requests.Session()
+        self._session.mount("https://", StaticAdapter(body))
+
+    def execute_query(self, database, query, properties=None):
+        self._session.post("https://test.kusto.windows.net/v2/rest/query")
+        return super().execute_query(database, query, properties)
+
+
+def test_execute_emits_event():
+    events = []
+    db = kdb.KustoDatabase(
+        "test", "db", client=FakeKustoClient(fake_table()), hooks=[events.append]
+    )
+    db.execute("tbl | take {{ n }}", n=2)
+    assert len(events) == 1
+    event = events[0]
+    assert event.query == "tbl | take 2"
+    assert set(event.timings) == {"read_file", "render", "network", "convert"}
+    assert (event.rows, event.columns) == (2, 2)
+    assert event.error is None
+    assert event.duration == sum(event.timings.values())
+
+
+def test_response_hook_splits_network_and_parse():
+    events = []
+    client = SessionKustoClient(fake_table(), b"x" * 42)
+    db = kdb.KustoDatabase("test", "db", client=client)
+    db.add_hook(events.append)
+    db.execute("tbl")
+    assert events[0].response_bytes == 42
+    assert {"network", "parse"} <= set(events[0].timings)
+    assert client._session.hooks["response"].count(_record_response) == 1
+    db.remove_hook(events.append)
+    db.execute("tbl")
+    assert len(events) == 1
+    assert client._session.hooks["response"].count(_record_response) == 1
+
+
+def test_response_hook_ignores_other_threads():
+    response = requests.Response()
+    response._content = b"abc"
+    assert _record_response(response) is response
+    event = QueryEvent("test", "db", "tbl")
+    with event.request():
+        _record_response(response)
+    assert event.response_bytes == 3
+    assert set(event.timings) == {"network", "parse"}
+
+
+def test_install_response_hook_without_session():
+    install_response_hook(FakeKustoClient(fake_table()))
+
+
+def test_failed_execute_emits_error():
+    events = []
+    db = kdb.KustoDatabase("test", "db", offline=True, hooks=[events.append])
+    with raises(RuntimeError):
+        db.execute("tbl")
+    assert isinstance(events[0].error, RuntimeError)
+    assert events[0].rows is None
+
+
+def test_hook_errors_are_ignored():
+    def hook(event):
+        raise ValueError("oops")
+
+    db = kdb.KustoDatabase("test", "db", client=FakeKustoClient(fake_table()), hooks=[hook])
+    assert len(db.execute("tbl")) == 2
+
+
+def test_execute_iter_emits_event():
+    events = []
+    db = kdb.KustoDatabase(
+        "test", "db", client=FakeKustoClient(fake_table()), hooks=[events.append]
+    )
+    chunks = list(db.execute_iter("tbl", chunk_rows=1))
+    assert len(chunks) == 2
+    assert (events[0].rows, events[0].columns) == (2, 2)
+    assert {"network", "convert"} <= set(events[0].timings)
+
+
+def test_to_parquet_emits_event(tmp_path):
+    events = []
+    client = FakeKustoClient(fake_table())
+    db = kdb.KustoDatabase("test", "db", client=client, hooks=[events.append])
+    options = QueryOptions(notruncation=True)
+    db.to_parquet("tbl", tmp_path / "out.parquet", row_group_size=1, options=options)
+    assert len(events) == 1
+    assert (events[0].query, events[0].rows, events[0].columns) == ("tbl", 2, 2)
+    assert {"network", "convert"} <= set(events[0].timings)
+    assert client.properties[0].get_option("notruncation", None) is True
+
+
+def test_execute_async_emits_event():
+    events = []
+    db = kdb.KustoDatabase(
+        "test", "db", async_client=FakeAsyncKustoClient(fake_table()), hooks=[events.append]
+    )
+    asyncio.run(db.execute_async("tbl"))
+    assert (events[0].rows, events[0].columns) == (2, 2)
+    assert {"render", "network", "convert"} <= set(events[0].timings)
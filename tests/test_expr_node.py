@@ -0,0 +1,142 @@
+from kusto_tool import QueryOptions
+from kusto_tool.expression import Extend, Limit, Node, TableExpr, Where
+
+from .fake_database import FakeDatabase
+
+
+def tbl():
+    return TableExpr("tbl", FakeDatabase("c", "db"), columns={"foo": str, "bar": int})
+
+
+def test_node_chain():
+    node = Node.chain(["a", "b", "c"])
+    assert node.ops() == ["a", "b", "c"]
+    assert node.length == 3
+    assert node.parent.ops() == ["a", "b"]
+    assert Node.chain([]) is None
+
+
+def test_variants_share_base():
+    t = tbl()
+    base = t.where(t.bar > 1).extend(baz=t.bar)
+    first, second = base.limit(1), base.limit(2)
+    assert first._node.parent is base._node
+    assert second._node.parent is base._node
+    assert [type(op) for op in base._ast] == [Where, Extend]
+    assert str(first).endswith("| limit 1\n")
+    assert str(second).endswith("| limit 2\n")
+
+
+def test_operators_share_columns():
+    t = tbl()
+    filtered = t.where(t.bar > 1).limit(5)
+    assert filtered.columns is t.columns
+    assert filtered.with_options(None).columns is t.columns
+
+
+def test_ast_argument():
+    t = TableExpr("tbl", FakeDatabase("c", "db"), ast=[Limit(3)])
+    assert str(t) == "cluster('c').database('db').['tbl']\n| limit 3\n"
+    assert isinstance(t._last, Limit)
+
+
+def test_long_pipeline():
+    expr = tbl()
+    for i in range(10_000):
+        expr = expr.extend(**{f"c{i % 10}": i})
+    assert expr._node.length == 10_000
+    assert len(expr._ast) == 10_000
+    assert len(expr.fingerprint) == 32
+
+
+def test_compiled_text_cached():
+    t = tbl()
+    expr = t.where(t.bar > 1).extend(baz=t.bar)
+    text = str(expr)
+    assert expr._node.text is not None
+    assert str(expr) == text
+
+
+def test_extending_reuses_compiled_operators(monkeypatch):
+    t = tbl()
+    calls = []
+    right = TableExpr("other", t.database, columns={"foo": str})
+    base = t.join(right, on="foo", kind="inner").extend(baz=t.bar)
+    str(base)
+    original = TableExpr._compile_ops
+
+    def compile_ops(self):
+        calls.append(self.name)
+        return original(self)
+
+    monkeypatch.setattr(TableExpr, "_compile_ops", compile_ops)
+    str(base.limit(1))
+    str(base.limit(2))
+    # The join's right side isn't compiled again.
+    assert calls == ["tbl", "tbl"]
+
+
+def test_extending_reuses_where_text(monkeypatch):
+    t = tbl()
+    expr = t.where((t.bar > 1) | (t.foo == "a"), t.bar < 9)
+    str(expr)
+    calls = []
+    where_str = Where.__str__
+
+    def counted(self):
+        calls.append(self)
+        return where_str(self)
+
+    monkeypatch.setattr(Where, "__str__", counted)
+    assert "| where ((bar > 1) or (foo == 'a')) and bar < 9\n| limit 5\n" in str(expr.take(5))
+    str(expr.extend(baz=t.bar))
+    assert not calls
+
+
+def test_compile_parameterized_after_cached():
+    t = tbl()
+    expr = t.where(t.foo == "a")
+    assert str(expr).endswith("| where foo == 'a'\n")
+    query, parameters = expr._compile(QueryOptions(parameterize=True))
+    assert query.endswith("| where foo == _kt_p0\n")
+    assert parameters == {"_kt_p0": "a"}
+    assert str(expr).endswith("| where foo == 'a'\n")
+
+
+def test_fingerprint():
+    def build(value, name="tbl"):
+        t = TableExpr(name, FakeDatabase("c", "db"), columns={"foo": str, "bar": int})
+        return t.where(t.foo == value).summarize(by="foo", n=t.bar.sum()).order(t.foo.asc())
+
+    fingerprint = build("a").fingerprint
+    assert len(fingerprint) == 32
+    assert build("a").fingerprint == fingerprint
+    assert build("b").fingerprint != fingerprint
+    assert build("a", name="other").fingerprint != fingerprint
+    assert build(1).fingerprint != build("1").fingerprint
+
+
+def test_fingerprint_column_order():
+    t = tbl()
+    assert t.extend(a=1, b=2).fingerprint != t.extend(b=2, a=1).fingerprint
+    assert t.project(a=t.foo, b=t.bar).fingerprint != t.project(b=t.bar, a=t.foo).fingerprint
+    first = t.summarize(x=t.bar.sum(), y=t.bar.max())
+    assert first.fingerprint != t.summarize(y=t.bar.max(), x=t.bar.sum()).fingerprint
+
+
+def test_fingerprint_doesnt_compile(monkeypatch):
+    t = tbl()
+    expr = t.join(t.where(t.bar > 1), on="foo", kind="inner").limit(3)
+
+    def fail(self):
+        raise AssertionError("compiled")
+
+    monkeypatch.setattr(TableExpr, "_compile_ops", fail)
+    assert expr.fingerprint == expr.fingerprint
+
+
+def test_asc_doesnt_modify_column():
+    t = tbl()
+    ordered = t.order(t.foo.asc())
+    assert not t.foo.ascending
+    assert str(ordered).endswith("| order by\n\tfoo asc\n")
@@ -1,4 +1,6 @@
-from kusto_tool.expression import Column, Summarize, TableExpr
+import pandas as pd
+
+from kusto_tool.expression import OP, Column, Prefix, Summarize, TableExpr
 from kusto_tool.function import strcat, sum
 from pytest import raises
 
@@ -230,3 +232,133 @@ def test_summarize_nonagg_fails():
     tbl = TableExpr("tbl", database=db, columns={"foo": str, "bar": int})
     with raises(AssertionError):
         tbl.summarize(sum_foo=strcat(Column("foo", str)))
+
+
+def test_summarize_decompose():
+    """Aggregates are rewritten as mergeable partial aggregates"""
+    foo = Column("foo", int)
+    summ = Summarize(
+        by="bar",
+        total=foo.sum(),
+        mean=foo.avg(),
+        n=Prefix(OP.COUNT, agg=True),
+        distinct=foo.dcount(),
+        p50=foo.percentile(50),
+    )
+    partial, merge = summ.decompose()
+    expected = (
+        "| summarize\n\ttotal=sum(foo),\n\t_mean_sum=sum(foo),\n"
+        "\t_mean_count=countif(isnotnull(foo)),\n\tn=count(),\n"
+        "\t_distinct_hll=hll(foo, 1),\n\t_p50_tdigest=tdigest(foo)\n\tby bar"
+    )
+    assert str(partial) == expected
+    assert merge.by == ["bar"]
+
+
+def test_summarize_decompose_unsupported():
+    """Aggregates without partials can't be decomposed"""
+    summ = Summarize(pcts=Column("foo", int).percentile(50, 90))
+    with raises(ValueError):
+        summ.decompose()
+
+
+def test_merge_aggregates_local():
+    """sum, count, min, max and avg partials are merged with pandas"""
+    foo = Column("foo", int)
+    summ = Summarize(
+        by="bar", total=foo.sum(), low=foo.min(), mean=foo.avg(), n=Prefix(OP.COUNT, agg=True)
+    )
+    _, merge = summ.decompose()
+    partials = pd.DataFrame(
+        {
+            "bar": ["a", "b", "a"],
+            "total": [3, 4, 5],
+            "low": [1, 4, 0],
+            "_mean_sum": [3, 4, 5],
+            "_mean_count": [2, 1, 2],
+            "n": [2, 1, 3],
+        }
+    )
+    result = merge.merge(partials)
+    assert result.columns.tolist() == ["bar", "total", "low", "mean", "n"]
+    assert result.bar.tolist() == ["a", "b"]
+    assert result.total.tolist() == [8, 4]
+    assert result.low.tolist() == [0, 4]
+    assert result["mean"].tolist() == [2.0, 4.0]
+    assert result.n.tolist() == [5, 1]
+
+
+def test_merge_aggregates_without_by():
+    summ = Summarize(total=Column("foo", int).sum())
+    _, merge = summ.decompose()
+    result = merge.merge(pd.DataFrame({"total": [1, 2]}))
+    assert result.to_dict("list") == {"total": [3]}
+
+
+class SketchDatabase:
+    def __init__(self, result):
+        self.result = result
+        self.queries = []
+
+    def execute(self, query):
+        self.queries.append(query)
+        return self.result
+
+
+def test_merge_aggregates_sketches():
+    """hll and tdigest sketches are merged on the database"""
+    foo = Column("foo", int)
+    _, merge = Summarize(by="bar", d=foo.dcount(), p=foo.percentile(90)).decompose()
+    partials = pd.DataFrame(
+        {
+            "bar": ["a", "b", "a"],
+            "_d_hll": [[1], [2], [3]],
+            "_p_tdigest": [[4], [5], [6]],
+        }
+    )
+    db = SketchDatabase(pd.DataFrame({"_group": [1, 0], "d": [7, 8], "p": [1.5, 2.5]}))
+    result = merge.merge(partials, db)
+    assert db.queries == [
+        "datatable(_group: long, _d_hll: dynamic, _p_tdigest: dynamic)[\n"
+        "\t0, dynamic([1]), dynamic([4]),\n"
+        "\t1, dynamic([2]), dynamic([5]),\n"
+        "\t0, dynamic([3]), dynamic([6]),\n]\n"
+        "| summarize\n\t_d_hll=hll_merge(_d_hll),\n\t_p_tdigest=tdigest_merge(_p_tdigest)\n"
+        "\tby _group\n"
+        "| project _group, d=dcount_hll(_d_hll), p=percentile_tdigest(_p_tdigest, 90)"
+    ]
+    assert result.to_dict("list") == {"bar": ["a", "b"], "d": [8, 7], "p": [2.5, 1.5]}
+
+
+class BatchSketchDatabase:
+    def __init__(self, results):
+        self.results = list(results)
+        self.queries = []
+
+    def execute(self, query):
+        self.queries.append(query)
+        return self.results[len(self.queries) - 1]
+
+
+def test_merge_aggregates_sketches_batched():
+    """Groups are split over merge queries, with each group in one query."""
+    _, merge = Summarize(by="bar", d=Column("foo", int).dcount()).decompose()
+    partials = pd.DataFrame({"bar": ["a", "b", "a", "c"], "_d_hll": [[1], [2], [3], [4]]})
+    db = BatchSketchDatabase(
+        [
+            pd.DataFrame({"_group": [0], "d": [5]}),
+            pd.DataFrame({"_group": [2, 1], "d": [7, 6]}),
+        ]
+    )
+    result = merge.merge(partials, db, max_query_chars=40)
+    assert [query.split("]\n|")[0] for query in db.queries] == [
+        "datatable(_group: long, _d_hll: dynamic)[\n\t0, dynamic([1]),\n\t0, dynamic([3]),\n",
+        "datatable(_group: long, _d_hll: dynamic)[\n\t1, dynamic([2]),\n\t2, dynamic([4]),\n",
+    ]
+    assert result.to_dict("list") == {"bar": ["a", "b", "c"], "d": [5, 6, 7]}
+
+
+def test_merge_aggregates_sketches_need_database():
+    _, merge = Summarize(d=Column("foo", int).dcount()).decompose()
+    with raises(ValueError):
+        merge.merge(pd.DataFrame({"_d_hll": [[1]]}))
@@ -0,0 +1,56 @@
+from pytest import raises
+
+from kusto_tool.database import KustoDatabase
+from kusto_tool.expression import Column, TableExpr, Top
+
+PREFIX = "cluster('c').database('db').['tbl']\n"
+
+
+def tbl():
+    return TableExpr("tbl", KustoDatabase("c", "db"), columns={"foo": str, "bar": int})
+
+
+def test_top():
+    """top prints."""
+    assert str(Top(10, Column("foo", str), Column("bar", int).asc())) == (
+        "| top 10 by\n\tfoo,\n\tbar asc"
+    )
+
+
+def test_top_tbl():
+    """top works on a tbl."""
+    t = tbl()
+    assert str(t.top(5, t.bar)) == PREFIX + "| top 5 by\n\tbar\n"
+
+
+def test_top_needs_columns():
+    """top without sort columns raises."""
+    with raises(ValueError):
+        tbl().top(5)
+
+
+def test_order_limit_compiles_to_top():
+    """order followed by limit becomes top."""
+    t = tbl()
+    assert str(t.order(t.bar).limit(100)) == PREFIX + "| top 100 by\n\tbar\n"
+    assert str(t.sort("bar").take(3)) == PREFIX + "| top 3 by\n\tbar\n"
+
+
+def test_order_limit_not_adjacent():
+    """order and limit separated by another operator stay as they are."""
+    t = tbl()
+    query = str(t.order(t.bar).extend(baz=t.bar).limit(100))
+    assert query == PREFIX + "| order by\n\tbar\n| extend\n\tbaz=bar\n| limit 100\n"
+
+
+def test_top_nested():
+    """consecutive top_nested calls are levels of one operator."""
+    t = tbl()
+    query = t.top_nested(3, t.foo, total=t.bar.sum()).top_nested(
+        None, "bar", ascending=True, others=-1, largest=t.bar.max()
+    )
+    assert str(query) == PREFIX + (
+        "| top-nested 3 of foo by total=sum(bar),\n"
+        "\ttop-nested of bar with others=-1 by largest=max(bar) asc\n"
+    )
+    assert set(query.columns) == {"foo", "total", "bar", "largest"}
@@ -134,3 +134,35 @@ def test_where_isin_int():
     foo = exp.Column("foo", str)
     where = exp.Where(foo.isin(1, 2, 3))
     assert str(where) == "| where foo in (1, 2, 3)"
+
+
+def test_where_chain():
+    foo = exp.Column("foo", str)
+    bar = exp.Column("bar", int)
+    where = exp.Where((foo == "a") | ((bar == 1) & (bar == 3)))
+    assert str(where) == "| where (foo == 'a') or ((bar == 1) and (bar == 3))"
+    where = exp.Where(((foo == "a") | (bar == 1)) & (bar == 2))
+    assert str(where) == "| where ((foo == 'a') or (bar == 1)) and (bar == 2)"
+
+
+def test_where_long_or_chain(tbl):
+    renamed = tbl.project(baz=tbl.bar)
+    pred = renamed.baz == 0
+    for i in range(1, 10_000):
+        pred = pred | (renamed.baz == i)
+    query = str(renamed.where(pred))
+    # The predicate is moved ahead of the project, renamed back to bar.
+    assert query.startswith(
+        "cluster('test').database('testdb').['tbl']\n| where "
+        + "(" * 9999
+        + "bar == 0) or (bar == 1)) or (bar == 2))"
+    )
+    assert query.endswith(") or (bar == 9999)\n| project\n\tbaz = bar\n")
+    assert len(exp.structure(pred)[2]) == 10_000
+
+
+def test_nodes_have_slots():
+    pred = exp.Column("foo", str) == "a"
+    assert not hasattr(pred, "__dict__")
+    assert not hasattr(pred.lhs, "__dict__")
+    assert not hasattr(exp.Where(pred), "__dict__")
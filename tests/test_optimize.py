@@ -0,0 +1,350 @@
+"""The optimizer keeps results the same: each expression in the corpus is run
+on small DataFrames by a minimal evaluator, with and without optimizing.
+
+Without optimizing, predicates are evaluated from the expression's operators.
+Optimized, each `where` is evaluated from its compiled text, so the text has
+to mean the same as the predicates it was compiled from.
+"""
+
+import operator
+import re
+from datetime import datetime
+
+import pandas as pd
+import pytest
+
+from kusto_tool import expression as exp
+from kusto_tool import optimize as optimize_module
+from kusto_tool.expression import OP, Column, TableExpr
+from kusto_tool.optimize import optimize
+
+from .fake_database import FakeDatabase
+
+TABLES = {
+    "tbl": pd.DataFrame(
+        {
+            "ts": pd.to_datetime(
+                ["2023-01-01", "2023-01-02", "2023-01-03", "2023-01-04", "2023-01-05"]
+            ),
+            "foo": ["a", "b", "a", "c", "b"],
+            "bar": [1, 2, 3, 4, 5],
+            "baz": [0.5, -1.0, 2.5, 3.0, -0.5],
+        }
+    ),
+    "other": pd.DataFrame(
+        {"foo": ["a", "a", "b", "d"], "qux": [10, 20, 30, 40], "bar": [7, 8, 9, 10]}
+    ),
+}
+
+INFIX = {
+    OP.EQ: operator.eq,
+    OP.NE: operator.ne,
+    OP.LT: operator.lt,
+    OP.LE: operator.le,
+    OP.GT: operator.gt,
+    OP.GE: operator.ge,
+    OP.AND: operator.and_,
+    OP.OR: operator.or_,
+    OP.ADD: operator.add,
+}
+
+
+def kql(text):
+    """Translate compiled predicates to a pandas expression with the same
+    precedence: and binds more tightly than or."""
+    text = re.sub(r"datetime\(([^)]*)\)", r'"\1"', text)
+    return re.sub(
+        r"(\w+) (!?)between\((.+?) \.\. (.+?)\)",
+        lambda m: f"{'~' if m[2] else ''}(({m[1]} >= {m[3]}) & ({m[1]} <= {m[4]}))",
+        text,
+    )
+
+
+def value(expr, df):
+    if isinstance(expr, Column):
+        return df[expr.name]
+    if isinstance(expr, exp.Infix):
+        lhs = value(expr.lhs, df)
+        if expr.op == OP.IN:
+            return lhs.isin(value(expr.rhs, df))
+        return INFIX[expr.op](lhs, value(expr.rhs, df))
+    if isinstance(expr, exp.Prefix):
+        assert expr.op == OP.NOT
+        return ~value(expr.terms[0], df)
+    if isinstance(expr, exp.Between):
+        inside = value(expr.lhs, df).between(expr.left, expr.right)
+        return ~inside if expr.negate else inside
+    if isinstance(expr, exp.ListLit):
+        return list(expr.args)
+    return expr
+
+
+def join(op, left, right):
+    keys = op.on
+    if op.kind == "leftsemi":
+        return left[left[keys[0]].isin(right[keys[0]])]
+    if op.kind == "leftanti":
+        return left[~left[keys[0]].isin(right[keys[0]])]
+    if op.kind == "innerunique":
+        left = left.drop_duplicates(keys)
+    how = "left" if op.kind == "left" else "inner"
+    return left.merge(right, on=keys, how=how, suffixes=("", "1"))
+
+
+def where(predicate, df):
+    if isinstance(predicate, str):
+        return df.eval(kql(predicate), engine="python")
+    return value(predicate, df)
+
+
+def run(expr, optimized):
+    df = TABLES[expr.name]
+    ast = optimize(expr._ast) if optimized else expr._ast
+    for op in ast:
+        if isinstance(op, exp.Where) and optimized:
+            df = df[where(str(op)[len("| where ") :], df).astype(bool)]
+        elif isinstance(op, exp.Where):
+            for predicate in op.expressions:
+                df = df[where(predicate, df).astype(bool)]
+        elif isinstance(op, exp.Extend):
+            df = df.assign(**{k: value(v, df) for k, v in op.kwargs.items()})
+        elif isinstance(op, exp.Project):
+            columns = {str(col): df[str(col)] for col in op.columns}
+            columns.update({k: value(v, df) for k, v in op.renamed_columns.items()})
+            df = pd.DataFrame(columns)
+        elif isinstance(op, exp.Join):
+            df = join(op, df, run(op.right, optimized))
+        elif isinstance(op, exp.Count):
+            df = pd.DataFrame({"Count": [len(df)]})
+        elif isinstance(op, exp.Summarize):
+            aggs = {k: (str(v.terms[0]), v.op) for k, v in op.expressions.items()}
+            df = df.groupby([str(col) for col in op.by], as_index=False).agg(**aggs)
+        else:
+            raise NotImplementedError(op)
+    return df.sort_values(list(df.columns)).reset_index(drop=True)
+
+
+@pytest.fixture
+def tables():
+    db = FakeDatabase("test", "testdb")
+    tbl = TableExpr("tbl", db, columns={"ts": datetime, "foo": str, "bar": int, "baz": float})
+    other = TableExpr("other", db, columns={"foo": str, "qux": int, "bar": int})
+    return tbl, other
+
+
+def _extended(t, _):
+    e = t.extend(x=t.bar + t.bar)
+    return e.where(e.x > 2, e.foo == "a", (e.bar > 1) | (e.foo == "b"))
+
+
+def _renamed(t, _):
+    p = t.project("foo", "ts", b=t.bar, c=t.bar + t.bar)
+    return p.where(p.b > 1).where(p.c < 9, p.foo.isin("a", "b"))
+
+
+def _swapped(t, _):
+    p = t.project(bar=t.baz, baz=t.bar)
+    return p.where(p.bar > 0.0, p.baz < 4)
+
+
+def _joined(kind):
+    def build(t, o):
+        j = t.join(o, on="foo", kind=kind)
+        return j.where(t.foo != "c", t.bar > 1, t.baz > 0.0, Column("qux", int) > 10)
+
+    return build
+
+
+def _joined_left(kind):
+    def build(t, o):
+        return t.join(o, on="foo", kind=kind).where(t.foo != "c", t.bar > 1, ~(t.baz < 0.0))
+
+    return build
+
+
+def _summarized(t, _):
+    s = t.where(t.bar > 1).summarize(by="foo", n=t.bar.sum())
+    return s.where(s.n > 3, s.foo != "c")
+
+
+def _datetimes(t, _):
+    e = t.extend(y=t.baz)
+    return e.where(e.bar > 1, e.ts.between(datetime(2023, 1, 2), datetime(2023, 1, 4))).where(
+        e.ts < datetime(2023, 1, 4), e.y > 0
+    )
+
+
+def _pruned_summarize(t, _):
+    e = t.where(t.bar > 1).extend(x=t.baz + t.bar)
+    return e.where(e.foo != "c").summarize(by="foo", n=e.x.sum())
+
+
+CORPUS = {
+    "adjacent": lambda t, _: t.where(t.bar > 1).where(t.foo != "b").where(t.baz.nbetween(0, 1)),
+    "extended": _extended,
+    "renamed": _renamed,
+    "swapped": _swapped,
+    "inner": _joined("inner"),
+    "left": _joined("left"),
+    "innerunique": _joined("innerunique"),
+    "leftsemi": _joined_left("leftsemi"),
+    "leftanti": _joined_left("leftanti"),
+    "summarized": _summarized,
+    "datetimes": _datetimes,
+    "pruned_join": lambda t, o: t.join(o, on="foo", kind="inner").project("foo", "baz", "qux"),
+    "pruned_renamed": lambda t, o: t.join(o, on="foo", kind="left").project("ts", "bar1"),
+    "pruned_semi": lambda t, o: t.join(o.where(o.qux > 10), on="foo", kind="leftsemi"),
+    "pruned_summarize": _pruned_summarize,
+    "pruned_count": lambda t, _: t.where(t.bar > 1)
+    .extend(x=t.baz)
+    .where(Column("x", float) > 0)
+    .count(),
+    "renamed_right": lambda t, o: t.join(o, on="foo", kind="inner").where(
+        Column("bar1", int) > 8, t.bar > 1
+    ),
+    "literal_extend": lambda t, _: t.extend(label="hello", x=t.bar).project("label", "x"),
+    "or_merged": lambda t, _: t.where((t.bar == 1) | (t.foo == "b")).where(t.baz < 0.0),
+    "or_datetime": lambda t, _: t.where((t.bar == 1) | (t.foo == "b"), t.ts > datetime(2023, 1, 3)),
+    "strings_merged": lambda t, _: t.where("bar == 1 or foo == 'b'").where("baz < 0.0"),
+    "nested": lambda t, o: t.join(o.extend(z=o.qux).where(o.foo == "a"), on="foo", kind="inner"),
+}
+
+
+@pytest.mark.parametrize("name", sorted(CORPUS))
+def test_optimized_results_equal(tables, name):
+    expr = CORPUS[name](*tables)
+    expected = run(expr, optimized=False)
+    # Left joins filtered first may have no unmatched rows, so no nulls to widen ints.
+    pd.testing.assert_frame_equal(run(expr, optimized=True), expected, check_dtype=False)
+
+
+def test_optimize_doesnt_modify_expression(tables):
+    tbl, _ = tables
+    expr = tbl.where(tbl.bar > 1).where(tbl.foo == "a")
+    str(expr)
+    assert len(expr._ast) == 2
+    assert len(expr._ast[0].expressions) == 1
+
+
+def test_merge_adjacent_where(tables):
+    tbl, _ = tables
+    expr = tbl.where(tbl.bar > 1).where(tbl.foo == "a")
+    assert str(expr).endswith("['tbl']\n| where bar > 1 and foo == 'a'\n")
+
+
+def test_push_past_extend(tables):
+    tbl, _ = tables
+    e = tbl.extend(x=tbl.bar + tbl.bar)
+    expr = e.where(e.x > 2, e.foo == "a")
+    assert str(expr).endswith(
+        "['tbl']\n| where foo == 'a'\n| extend\n\tx=bar + bar\n| where x > 2\n"
+    )
+
+
+def test_push_past_rename(tables):
+    tbl, _ = tables
+    p = tbl.project("foo", b=tbl.bar)
+    expr = p.where(p.b > 1)
+    assert str(expr).endswith("['tbl']\n| where bar > 1\n| project\n\tfoo,\n\tb = bar\n")
+    # Compiling again gives the same query.
+    assert str(expr) == str(expr)
+
+
+def test_push_past_join(tables):
+    tbl, other = tables
+    expr = tbl.join(other, on="foo", kind="inner").where(tbl.baz > 0.0, tbl.bar > 1)
+    assert str(expr).endswith(
+        "['tbl']\n| where baz > 0.0 and bar > 1\n| join kind=inner (\n"
+        "\tcluster('test').database('testdb').['other']\n) on foo\n"
+    )
+    # The right side's bar is renamed bar1, so filters on it stay after the join.
+    expr = tbl.join(other, on="foo", kind="inner").where(Column("bar1", int) > 1)
+    assert str(expr).endswith(") on foo\n| where bar1 > 1\n")
+
+
+def test_string_predicates_stay(tables):
+    tbl, _ = tables
+    expr = tbl.extend(x=tbl.bar).where("x > 1")
+    assert str(expr).endswith("| extend\n\tx=bar\n| where x > 1\n")
+
+
+def test_datetime_predicates_first(tables):
+    tbl, _ = tables
+    expr = tbl.where(tbl.foo == "a", tbl.ts > datetime(2023, 1, 1))
+    assert str(expr).endswith("| where ts > datetime(2023-01-01T00:00:00) and foo == 'a'\n")
+    e = tbl.extend(y=tbl.baz)
+    expr = e.where(e.bar > 1).where(e.ts < datetime(2023, 1, 4))
+    assert "| where ts < datetime(2023-01-04T00:00:00) and bar > 1\n" in str(expr)
+
+
+def test_prune_source_columns(tables):
+    tbl, _ = tables
+    expr = tbl.where(tbl.bar > 1).extend(x=tbl.baz).summarize(by="foo", n=Column("x", float).sum())
+    assert str(expr).endswith(
+        "['tbl']\n| where bar > 1\n| project\n\tbaz,\n\tfoo\n| extend\n\tx=baz\n"
+        "| summarize\n\tn=sum(x)\n\tby foo\n"
+    )
+
+
+def test_prune_join_right_side(tables):
+    tbl, other = tables
+    expr = tbl.join(other, on="foo", kind="leftsemi")
+    assert str(expr).endswith(
+        "['tbl']\n| join kind=leftsemi (\n\tcluster('test').database('testdb').['other']\n"
+        "| project\n\tfoo\n) on foo\n"
+    )
+    expr = tbl.join(other, on="foo", kind="inner").project("foo", "ts", "qux")
+    assert str(expr) == (
+        "cluster('test').database('testdb').['tbl']\n| project\n\tfoo,\n\tts\n"
+        "| join kind=inner (\n\tcluster('test').database('testdb').['other']\n"
+        "| project\n\tfoo,\n\tqux\n) on foo\n| project\n\tfoo,\n\tts,\n\tqux\n"
+    )
+
+
+def test_no_pruning_without_restriction(tables):
+    tbl, other = tables
+    assert "project" not in str(tbl.where(tbl.bar > 1).extend(x=tbl.baz).take(5))
+    assert "project" not in str(tbl.join(other, on="foo", kind="inner").where(tbl.bar > 1))
+    expr = tbl.where(tbl.bar > 1).where("baz > 0").summarize(by="foo", n=tbl.bar.sum())
+    assert "project" not in str(expr)
+
+
+def test_prune_literal_extend(tables):
+    tbl, _ = tables
+    expr = tbl.extend(label="hello", x=tbl.bar).project("label", "x")
+    assert str(expr) == (
+        "cluster('test').database('testdb').['tbl']\n| project\n\tbar\n"
+        "| extend\n\tlabel='hello',\n\tx=bar\n| project\n\tlabel,\n\tx\n"
+    )
+
+
+def test_push_stops_at_barrier(tables, monkeypatch):
+    tbl, _ = tables
+    expr = tbl
+    for i in range(50):
+        expr = expr.extend(**{f"x{i}": tbl.bar})
+    expr = expr.limit(10).extend(y=tbl.bar).where(tbl.foo == "a")
+    calls = []
+    push_past = optimize_module._push_past
+
+    def counted(*args):
+        calls.append(args[0])
+        return push_past(*args)
+
+    monkeypatch.setattr(optimize_module, "_push_past", counted)
+    assert str(expr).endswith("| limit 10\n| where foo == 'a'\n| extend\n\ty=bar\n")
+    assert len(calls) == 1
+
+
+def test_merged_or_predicates_parenthesized(tables):
+    tbl, _ = tables
+    expr = tbl.where((tbl.bar == 1) | (tbl.foo == "b")).where(tbl.baz > 0.0)
+    assert str(expr).endswith("| where ((bar == 1) or (foo == 'b')) and baz > 0.0\n")
+    expr = tbl.where("bar == 1 or foo == 'b'").where("baz > 0.0")
+    assert str(expr).endswith("| where (bar == 1 or foo == 'b') and (baz > 0.0)\n")
+    expr = tbl.where((tbl.bar == 1) | (tbl.foo == "b"), tbl.ts > datetime(2023, 1, 1))
+    assert str(expr).endswith(
+        "| where ts > datetime(2023-01-01T00:00:00) and ((bar == 1) or (foo == 'b'))\n"
+    )
+    # A single predicate isn't wrapped.
+    assert str(tbl.where("bar == 1 or foo == 'b'")).endswith("| where bar == 1 or foo == 'b'\n")
@@ -0,0 +1,93 @@
+from datetime import timedelta
+
+from kusto_tool import QueryOptions
+from kusto_tool import database as kdb
+from kusto_tool.options import merge_options
+
+from .fake_database import (
+    FakeKustoClient,
+    FakeKustoResponseDataSet,
+    FakeKustoResultTable,
+    fake_table,
+)
+
+
+def test_merge_more_specific_wins():
+    cluster = QueryOptions(notruncation=True, server_timeout=timedelta(minutes=5))
+    call = QueryOptions(server_timeout=timedelta(minutes=1), client_request_id="abc")
+    merged = cluster.merge(call)
+    assert merged == QueryOptions(
+        notruncation=True, server_timeout=timedelta(minutes=1), client_request_id="abc"
+    )
+    assert cluster.merge(None) is cluster
+
+
+def test_merge_raw_options():
+    merged = QueryOptions(options={"a": 1, "b": 2}).merge(QueryOptions(options={"b": 3}))
+    assert merged.options == {"a": 1, "b": 3}
+
+
+def test_merge_options_skips_none():
+    assert merge_options(None, None) is None
+    options = QueryOptions(notruncation=True)
+    assert merge_options(None, options, None) is options
+
+
+def test_properties():
+    properties = QueryOptions(
+        results_cache_max_age=timedelta(days=1, minutes=5),
+        notruncation=True,
+        max_memory_per_iterator=2**30,
+        server_timeout=timedelta(minutes=10),
+        client_request_id="kt;123",
+        application="dashboards",
+        options={"query_language": "kql"},
+    ).properties()
+    assert properties.get_option("query_results_cache_max_age", None) == "1.00:05:00"
+    assert properties.get_option("notruncation", None) is True
+    assert properties.get_option("maxmemoryconsumptionperiterator", None) == 2**30
+    assert properties.get_option("servertimeout", None) == timedelta(minutes=10)
+    assert properties.get_option("query_language", None) == "kql"
+    assert properties.client_request_id == "kt;123"
+    assert properties.application == "dashboards"
+
+
+def test_options_levels():
+    client = FakeKustoClient(fake_table())
+    clus = kdb.cluster("test", options=QueryOptions(notruncation=True, application="a"))
+    db = clus.database("db", options=QueryOptions(application="b"))
+    db.client = client
+    tbl = db.table("tbl").with_options(QueryOptions(client_request_id="expr"))
+    tbl.collect(options=QueryOptions(server_timeout=timedelta(minutes=1)))
+    properties = client.properties[-1]
+    assert properties.get_option("notruncation", None) is True
+    assert properties.application == "b"
+    assert properties.client_request_id == "expr"
+    assert properties.get_option("servertimeout", None) == timedelta(minutes=1)
+    # Options set on an expression carry over to expressions built from it.
+    tbl.take(1).collect()
+    assert client.properties[-1].client_request_id == "expr"
+
+
+def test_no_options_sends_no_properties():
+    client = FakeKustoClient(fake_table())
+    db = kdb.KustoDatabase("test", "db", client=client)
+    db.execute("tbl")
+    list(db.execute_iter("tbl"))
+    assert client.properties == [None, None]
+
+
+def test_server_cache_hit():
+    extended = FakeKustoResultTable(
+        [("TableId", "int"), ("Key", "string"), ("Value", "dynamic")],
+        [[1, "ServerCache", {"OriginalStartedOn": "2023-01-01T00:00:00Z"}]],
+    )
+    extended.table_name = "@ExtendedProperties"
+    client = FakeKustoClient(fake_table())
+    events = []
+    db = kdb.KustoDatabase("test", "db", client=client, hooks=[events.append])
+    assert db.execute("tbl").attrs["server_cache_hit"] is False
+    client.response = FakeKustoResponseDataSet([fake_table(), extended])
+    df = db.execute("tbl", options=QueryOptions(results_cache_max_age=timedelta(hours=1)))
+    assert df.attrs["server_cache_hit"] is True
+    assert [event.server_cache_hit for event in events] == [False, True]
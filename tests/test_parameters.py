@@ -0,0 +1,136 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from kusto_tool import QueryOptions
+from kusto_tool import database as kdb
+from kusto_tool.cache import MemoryCache, cache_key
+from kusto_tool.expression import TableExpr
+from kusto_tool.parameters import collect, collecting, declare, parameter_value, split_parameters
+
+from .fake_database import FakeDatabase, client  # pylint: disable=unused-import
+
+PARAMETERIZE = QueryOptions(parameterize=True)
+
+
+def test_parameter_values():
+    assert parameter_value("it's") == "it's"
+    assert parameter_value(True) == "true"
+    assert parameter_value(3) == "3"
+    assert parameter_value(1.5) == "1.5"
+    assert parameter_value(datetime(2023, 1, 2, 3, tzinfo=timezone.utc)) == (
+        "datetime(2023-01-02T03:00:00)"
+    )
+    assert parameter_value(timedelta(minutes=5)) == "time(300.0s)"
+    assert parameter_value(["a", 1]) == 'dynamic(["a", 1])'
+
+
+def test_declare():
+    assert declare({"a": "x", "b": 1, "c": [1]}) == (
+        "declare query_parameters(a:string, b:long, c:dynamic);\n"
+    )
+
+
+def test_split_parameters():
+    rendered, parameters = split_parameters({"n": 1, "ids": {"a"}, "obj": object()})
+    assert rendered["n"] == "n" and rendered["ids"] == "ids"
+    assert parameters == {"n": 1, "ids": ["a"]}
+    rendered, parameters = split_parameters({"table": "T", "n": 1}, names={"n"})
+    assert rendered == {"table": "T", "n": "n"}
+    assert parameters == {"n": 1}
+
+
+def test_template_parameters(client):
+    db = kdb.KustoDatabase("c", "db", client=client, options=PARAMETERIZE)
+    db.execute("tbl | where foo == {{ name }} and bar in ({{ bars }})", name="x", bars=[1, 2])
+    assert client.queries == [
+        "declare query_parameters(name:string, bars:dynamic);\n"
+        "tbl | where foo == name and bar in (bars)"
+    ]
+    properties = client.properties[0]
+    assert properties.get_parameter("name", None) == "x"
+    assert properties.get_parameter("bars", None) == "dynamic([1, 2])"
+
+
+def test_template_parameterize_names(client):
+    db = kdb.KustoDatabase("c", "db", client=client)
+    options = QueryOptions(parameterize=["n"])
+    db.execute("{{ table }} | take {{ n }}", options=options, table="tbl", n=5)
+    assert client.queries == ["declare query_parameters(n:long);\ntbl | take n"]
+
+
+def test_explicit_parameters(client):
+    db = kdb.KustoDatabase("c", "db", client=client)
+    db.execute("tbl | take n", parameters={"n": 5})
+    assert client.queries == ["declare query_parameters(n:long);\ntbl | take n"]
+    assert client.properties[0].get_parameter("n", None) == "5"
+    with pytest.raises(ValueError):
+        db.execute(".show tables", parameters={"n": 5})
+
+
+def test_not_parameterized_by_default(client):
+    db = kdb.KustoDatabase("c", "db", client=client)
+    db.execute("tbl | take {{ n }}", n=5)
+    assert client.queries == ["tbl | take 5"]
+    assert client.properties == [None]
+
+
+def test_expression_parameters(client):
+    db = kdb.KustoDatabase("c", "db", client=client, options=PARAMETERIZE)
+    tbl = db.table("tbl", columns={"foo": str, "bar": int, "ts": datetime})
+    start = datetime(2023, 1, 1)
+    expr = tbl.where(
+        tbl.foo == "x",
+        tbl.bar.isin(1, 2),
+        tbl.ts.between(start, datetime(2023, 2, 1)),
+        tbl.bar > 1,
+    )
+    expr.collect()
+    assert client.queries == [
+        "declare query_parameters(_kt_p0:datetime, _kt_p1:datetime, _kt_p2:string, "
+        "_kt_p3:dynamic, _kt_p4:long);\n"
+        "cluster('c').database('db').['tbl']\n"
+        "| where ts between(_kt_p0 .. _kt_p1) and foo == _kt_p2 and bar in (_kt_p3) "
+        "and bar > _kt_p4"
+    ]
+    assert client.properties[0].get_parameter("_kt_p0", None) == "datetime(2023-01-01T00:00:00)"
+
+
+def test_expression_text_is_value_independent(client):
+    db = kdb.KustoDatabase("c", "db", client=client)
+    tbl = db.table("tbl", columns={"foo": str}).with_options(PARAMETERIZE)
+    tbl.where(tbl.foo == "x").collect()
+    tbl.where(tbl.foo == "y").collect()
+    assert client.queries[0] == client.queries[1]
+    assert client.properties[1].get_parameter("_kt_p0", None) == "y"
+
+
+def test_equal_values_share_parameter(client):
+    db = kdb.KustoDatabase("c", "db", client=client)
+    tbl = db.table("tbl", columns={"foo": str, "bar": str})
+    tbl.where(tbl.foo == "x", tbl.bar == "x").collect(options=PARAMETERIZE)
+    assert client.queries[0].startswith("declare query_parameters(_kt_p0:string);\n")
+    assert client.queries[0].endswith("| where foo == _kt_p0 and bar == _kt_p0")
+
+
+def test_values_of_other_types_dont_share_parameter():
+    with collecting() as parameters:
+        names = [collect(val) for val in [1, True, 1.0, [1, 1], [1, True], (1, 1), 1]]
+    assert names == ["_kt_p0", "_kt_p1", "_kt_p2", "_kt_p3", "_kt_p4", "_kt_p3", "_kt_p0"]
+    assert parameters["_kt_p4"] == [1, True]
+
+
+def test_compile_without_parameterize():
+    db = FakeDatabase("c", "db")
+    tbl = TableExpr("tbl", db, columns={"foo": str})
+    assert tbl.where(tbl.foo == "x").collect().endswith("| where foo == 'x'\n")
+
+
+def test_cache_key_includes_parameters(client):
+    assert cache_key("c", "db", "q", {"n": 1}) != cache_key("c", "db", "q", {"n": 2})
+    assert cache_key("c", "db", "q", {}) == cache_key("c", "db", "q")
+    db = kdb.KustoDatabase("c", "db", client=client, cache=MemoryCache(2**20))
+    db.execute("tbl | take n", parameters={"n": 1})
+    db.execute("tbl | take n", parameters={"n": 2})
+    db.execute("tbl | take n", parameters={"n": 1})
+    assert len(client.queries) == 2
@@ -0,0 +1,250 @@
+from datetime import datetime, timedelta, timezone
+from itertools import islice
+
+import pandas as pd
+from pytest import raises
+
+from kusto_tool import database as kdb
+from kusto_tool.expression import OP, Prefix, TableExpr, quote
+from kusto_tool.partition import concat_windows, iter_windows
+
+from .fake_database import FakeKustoClient, FakeKustoResultTable
+
+START = datetime(2023, 1, 1)
+
+
+def frame(lower, upper):
+    return pd.DataFrame({"start": [lower], "end": [upper]})
+
+
+def test_quote_datetime():
+    assert quote(datetime(2023, 1, 2, 3, 4, 5)) == "datetime(2023-01-02T03:04:05)"
+    aware = datetime(2023, 1, 2, 3, tzinfo=timezone(timedelta(hours=1)))
+    assert quote(aware) == "datetime(2023-01-02T02:00:00)"
+
+
+def test_between_datetime():
+    tbl = TableExpr("tbl", None, columns={"ts": datetime})
+    pred = tbl.ts.between(START, START + timedelta(days=1))
+    assert str(pred) == "ts between(datetime(2023-01-01T00:00:00) .. datetime(2023-01-02T00:00:00))"
+
+
+def test_iter_windows_covers_range():
+    end = START + timedelta(days=3, hours=12)
+    windows = list(iter_windows(frame, START, end, window=timedelta(days=1)))
+    bounds = sorted((lower, upper) for lower, upper, _ in windows)
+    assert bounds[0][0] == START
+    assert bounds[-1][1] == end
+    assert all(prev[1] == nxt[0] for prev, nxt in zip(bounds, bounds[1:]))
+    assert len(bounds) == 4
+
+
+def test_iter_windows_splits_large_results():
+    def run(lower, upper):
+        if upper - lower > timedelta(hours=6):
+            raise RuntimeError(
+                "Query result set has exceeded the internal record count limit. "
+                "(E_QUERY_RESULT_SET_TOO_LARGE)"
+            )
+        return frame(lower, upper)
+
+    result = concat_windows(iter_windows(run, START, START + timedelta(days=2), max_workers=2))
+    assert (result.end - result.start).max() <= timedelta(hours=6)
+    assert result.start.min() == START
+    assert result.end.max() == START + timedelta(days=2)
+    assert (result.end.iloc[:-1].to_numpy() == result.start.iloc[1:].to_numpy()).all()
+
+
+def test_iter_windows_raises_other_errors():
+    def run(lower, upper):
+        raise RuntimeError("Semantic error")
+
+    with raises(RuntimeError):
+        list(iter_windows(run, START, START + timedelta(days=2)))
+
+
+def test_iter_windows_raises_at_min_window():
+    def run(lower, upper):
+        raise RuntimeError("E_QUERY_RESULT_SET_TOO_LARGE")
+
+    with raises(RuntimeError):
+        list(iter_windows(run, START, START + timedelta(hours=1), min_window=timedelta(minutes=15)))
+
+
+def test_iter_windows_shrinks_after_slow_window():
+    def run(lower, upper):
+        return frame(lower, upper)
+
+    windows = iter_windows(run, START, START + timedelta(days=4), max_workers=1, target_seconds=-1)
+    sizes = [upper - lower for lower, upper, _ in islice(windows, 3)]
+    windows.close()
+    assert sizes == [timedelta(days=1), timedelta(hours=12), timedelta(hours=6)]
+
+
+def test_collect_windowed():
+    client = FakeKustoClient(FakeKustoResultTable([("foo", "long")], [[1]]))
+    db = kdb.KustoDatabase("test", "db", client=client)
+    tbl = db.table("tbl", columns={"ts": datetime, "foo": int})
+    result = tbl.collect_windowed("ts", START, START + timedelta(days=2))
+    assert result.foo.tolist() == [1, 1]
+    assert sorted(client.queries) == [
+        "cluster('test').database('db').['tbl']\n| where (ts >= datetime(2023-01-01T00:00:00)) "
+        "and (ts < datetime(2023-01-02T00:00:00))",
+        "cluster('test').database('db').['tbl']\n| where (ts >= datetime(2023-01-02T00:00:00)) "
+        "and (ts < datetime(2023-01-03T00:00:00))",
+    ]
+
+
+def test_execute_windowed():
+    client = FakeKustoClient(FakeKustoResultTable([("foo", "long")], [[1]]))
+    db = kdb.KustoDatabase("test", "db", client=client)
+    query = "tbl | where ts >= {{ start }} and ts < {{ end }} | where foo == {{ foo }}"
+    result = db.execute_windowed(query, START, START + timedelta(hours=12), foo=2)
+    assert len(result) == 1
+    assert client.queries == [
+        "tbl | where ts >= datetime(2023-01-01T00:00:00) "
+        "and ts < datetime(2023-01-01T12:00:00) | where foo == 2"
+    ]
+
+
+def test_partitions_filter_source():
+    db = kdb.KustoDatabase("test", "db", offline=True)
+    left = db.table("tbl", columns={"foo": str, "bar": int})
+    right = db.table("tbl2", columns={"foo": str})
+    expr = left.join(right, on="foo", kind="inner").summarize(by="foo", n=left.bar.sum())
+    parts = expr.partitions("foo", 3)
+    assert len(parts) == 3
+    assert str(parts[2]).startswith(
+        "cluster('test').database('db').['tbl']\n| where hash(foo, 3) == 2\n"
+        "| project\n\tbar,\n\tfoo\n| join kind=inner"
+    )
+    assert str(expr) == str(parts[2]).replace("| where hash(foo, 3) == 2\n", "")
+
+
+def test_collect_partitioned():
+    client = FakeKustoClient(FakeKustoResultTable([("foo", "long")], [[1], [2]]))
+    db = kdb.KustoDatabase("test", "db", client=client)
+    tbl = db.table("tbl", columns={"foo": int})
+    result = tbl.take(10).collect_partitioned(tbl.foo, 2)
+    assert result.foo.tolist() == [1, 2, 1, 2]
+    assert sorted(client.queries) == [
+        f"cluster('test').database('db').['tbl']\n| where hash(foo, 2) == {i}\n| limit 10"
+        for i in range(2)
+    ]
+
+
+def test_collect_partitioned_raises():
+    db = kdb.KustoDatabase("test", "db", offline=True)
+    with raises(RuntimeError):
+        db.table("tbl").collect_partitioned("foo", 2)
+
+
+def test_collect_partitioned_merges_summarize():
+    partial = FakeKustoResultTable(
+        [("bar", "string"), ("_mean_sum", "long"), ("_mean_count", "long")],
+        [["a", 3, 2], ["b", 4, 1]],
+    )
+    client = FakeKustoClient(partial)
+    db = kdb.KustoDatabase("test", "db", client=client)
+    tbl = db.table("tbl", columns={"foo": int, "bar": str})
+    result = tbl.summarize(by="bar", mean=tbl.foo.avg()).collect_partitioned("foo", 2)
+    assert result.to_dict("list") == {"bar": ["a", "b"], "mean": [1.5, 4.0]}
+    assert client.queries[0].endswith(
+        "| summarize\n\t_mean_sum=sum(foo),\n\t_mean_count=countif(isnotnull(foo))\n\tby bar"
+    )
+
+
+def test_collect_windowed_merges_summarize():
+    partial = FakeKustoResultTable([("n", "long")], [[2]])
+    client = FakeKustoClient(partial)
+    db = kdb.KustoDatabase("test", "db", client=client)
+    tbl = db.table("tbl", columns={"ts": datetime, "foo": int})
+    expr = tbl.summarize(n=Prefix(OP.COUNT, agg=True))
+    result = expr.collect_windowed("ts", START, START + timedelta(days=3))
+    assert result.to_dict("list") == {"n": [6]}
+    assert (
+        "| where (ts >= datetime(2023-01-01T00:00:00)) and (ts < datetime(2023-01-02T00:00:00))\n"
+        "| summarize\n\tn=count()"
+    ) in sorted(client.queries)[0]
+
+
+def partitioned_db(columns, rows):
+    client = FakeKustoClient(FakeKustoResultTable(columns, rows))
+    db = kdb.KustoDatabase("test", "db", client=client)
+    return db.table("tbl", columns={"foo": int, "bar": str}), client
+
+
+def test_collect_partitioned_sums_count():
+    tbl, client = partitioned_db([("Count", "long")], [[3]])
+    result = tbl.where(tbl.foo > 1).count().collect_partitioned("foo", 4)
+    assert result.to_dict("list") == {"Count": [12]}
+    assert client.queries[0].endswith(" and foo > 1\n| count")
+
+
+def test_collect_partitioned_applies_top():
+    tbl, client = partitioned_db([("foo", "long")], [[1], [3], [2]])
+    result = tbl.order(tbl.foo).limit(2).collect_partitioned("foo", 2)
+    assert result.foo.tolist() == [3, 3]
+    assert client.queries[0].endswith("| top 2 by\n\tfoo")
+    result = tbl.top(3, tbl.foo.asc()).collect_partitioned("foo", 2)
+    assert result.foo.tolist() == [1, 1, 2]
+    result = tbl.sort("foo").collect_partitioned("foo", 2)
+    assert result.foo.tolist() == [3, 3, 2, 2, 1, 1]
+
+
+def test_collect_partitioned_applies_distinct():
+    tbl, _ = partitioned_db([("foo", "long")], [[1], [2]])
+    result = tbl.distinct("foo").collect_partitioned("foo", 3)
+    assert result.foo.tolist() == [1, 2]
+
+
+def test_collect_partitioned_raises_when_not_mergeable():
+    tbl, client = partitioned_db([("foo", "long")], [[1]])
+    other = tbl.database.table("other", columns={"foo": int})
+    exprs = [
+        tbl.summarize(by="bar", n=tbl.foo.sum()).where("n > 1"),
+        tbl.distinct("foo").limit(5),
+        tbl.sample(10),
+        tbl.count().extend(x=1),
+        tbl.join(other, on="foo", kind="rightouter"),
+        tbl.join(other, on="foo", kind="fullouter"),
+        tbl.join(other, on="foo", kind="rightanti"),
+        tbl.join(other, on="bar", kind="innerunique"),
+    ]
+    for expr in exprs:
+        with raises(ValueError):
+            expr.collect_partitioned("foo", 2)
+    assert not client.queries
+    result = tbl.join(other, on="foo", kind="innerunique").collect_partitioned("foo", 2)
+    assert len(result) == 2
+
+
+def test_collect_windowed_filters_source():
+    client = FakeKustoClient(FakeKustoResultTable([("foo", "long")], [[1], [2], [3]]))
+    db = kdb.KustoDatabase("test", "db", client=client)
+    tbl = db.table("tbl", columns={"ts": datetime, "foo": int})
+    result = tbl.take(4).collect_windowed("ts", START, START + timedelta(days=2))
+    assert result.foo.tolist() == [1, 2, 3, 1]
+    assert all(
+        query.startswith("cluster('test').database('db').['tbl']\n| where (ts >= ")
+        and query.endswith("\n| limit 4")
+        for query in client.queries
+    )
+
+
+def test_collect_windowed_sums_count():
+    client = FakeKustoClient(FakeKustoResultTable([("Count", "long")], [[5]]))
+    db = kdb.KustoDatabase("test", "db", client=client)
+    tbl = db.table("tbl", columns={"ts": datetime, "foo": int})
+    result = tbl.project("foo").count().collect_windowed("ts", START, START + timedelta(days=3))
+    assert result.to_dict("list") == {"Count": [15]}
+    assert all(query.endswith("| project\n\tfoo\n| count") for query in client.queries)
+
+
+def test_collect_windowed_raises_when_not_mergeable():
+    client = FakeKustoClient(FakeKustoResultTable([("foo", "long")], [[1]]))
+    db = kdb.KustoDatabase("test", "db", client=client)
+    tbl = db.table("tbl", columns={"ts": datetime, "foo": int})
+    with raises(ValueError):
+        tbl.sample(10).collect_windowed("ts", START, START + timedelta(days=2))
+    assert not client.queries